@@ -0,0 +1,72 @@
+import time
+import uuid
+import logging
+
+from starlette.datastructures import MutableHeaders
+
+from app.config import SLOW_REQUEST_SECONDS
+from app.services.metrics import (
+    HTTP_REQUEST_SECONDS,
+    ERRORS_TOTAL,
+    start_request_timings,
+    reset_request_timings,
+    format_server_timing
+)
+
+logger = logging.getLogger(__name__)
+
+class RequestMetricsMiddleware:
+    """
+    请求级指标（纯ASGI实现，不缓冲SSE流式响应）：
+    - 为每个请求分配请求ID（沿用客户端传入的X-Request-ID），写入响应头
+    - 响应头Server-Timing给出响应开始前各阶段的耗时
+    - 记录请求总耗时，超过阈值时输出带请求ID和阶段明细的慢请求日志
+    """
+    def __init__(self, app, slow_request_seconds: float = SLOW_REQUEST_SECONDS):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for key, value in scope.get("headers", []):
+            if key == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+        scope.setdefault("state", {})["request_id"] = request_id
+
+        timings, token = start_request_timings()
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_headers(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Request-ID", request_id)
+                headers.append("Server-Timing", format_server_timing(timings, time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            elapsed = time.perf_counter() - start
+            reset_request_timings(token)
+
+            # 使用路由模板而非实际路径作为标签，避免标签数量无限增长
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route, status=str(status_code))
+            if status_code >= 500:
+                ERRORS_TOTAL.inc(kind="http_5xx")
+
+            if elapsed >= self.slow_request_seconds:
+                stages = ", ".join(f"{stage}={seconds:.3f}s" for stage, seconds in timings.items())
+                logger.warning(
+                    f"慢请求 [{request_id}] {scope['method']} {scope['path']} -> {status_code} "
+                    f"耗时 {elapsed:.3f}s（{stages or '无阶段记录'}）"
+                )
@@ -1,19 +1,72 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks, Request, Response, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List, Optional
+from typing import List, Optional, Tuple, TYPE_CHECKING
 import json
-import os
+import gzip
+import hashlib
 from datetime import datetime
 
-from app.models.database import Project, Document, DocumentVersion, ChatSession, Message, Setting
-from app.models.database_manager import get_db
-from app.services.word_processor import WordProcessor
-from app.services.document_processor import DocumentProcessor
-from app.services.llm_service import LLMService
-from app.config import DOCS_STORAGE_PATH
+from app.models.database import (
+    Project, DocumentVersion, ChatSession, Message, IngestionJob, DocumentBlock
+)
+from app.models.database_manager import get_db, AsyncSessionLocal
+from app.models.repository import Repository, Page, InvalidCursor, get_repository
+from app.services.job_queue import job_to_dict
+from app.services.uploads import (
+    UploadError, ChunkedUploadStore, get_upload_store, is_document, save_stream, iter_upload_file,
+    register_upload, extract_documents, remove_quietly
+)
+from app.services.llm_service import LLMService, LLMError, LLMBusy
+from app.services.llm_scheduler import LLMScheduler
+from app.services.registry import (
+    ServiceRegistry, get_registry, get_document_processor, get_llm_client, get_llm_scheduler, get_answer_cache,
+    get_context_packer, get_storage_reclaimer
+)
+from app.services.storage_reclaimer import StorageReclaimer
+from app.services.answer_cache import AnswerCache
+from app.services.context_packer import ContextPacker
+from app.services.tables import match_cell_answer, cell_context_blocks
+from app.services.version_diff import match_blocks, replaced_html_ids, build_changes
+from app.services.lexical_index import looks_like_identifier
+from app.services.metrics import REGISTRY, INGEST_STAGES, span, format_metric
+from app.config import (
+    BULK_UPLOAD_MAX_BYTES, RETRIEVAL_TOP_K, PAGE_SIZE, MAX_PAGE_SIZE, PREVIEW_PAGE_SIZE, PREVIEW_MAX_PAGE_SIZE,
+    CELL_LOOKUP_ENABLED, CELL_LOOKUP_MIN_CHARS
+)
+
+if TYPE_CHECKING:
+    # 仅用于类型标注：文档处理器由ServiceRegistry在后台加载模型时导入
+    from app.services.document_processor import DocumentProcessor
 
 router = APIRouter()
 
+async def _paginate(fetch, *args, before: Optional[str], after: Optional[str], limit: int) -> Page:
+    """执行键集分页查询，游标参数有误时返回400"""
+    if before and after:
+        raise HTTPException(status_code=400, detail="before和after不能同时指定")
+    try:
+        return await fetch(*args, limit=limit, before=before, after=after)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _json_response(request: Request, body: bytes, headers: dict) -> Response:
+    """返回已序列化的JSON，较大的响应在客户端支持时使用gzip压缩"""
+    if len(body) > 1024 and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    headers["Vary"] = "Accept-Encoding"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# 健康检查
+@router.get("/health/ready")
+async def readiness(registry: ServiceRegistry = Depends(get_registry)):
+    """就绪检查：嵌入模型加载完成后返回200"""
+    status = registry.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 # 项目相关路由
 @router.post("/projects/")
 async def create_project(
@@ -35,137 +88,200 @@ async def create_project(
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/projects/")
-async def list_projects(db: AsyncSession = Depends(get_db)):
+async def list_projects(repo: Repository = Depends(get_repository)):
     """获取项目列表"""
-    result = await db.execute(
-        "SELECT * FROM projects ORDER BY creation_time DESC"
-    )
-    projects = result.fetchall()
-    return {"projects": projects}
+    return {"projects": await repo.list_projects()}
 
 # 文档相关路由
+def _upload_error(e: UploadError) -> HTTPException:
+    """断点续传的409响应在Upload-Offset头中带上服务端已收到的字节数"""
+    headers = {"Upload-Offset": str(e.offset)} if e.offset is not None else None
+    return HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
+
+async def _require_project(db: AsyncSession, project_id: str):
+    project = await db.get(Project, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="项目不存在")
+
+async def _register_and_commit(
+    db: AsyncSession,
+    repo: Repository,
+    project_id: str,
+    documents: List[dict]
+) -> List[dict]:
+    """把已写入临时文件的文档在同一事务中登记为新版本并创建入库任务，失败时删除尚未移走的临时文件"""
+    try:
+        results = []
+        for document in documents:
+            results.append(await register_upload(
+                db, repo, project_id, document["filename"], document["path"], document["content_hash"]
+            ))
+        await db.commit()
+        return results
+    except BaseException:
+        await db.rollback()
+        for document in documents:
+            remove_quietly(document["path"])
+        raise
+
 @router.post("/documents/upload/")
 async def upload_document(
-    background_tasks: BackgroundTasks,
     project_id: str,
     file: UploadFile = File(...),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    repo: Repository = Depends(get_repository)
 ):
-    """上传文档"""
-    if not file.filename.endswith('.docx'):
+    """上传文档：分块写入磁盘并计算SHA-256，同一文档的内容与已有版本相同时返回该版本，不重新入库"""
+    if not is_document(file.filename):
         raise HTTPException(status_code=400, detail="只支持.docx格式文件")
-        
-    # 检查项目是否存在
-    project = await db.get(Project, project_id)
-    if not project:
-        raise HTTPException(status_code=404, detail="项目不存在")
-        
-    # 检查是否是新文档或新版本
-    result = await db.execute(
-        "SELECT * FROM documents WHERE project_id = :project_id AND original_filename = :filename",
-        {"project_id": project_id, "filename": file.filename}
-    )
-    existing_doc = result.first()
-    
-    if existing_doc:
-        # 新版本
-        doc_base_id = existing_doc.doc_base_id
-        result = await db.execute(
-            "SELECT MAX(version_number) FROM document_versions WHERE doc_base_id = :doc_base_id",
-            {"doc_base_id": doc_base_id}
-        )
-        max_version = result.scalar() or 0
-        version_number = max_version + 1
-        
-        # 更新之前版本的is_latest状态
-        await db.execute(
-            "UPDATE document_versions SET is_latest = FALSE WHERE doc_base_id = :doc_base_id",
-            {"doc_base_id": doc_base_id}
-        )
-    else:
-        # 新文档
-        doc = Document(
-            project_id=project_id,
-            original_filename=file.filename
-        )
-        db.add(doc)
-        await db.flush()
-        doc_base_id = doc.doc_base_id
-        version_number = 1
-        
-    # 保存文件
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    stored_filename = f"{doc_base_id}_v{version_number}_{timestamp}.docx"
-    stored_filepath = os.path.join(DOCS_STORAGE_PATH, stored_filename)
-    
-    with open(stored_filepath, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
-        
-    # 创建版本记录
-    version = DocumentVersion(
-        doc_base_id=doc_base_id,
-        version_number=version_number,
-        stored_filename=stored_filename,
-        stored_filepath=stored_filepath,
-        status="processing",
-        is_latest=True
-    )
-    db.add(version)
-    await db.flush()
-    version_id = version.version_id
-    
-    # 在后台处理文档
-    background_tasks.add_task(
-        process_document_background,
-        stored_filepath,
-        version_id,
-        doc_base_id,
-        project_id
+    await _require_project(db, project_id)
+
+    try:
+        path, _, content_hash = await save_stream(iter_upload_file(file))
+    except UploadError as e:
+        raise _upload_error(e)
+    results = await _register_and_commit(
+        db, repo, project_id, [{"filename": file.filename, "path": path, "content_hash": content_hash}]
     )
-    
-    await db.commit()
-    
+    return results[0]
+
+@router.post("/documents/upload/zip/")
+async def upload_documents_zip(
+    project_id: str,
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db),
+    repo: Repository = Depends(get_repository)
+):
+    """批量上传：zip中的全部.docx在同一事务中登记并创建入库任务，内容未变化的文档不重新入库"""
+    if not (file.filename or "").lower().endswith(".zip"):
+        raise HTTPException(status_code=400, detail="只支持.zip格式文件")
+    await _require_project(db, project_id)
+
+    try:
+        zip_path, _, _ = await save_stream(iter_upload_file(file), max_bytes=BULK_UPLOAD_MAX_BYTES)
+        try:
+            documents, skipped = await run_in_threadpool(extract_documents, zip_path)
+        finally:
+            remove_quietly(zip_path)
+    except UploadError as e:
+        raise _upload_error(e)
+    if not documents:
+        raise HTTPException(status_code=400, detail="zip中没有可上传的.docx文档")
+
+    results = await _register_and_commit(db, repo, project_id, documents)
+    queued = sum(1 for result in results if not result["duplicate"])
     return {
-        "message": "文档上传成功，正在处理",
-        "version_id": version_id,
-        "version_number": version_number
+        "message": f"已上传 {len(results)} 个文档，其中 {queued} 个正在处理",
+        "documents": results,
+        "skipped": skipped
     }
 
-@router.get("/documents/{project_id}")
-async def list_documents(project_id: str, db: AsyncSession = Depends(get_db)):
-    """获取项目下的文档列表"""
-    result = await db.execute(
-        """
-        SELECT d.*, v.version_number, v.status, v.is_latest, v.version_id
-        FROM documents d
-        LEFT JOIN document_versions v ON d.doc_base_id = v.doc_base_id
-        WHERE d.project_id = :project_id AND (v.is_latest = TRUE OR v.is_latest IS NULL)
-        ORDER BY d.creation_time DESC
-        """,
-        {"project_id": project_id}
+# 断点续传：创建上传 -> 按offset顺序PUT数据块（中断后GET查询offset继续）-> complete登记为新版本
+@router.post("/uploads/", status_code=201)
+async def create_upload(
+    project_id: str,
+    filename: str,
+    size: int,
+    sha256: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    store: ChunkedUploadStore = Depends(get_upload_store)
+):
+    """创建断点续传的上传，返回upload_id和建议的数据块大小"""
+    if not is_document(filename):
+        raise HTTPException(status_code=400, detail="只支持.docx格式文件")
+    await _require_project(db, project_id)
+    try:
+        return await run_in_threadpool(store.create, project_id, filename, size, sha256)
+    except UploadError as e:
+        raise _upload_error(e)
+
+@router.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str, store: ChunkedUploadStore = Depends(get_upload_store)):
+    """查询上传已收到的字节数（offset），连接中断后从该位置续传"""
+    try:
+        return store.status(upload_id)
+    except UploadError as e:
+        raise _upload_error(e)
+
+@router.put("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    store: ChunkedUploadStore = Depends(get_upload_store)
+):
+    """从offset处追加请求体中的数据（application/octet-stream），offset与服务端不一致时返回409"""
+    try:
+        return await store.append(upload_id, offset, request.stream())
+    except UploadError as e:
+        raise _upload_error(e)
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(
+    upload_id: str,
+    db: AsyncSession = Depends(get_db),
+    repo: Repository = Depends(get_repository),
+    store: ChunkedUploadStore = Depends(get_upload_store)
+):
+    """数据收齐后校验大小和哈希，登记为文档的新版本（内容未变化时返回已有版本）"""
+    try:
+        meta, path, content_hash = await store.complete(upload_id)
+    except UploadError as e:
+        raise _upload_error(e)
+    results = await _register_and_commit(
+        db, repo, meta["project_id"], [{"filename": meta["filename"], "path": path, "content_hash": content_hash}]
     )
-    documents = result.fetchall()
-    return {"documents": documents}
+    return results[0]
+
+@router.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str, store: ChunkedUploadStore = Depends(get_upload_store)):
+    """放弃上传并删除已收到的数据"""
+    try:
+        store.discard(upload_id)
+    except UploadError as e:
+        raise _upload_error(e)
+    return {"message": "上传已取消"}
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    """获取入库任务的当前阶段和进度"""
+    job = await db.get(IngestionJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job_to_dict(job)
+
+@router.get("/documents/{project_id}")
+async def list_documents(
+    project_id: str,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    repo: Repository = Depends(get_repository)
+):
+    """获取项目下的文档列表（从新到旧，按游标分页）"""
+    page = await _paginate(repo.list_documents, project_id, before=before, after=after, limit=limit)
+    return {"documents": page.items, "page": page.cursors()}
 
 @router.get("/documents/{doc_base_id}/versions")
-async def list_versions(doc_base_id: int, db: AsyncSession = Depends(get_db)):
-    """获取文档的版本列表"""
-    result = await db.execute(
-        """
-        SELECT *
-        FROM document_versions
-        WHERE doc_base_id = :doc_base_id AND is_deleted = FALSE
-        ORDER BY version_number DESC
-        """,
-        {"doc_base_id": doc_base_id}
-    )
-    versions = result.fetchall()
-    return {"versions": versions}
+async def list_versions(
+    doc_base_id: int,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    repo: Repository = Depends(get_repository)
+):
+    """获取文档的版本列表（从新到旧，按游标分页）"""
+    page = await _paginate(repo.list_versions, doc_base_id, before=before, after=after, limit=limit)
+    return {"versions": page.items, "page": page.cursors()}
 
 @router.delete("/versions/{version_id}")
-async def soft_delete_version(version_id: int, db: AsyncSession = Depends(get_db)):
-    """软删除文档版本"""
+async def soft_delete_version(
+    version_id: int,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+    registry: ServiceRegistry = Depends(get_registry)
+):
+    """软删除文档版本，并在后台将向量库中该版本的记录标记为已删除"""
     version = await db.get(DocumentVersion, version_id)
     if not version:
         raise HTTPException(status_code=404, detail="版本不存在")
@@ -173,147 +289,537 @@ async def soft_delete_version(version_id: int, db: AsyncSession = Depends(get_db
     if version.is_latest:
         raise HTTPException(status_code=400, detail="不能删除最新版本")
         
+    # 重复删除不改变删除时间，保留期从首次删除开始计算
+    if not version.is_deleted:
+        version.deleted_at = datetime.utcnow()
     version.is_deleted = True
     await db.commit()
+    if registry.is_ready:
+        background_tasks.add_task(registry.document_processor.mark_version_deleted, version_id)
     return {"message": "版本已删除"}
 
+@router.get("/versions/{version_id}/preview")
+async def get_version_preview(
+    version_id: int,
+    request: Request,
+    start: int = 0,
+    limit: int = PREVIEW_PAGE_SIZE,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    获取版本预览：按sequence_in_doc顺序返回入库时预渲染的HTML片段
+    以sequence_in_doc范围分页（start起，最多limit个块），支持ETag和gzip
+    """
+    limit = max(1, min(limit, PREVIEW_MAX_PAGE_SIZE))
+    version = await db.get(DocumentVersion, version_id)
+    if not version:
+        raise HTTPException(status_code=404, detail="文档版本不存在")
+        
+    # 重新入库会重建所有块，块数量和最大block_id共同标识内容版本
+    total, revision = (await db.execute(
+        select(func.count(DocumentBlock.block_id), func.max(DocumentBlock.block_id))
+        .where(DocumentBlock.version_id == version_id)
+    )).one()
+    etag = f'W/"{version_id}-{revision or 0}-{total}-{start}-{limit}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+        
+    rows = (await db.execute(
+        select(DocumentBlock.html_id, DocumentBlock.block_type, DocumentBlock.sequence_in_doc, DocumentBlock.html)
+        .where(DocumentBlock.version_id == version_id, DocumentBlock.sequence_in_doc >= start)
+        .order_by(DocumentBlock.sequence_in_doc)
+        .limit(limit + 1)
+    )).all()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    payload = {
+        "version_id": version_id,
+        "status": version.status,
+        "total": total,
+        "blocks": [
+            {
+                "html_id": row.html_id,
+                "block_type": row.block_type,
+                "sequence_in_doc": row.sequence_in_doc,
+                "html": row.html
+            }
+            for row in rows
+        ],
+        "next_start": rows[-1].sequence_in_doc + 1 if has_more else None
+    }
+    
+    return _json_response(request, json.dumps(payload, ensure_ascii=False).encode("utf-8"), headers)
+
+@router.get("/documents/{doc_base_id}/diff")
+async def diff_versions(
+    doc_base_id: int,
+    request: Request,
+    old_version_id: int,
+    new_version_id: int,
+    db: AsyncSession = Depends(get_db),
+    repo: Repository = Depends(get_repository)
+):
+    """
+    对比同一文档的两个版本：按入库时保存的块指纹做序列差异，只对修改过的块读取正文做文本对比
+    结果按版本对缓存，任一版本重新入库时失效；不读取原始.docx文件
+    """
+    for version_id in (old_version_id, new_version_id):
+        version = await db.get(DocumentVersion, version_id)
+        if not version or version.doc_base_id != doc_base_id:
+            raise HTTPException(status_code=404, detail=f"文档版本不存在: {version_id}")
+        if version.status != "ready":
+            raise HTTPException(status_code=409, detail=f"版本 {version_id} 尚未处理完成")
+            
+    cached = await repo.get_version_diff(old_version_id, new_version_id)
+    if cached:
+        body = cached.result.encode("utf-8")
+    else:
+        with span("version_diff"):
+            old_blocks = await repo.block_fingerprints(old_version_id)
+            new_blocks = await repo.block_fingerprints(new_version_id)
+            opcodes = await run_in_threadpool(match_blocks, old_blocks, new_blocks)
+            old_ids, new_ids = replaced_html_ids(old_blocks, new_blocks, opcodes)
+            old_contents = await repo.block_contents(old_version_id, old_ids)
+            new_contents = await repo.block_contents(new_version_id, new_ids)
+            result = await run_in_threadpool(
+                build_changes, old_blocks, new_blocks, opcodes, old_contents, new_contents
+            )
+        payload = json.dumps({
+            "doc_base_id": doc_base_id,
+            "old_version_id": old_version_id,
+            "new_version_id": new_version_id,
+            **result
+        }, ensure_ascii=False)
+        await repo.save_version_diff(old_version_id, new_version_id, payload)
+        await db.commit()
+        body = payload.encode("utf-8")
+        
+    etag = f'W/"{hashlib.sha1(body).hexdigest()[:16]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return _json_response(request, body, headers)
+
+@router.get("/versions/{version_id}/cells")
+async def get_table_cells(
+    version_id: int,
+    row: Optional[str] = None,
+    column: Optional[str] = None,
+    table: Optional[int] = Query(None, description="表格的sequence_in_doc"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
+    repo: Repository = Depends(get_repository)
+):
+    """按行名（第一列的值）和列名（表头）查询表格单元格，例如 ?row=产品A&column=单价"""
+    version = await db.get(DocumentVersion, version_id)
+    if not version:
+        raise HTTPException(status_code=404, detail="文档版本不存在")
+    return {"cells": await repo.find_cells(version_id, row, column, table, limit)}
+
 # 问答相关路由
 @router.post("/chat/sessions/")
-async def create_chat_session(version_id: int, db: AsyncSession = Depends(get_db)):
+async def create_chat_session(
+    version_id: int,
+    background_tasks: BackgroundTasks,
+    prewarm: bool = True,
+    db: AsyncSession = Depends(get_db),
+    registry: ServiceRegistry = Depends(get_registry)
+):
     """创建新的聊天会话"""
     version = await db.get(DocumentVersion, version_id)
     if not version:
         raise HTTPException(status_code=404, detail="文档版本不存在")
+    if version.purged_at:
+        raise HTTPException(status_code=410, detail="版本已删除且内容已清理")
         
     session = ChatSession(version_id=version_id)
     db.add(session)
     await db.commit()
+    
+    # 用户刚打开该版本，提前打开其检索器，首个问题无需再等待
+    if prewarm and registry.is_ready:
+        background_tasks.add_task(registry.document_processor.prewarm, version_id)
+        
     return {"session_id": session.session_id}
 
+async def _get_api_key(repo: Repository) -> str:
+    """读取LLM API Key，未配置时返回400"""
+    api_key = await repo.get_setting("llm_api_key")
+    if not api_key:
+        raise HTTPException(status_code=400, detail="未配置API Key")
+    return api_key
+
+async def _lookup_cell(repo: Repository, version_id: int, query: str) -> Tuple[Optional[dict], List[dict]]:
+    """
+    单元格直查：问题只是查询某行某列的值时直接返回单元格的值
+    返回 (直查结果或None, 未直查时作为优先上下文的单元格块)
+    """
+    if not CELL_LOOKUP_ENABLED:
+        return None, []
+    with span("cell_lookup"):
+        cells = await repo.match_cells(version_id, query, CELL_LOOKUP_MIN_CHARS)
+    cell_answer = match_cell_answer(query, cells)
+    if cell_answer:
+        return cell_answer, []
+    return None, cell_context_blocks(cells)
+
+def _lookup_exact(answer_cache: Optional[AnswerCache], version_id: int, query: str, bypass_cache: bool) -> Optional[dict]:
+    """问答缓存的精确匹配（一次按哈希的索引查询），在单元格直查和检索之前执行"""
+    if answer_cache is None or bypass_cache:
+        return None
+    with span("answer_cache"):
+        return answer_cache.lookup_exact(version_id, query)
+
+def _retrieve_with_cache(
+    doc_processor: "DocumentProcessor",
+    answer_cache: Optional[AnswerCache],
+    version_id: int,
+    query: str,
+    bypass_cache: bool
+):
+    """
+    精确匹配未命中后查问答缓存的语义匹配，未命中时执行检索
+    返回 (缓存结果或None, 检索到的块, 问题向量或None)
+    问题向量在语义匹配和向量检索之间复用，只编码一次
+    """
+    if answer_cache is None or bypass_cache:
+        if answer_cache is not None:
+            answer_cache.record_bypass()
+        with span("retrieval"):
+            return None, doc_processor.retrieve(query, version_id, RETRIEVAL_TOP_K), None
+        
+    query_embedding = None
+    if looks_like_identifier(query):
+        # 编号类问题走倒排索引，不为语义匹配额外编码
+        answer_cache.record_miss()
+    else:
+        query_embedding = doc_processor.embed_query(query)
+        with span("answer_cache"):
+            cached = answer_cache.lookup_similar(version_id, query_embedding)
+        if cached:
+            return cached, [], query_embedding
+            
+    with span("retrieval"):
+        blocks = doc_processor.retrieve(query, version_id, RETRIEVAL_TOP_K, query_embedding)
+    return None, blocks, query_embedding
+
 @router.post("/chat/{session_id}/messages")
 async def send_message(
     session_id: int,
     query: str,
-    db: AsyncSession = Depends(get_db)
+    bypass_cache: bool = False,
+    db: AsyncSession = Depends(get_db),
+    repo: Repository = Depends(get_repository),
+    doc_processor: "DocumentProcessor" = Depends(get_document_processor),
+    llm_client = Depends(get_llm_client),
+    llm_scheduler: LLMScheduler = Depends(get_llm_scheduler),
+    answer_cache: Optional[AnswerCache] = Depends(get_answer_cache),
+    context_packer: ContextPacker = Depends(get_context_packer)
 ):
-    """发送问题并获取回答"""
+    """发送问题并获取回答（bypass_cache=true 时不读写问答缓存）"""
     session = await db.get(ChatSession, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
         
-    # 保存用户问题
-    user_message = Message(
+    # 先查问答缓存的精确匹配，再做单元格直查，都未命中时才经过检索和LLM
+    cached = await run_in_threadpool(_lookup_exact, answer_cache, session.version_id, query, bypass_cache)
+    cell_answer, cell_blocks = (None, []) if cached else await _lookup_cell(repo, session.version_id, query)
+    packed = None
+    if cell_answer:
+        answer = cell_answer['answer']
+        html_ids = cell_answer['sources']
+    elif not cached:
+        # 获取API Key
+        api_key = await _get_api_key(repo)
+        llm_service = LLMService(api_key, llm_client, context_packer, scheduler=llm_scheduler)
+        
+        # 查询缓存并检索相关内容（模型推理放到线程池，避免阻塞事件循环）
+        cached, relevant_blocks, query_embedding = await run_in_threadpool(
+            _retrieve_with_cache,
+            doc_processor,
+            answer_cache,
+            session.version_id,
+            query,
+            bypass_cache
+        )
+        
+    if cached:
+        answer = cached['answer']
+        html_ids = json.loads(cached['retrieved_chunk_html_ids'] or "[]")
+    elif not cell_answer:
+        # 在token预算内打包检索结果（问题涉及的单元格优先），引用来源只包含实际放入提示词的块
+        packed = await run_in_threadpool(llm_service.pack_context, query, cell_blocks + relevant_blocks)
+        html_ids = packed.html_ids
+        
+        # 生成回答（相同问题的进行中请求由调度器合并，按会话公平排队）
+        try:
+            response = await llm_service.generate_response(query, packed, tenant=str(session_id))
+        except LLMBusy as e:
+            raise _llm_busy(e)
+        if response['error']:
+            raise HTTPException(status_code=500, detail=response['error'])
+        answer = response['answer']
+        
+        if answer_cache is not None and not bypass_cache:
+            await run_in_threadpool(
+                answer_cache.store,
+                session.version_id,
+                query,
+                query_embedding,
+                answer,
+                json.dumps(html_ids)
+            )
+    
+    # 问题和回答在同一事务中保存（等待LLM期间不持有SQLite写锁，并发提问才能排队和合并）
+    db.add(Message(
         session_id=session_id,
         sender="user",
         text=query
-    )
-    db.add(user_message)
+    ))
     await db.flush()
     
-    # 获取API Key
-    result = await db.execute(
-        "SELECT value FROM settings WHERE key = 'llm_api_key'"
-    )
-    api_key = result.scalar()
-    if not api_key:
-        raise HTTPException(status_code=400, detail="未配置API Key")
-        
-    # 初始化服务
-    doc_processor = DocumentProcessor()
-    llm_service = LLMService(api_key)
-    
-    # 检索相关内容
-    relevant_blocks = doc_processor.query_document(
-        query_text=query,
-        version_id=session.version_id
-    )
-    
-    # 生成回答
-    response = llm_service.generate_response(query, relevant_blocks)
-    if response['error']:
-        raise HTTPException(status_code=500, detail=response['error'])
-        
-    # 提取引用的块ID
-    html_ids = [block['metadata']['html_id'] for block in relevant_blocks]
-    
     # 保存系统回答
     system_message = Message(
         session_id=session_id,
         sender="system",
-        text=response['answer'],
+        text=answer,
         retrieved_chunk_html_ids=json.dumps(html_ids)
     )
     db.add(system_message)
-    await db.commit()
+    with span("persist"):
+        await db.commit()
     
     return {
-        "answer": response['answer'],
-        "sources": html_ids
+        "answer": answer,
+        "sources": html_ids,
+        "cached": cached['match'] if cached else None,
+        "context": packed.stats() if packed else None,
+        "cell": cell_answer['cell'] if cell_answer else None
     }
 
+def _llm_busy(e: LLMBusy) -> HTTPException:
+    """调度器拒绝的请求返回429（排队已满、超时或上游限流）或503（熔断），并带上Retry-After"""
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def _sse_event(event: str, data: dict) -> str:
+    """格式化一条SSE事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/chat/{session_id}/messages/stream")
+async def send_message_stream(
+    session_id: int,
+    query: str,
+    bypass_cache: bool = False,
+    db: AsyncSession = Depends(get_db),
+    repo: Repository = Depends(get_repository),
+    doc_processor: "DocumentProcessor" = Depends(get_document_processor),
+    llm_client = Depends(get_llm_client),
+    llm_scheduler: LLMScheduler = Depends(get_llm_scheduler),
+    answer_cache: Optional[AnswerCache] = Depends(get_answer_cache),
+    context_packer: ContextPacker = Depends(get_context_packer)
+):
+    """
+    发送问题并以SSE流式返回回答
+    事件：token（增量文本）、done（来源和消息ID）、error（错误信息）
+    """
+    session = await db.get(ChatSession, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="会话不存在")
+        
+    version_id = session.version_id
+    cached = await run_in_threadpool(_lookup_exact, answer_cache, version_id, query, bypass_cache)
+    cell_answer, cell_blocks = (None, []) if cached else await _lookup_cell(repo, version_id, query)
+    if not cell_answer and not cached:
+        api_key = await _get_api_key(repo)
+        llm_service = LLMService(api_key, llm_client, context_packer, scheduler=llm_scheduler)
+    
+    # 保存用户问题（流式响应开始后请求级会话即被关闭，因此先提交）
+    db.add(Message(
+        session_id=session_id,
+        sender="user",
+        text=query
+    ))
+    await db.commit()
+    
+    packed = query_embedding = None
+    if cell_answer:
+        html_ids = cell_answer['sources']
+    elif cached:
+        html_ids = json.loads(cached['retrieved_chunk_html_ids'] or "[]")
+    else:
+        cached, relevant_blocks, query_embedding = await run_in_threadpool(
+            _retrieve_with_cache,
+            doc_processor,
+            answer_cache,
+            version_id,
+            query,
+            bypass_cache
+        )
+        if cached:
+            html_ids = json.loads(cached['retrieved_chunk_html_ids'] or "[]")
+        else:
+            packed = await run_in_threadpool(llm_service.pack_context, query, cell_blocks + relevant_blocks)
+            html_ids = packed.html_ids
+            # 排队和重试在开始响应前完成，被拒绝或上游失败时返回对应的状态码
+            try:
+                tokens = await llm_service.open_stream(query, packed, tenant=str(session_id))
+            except LLMBusy as e:
+                raise _llm_busy(e)
+            except LLMError as e:
+                raise HTTPException(status_code=500, detail=str(e))
+    
+    async def event_stream():
+        parts = []
+        direct = cell_answer or cached
+        if direct:
+            # 单元格直查或命中缓存时一次性返回完整回答
+            parts.append(direct['answer'])
+            yield _sse_event("token", {"text": direct['answer']})
+        else:
+            try:
+                async for text in tokens:
+                    parts.append(text)
+                    yield _sse_event("token", {"text": text})
+            except LLMError as e:
+                yield _sse_event("error", {"detail": str(e)})
+                return
+                
+        answer = "".join(parts)
+        
+        # 流结束后保存完整回答
+        async with AsyncSessionLocal() as stream_db:
+            system_message = Message(
+                session_id=session_id,
+                sender="system",
+                text=answer,
+                retrieved_chunk_html_ids=json.dumps(html_ids)
+            )
+            stream_db.add(system_message)
+            await stream_db.commit()
+            message_id = system_message.message_id
+            
+        if packed is not None and answer_cache is not None and not bypass_cache:
+            await run_in_threadpool(
+                answer_cache.store,
+                version_id,
+                query,
+                query_embedding,
+                answer,
+                json.dumps(html_ids)
+            )
+            
+        yield _sse_event("done", {
+            "sources": html_ids,
+            "message_id": message_id,
+            "cached": cached['match'] if cached else None,
+            "context": packed.stats() if packed else None,
+            "cell": cell_answer['cell'] if cell_answer else None
+        })
+        
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/chat/{session_id}/messages")
-async def get_chat_history(session_id: int, db: AsyncSession = Depends(get_db)):
-    """获取聊天历史记录"""
-    result = await db.execute(
-        "SELECT * FROM messages WHERE session_id = :session_id ORDER BY timestamp",
-        {"session_id": session_id}
+async def get_chat_history(
+    session_id: int,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    repo: Repository = Depends(get_repository)
+):
+    """
+    获取聊天历史记录
+    默认返回最新的一页，页内按时间正序；用page.before继续加载更早的消息
+    """
+    page = await _paginate(repo.list_messages, session_id, before=before, after=after, limit=limit)
+    return {"messages": page.items, "page": page.cursors()}
+
+@router.get("/cache/answers/stats")
+async def answer_cache_stats(answer_cache: Optional[AnswerCache] = Depends(get_answer_cache)):
+    """问答缓存命中统计"""
+    if answer_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await run_in_threadpool(answer_cache.stats)}
+
+# 存储维护
+@router.post("/maintenance/reclaim")
+async def reclaim_storage(
+    dry_run: bool = True,
+    full_vacuum: bool = False,
+    reclaimer: StorageReclaimer = Depends(get_storage_reclaimer)
+):
+    """
+    清理软删除超过保留期（VERSION_RETENTION_DAYS）的版本并整理数据库文件，返回回收报告
+    默认只统计（dry_run=true），传 dry_run=false 执行清理；
+    full_vacuum=true 时即使没有可回收的版本也整理数据库文件，旧的应用数据库执行一次完整VACUUM并切换为增量模式（期间写入会等待）
+    """
+    return await run_in_threadpool(reclaimer.run, dry_run, full_vacuum)
+
+# 指标
+@router.get("/metrics")
+async def metrics(
+    repo: Repository = Depends(get_repository),
+    registry: ServiceRegistry = Depends(get_registry)
+):
+    """Prometheus文本格式的指标（进程内计时和计数，以及抓取时计算的入库和缓存状态）"""
+    lines = REGISTRY.render()
+    
+    job_counts = await repo.ingestion_job_counts()
+    lines += format_metric(
+        "chatdoc_ingest_jobs", "各状态的入库任务数",
+        {(("status", status),): count for status, count in job_counts.items()}
+    )
+    completed, stage_totals = await repo.ingestion_stage_totals(INGEST_STAGES)
+    lines += format_metric("chatdoc_ingest_jobs_timed", "已完成且记录了耗时的入库任务数", {(): completed})
+    lines += format_metric(
+        "chatdoc_ingest_stage_seconds_total", "已完成入库任务各阶段的累计耗时（秒）",
+        {(("stage", stage),): seconds for stage, seconds in stage_totals.items()},
+        metric_type="counter"
+    )
+    
+    scheduler = registry.llm_scheduler.stats()
+    lines += format_metric(
+        "chatdoc_llm_scheduler_requests", "LLM调度器当前的上游请求数和排队数",
+        {(("state", "active"),): scheduler["active"], (("state", "waiting"),): scheduler["waiting"]}
     )
-    messages = result.fetchall()
-    return {"messages": messages}
+    lines += format_metric(
+        "chatdoc_llm_circuit_open", "LLM熔断状态（0关闭，1熔断中或半开）",
+        {(): 0 if scheduler["breaker_state"] == "closed" else 1}
+    )
+    
+    if registry.is_ready:
+        processor = registry.document_processor
+        caches = {
+            "vector_version": processor.vector_store.resolved.stats(),
+            "lexical_index": processor.lexical_store.cache.stats()
+        }
+        for field in ("hits", "misses", "evictions"):
+            lines += format_metric(
+                f"chatdoc_lru_cache_{field}_total", f"进程内LRU缓存的{field}次数",
+                {(("cache", name),): stats[field] for name, stats in caches.items()},
+                metric_type="counter"
+            )
+        lines += format_metric(
+            "chatdoc_lru_cache_size", "进程内LRU缓存当前条目数",
+            {(("cache", name),): stats["size"] for name, stats in caches.items()}
+        )
+    
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # 设置相关路由
 @router.post("/settings/api-key")
-async def update_api_key(api_key: str, db: AsyncSession = Depends(get_db)):
+async def update_api_key(api_key: str, db: AsyncSession = Depends(get_db), repo: Repository = Depends(get_repository)):
     """更新API Key"""
-    setting = Setting(key="llm_api_key", value=api_key)
-    db.merge(setting)
+    await repo.set_setting("llm_api_key", api_key)
     await db.commit()
     return {"message": "API Key已更新"}
 
 @router.get("/settings/api-key")
-async def get_api_key(db: AsyncSession = Depends(get_db)):
+async def get_api_key(repo: Repository = Depends(get_repository)):
     """获取API Key"""
-    result = await db.execute(
-        "SELECT value FROM settings WHERE key = 'llm_api_key'"
-    )
-    api_key = result.scalar()
-    return {"api_key": api_key}
-
-# 后台任务
-async def process_document_background(
-    file_path: str,
-    version_id: int,
-    doc_base_id: int,
-    project_id: str
-):
-    """后台处理文档"""
-    try:
-        # 初始化处理器
-        word_processor = WordProcessor()
-        doc_processor = DocumentProcessor()
-        
-        # 提取文档内容
-        with word_processor as wp:
-            content_blocks = wp.extract_content(file_path)
-            
-        # 处理文档内容
-        processed_blocks = doc_processor.process_document(
-            content_blocks,
-            version_id,
-            doc_base_id,
-            project_id
-        )
-        
-        # 更新处理状态
-        async with AsyncSession() as db:
-            version = await db.get(DocumentVersion, version_id)
-            version.status = "ready"
-            await db.commit()
-            
-    except Exception as e:
-        # 更新错误状态
-        async with AsyncSession() as db:
-            version = await db.get(DocumentVersion, version_id)
-            version.status = "error"
-            version.error_message = str(e)
-            await db.commit() 
\ No newline at end of file
+    return {"api_key": await repo.get_setting("llm_api_key")}
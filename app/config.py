@@ -4,21 +4,170 @@ from pathlib import Path
 # 项目根目录
 BASE_DIR = Path(__file__).parent.parent
 
+# 数据目录（SQLite、ChromaDB、缓存和索引文件），可通过环境变量指向其他位置（如基准测试的临时目录）
+DATA_DIR = Path(os.getenv("DATA_DIR", BASE_DIR / "db"))
+
 # 数据库配置
-SQLITE_DB_PATH = BASE_DIR / "db" / "app_data.db"
-CHROMA_DB_PATH = BASE_DIR / "db" / "chroma_db"
+SQLITE_DB_PATH = Path(os.getenv("DB_PATH", DATA_DIR / "app_data.db"))
+SQL_ECHO = os.getenv("SQL_ECHO", "0") == "1"  # 调试时打印SQL，生产环境保持关闭
+SQLITE_BUSY_TIMEOUT_MS = 5000  # 写锁等待时间，避免与入库进程并发写入时报 database is locked
+SQLITE_CACHE_SIZE_KB = 16384  # 每个连接的页缓存大小
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # 内存映射读取的字节数上限
+DB_POOL_SIZE = 5  # 异步引擎连接池大小
+DB_MAX_OVERFLOW = 5  # 连接池满时允许额外创建的连接数
+DB_POOL_TIMEOUT = 30  # 等待空闲连接的超时（秒）
+CHROMA_DB_PATH = DATA_DIR / "chroma_db"
+# ChromaDB服务地址（如 http://127.0.0.1:8001）：设置后所有进程（Web工作进程、入库工作进程、脚本）
+# 通过HTTP访问同一个持有db/chroma_db的服务进程（run.py默认启动，见scripts/chroma_server.py）；
+# 未设置时各进程以嵌入模式直接打开db/chroma_db
+CHROMA_SERVER_URL = os.getenv("CHROMA_SERVER_URL", "")
+CHROMA_SERVER_PORT = int(os.getenv("CHROMA_SERVER_PORT", "8001"))  # run.py启动ChromaDB服务的端口
+
+# 向量后端
+# chroma：ChromaDB（HNSW近似检索），布局见下方VECTOR_LAYOUT
+# mmap：每个版本一组内存映射的NumPy文件（量化向量 + 记录表），检索为精确余弦top-k，
+#       加载几乎不耗时，多个进程共享页缓存；切换前入库的版本仍从ChromaDB读取，可用迁移脚本转换
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # chroma | mmap
+VECTOR_INDEX_PATH = DATA_DIR / "vector_index"
+# 扫描量化向量筛选候选，再用同时保存的float32原始向量重新排序，两种类型的结果都与float32精确余弦检索一致；
+# int8扫描的数据量是float16的一半，但量化误差较大，需要重新排序的候选稍多
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float16")  # float16 | int8
+VECTOR_SEARCH_BLOCK_ROWS = 4096  # 检索时每次转换为float32参与乘法的行数，限制临时内存
+
+# 向量库布局
+# per_version（默认）：每个版本一个collection，只由入库该版本的进程写入一次；检索不需要元数据过滤，
+#          benchmarks/vector_layout.py中热查询p50约2ms，但collection和索引文件数量随版本数增长
+# sharded（需显式开启）：所有版本写入固定数量的分片collection（version_id取模），collection数量不随版本增长，
+#          但Chroma 0.4的元数据过滤开销与版本的chunk数成正比，同一基准中热查询p50约90ms；
+#          适合版本数多、单版本chunk少、更在意打开的索引数量而不是检索延迟的部署；
+#          需要ChromaDB服务（CHROMA_SERVER_URL）：嵌入模式下HNSW索引在每个进程内各自加载，
+#          其他进程写入分片后本进程看不到新向量，多个进程同时写同一分片还会互相覆盖索引文件
+# auto：等同per_version（兼容旧配置），使用ChromaDB服务时也不会自动切换为sharded
+# 两种布局的记录都带version_id和is_deleted元数据，检索时按版本过滤并排除软删除的记录
+VECTOR_LAYOUT = os.getenv("VECTOR_LAYOUT", "per_version")  # per_version | sharded | auto
+VECTOR_SHARD_COUNT = int(os.getenv("VECTOR_SHARD_COUNT", "8"))  # 分片数，已有数据后修改需重新执行迁移
+VECTOR_SHARD_PREFIX = "document_chunks"
+VECTOR_MIGRATION_BATCH_SIZE = 1000  # 迁移旧collection时每批复制的记录数
 
 # 文档存储配置
-DOCS_STORAGE_PATH = BASE_DIR / "docs_storage"
+DOCS_STORAGE_PATH = Path(os.getenv("DOCS_STORAGE_PATH", BASE_DIR / "docs_storage"))
+
+# 上传配置：文件分块流式写入磁盘并同时计算SHA-256，同一文档内容相同的上传不重新入库
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 流式写入时每次读取的字节数
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))  # 单个文档的大小上限
+UPLOAD_SESSION_PATH = DATA_DIR / "uploads"  # 断点续传中未完成的文件和批量上传的临时文件
+UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))  # 超过该时间没有续传的分块上传会被清理
+BULK_UPLOAD_MAX_FILES = 500  # 批量上传的zip中最多包含的文档数
+BULK_UPLOAD_MAX_BYTES = int(os.getenv("BULK_UPLOAD_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))  # zip文件及解压后文档总大小的上限
+
+# 存储回收配置：软删除超过保留期的版本，删除其原始文件、向量、倒排索引和派生数据，之后整理数据库文件
+VERSION_RETENTION_DAYS = float(os.getenv("VERSION_RETENTION_DAYS", "30"))
+RECLAIM_INTERVAL_HOURS = float(os.getenv("RECLAIM_INTERVAL_HOURS", "24"))  # 服务内定时回收的间隔，0表示不定时执行
+RECLAIM_VACUUM_STEP_PAGES = 1000  # 增量整理SQLite时每步回收的页数，每步是一个短事务，不长时间阻塞其他写入
+RECLAIM_VACUUM_CHROMA = os.getenv("RECLAIM_VACUUM_CHROMA", "1") == "1"  # 回收后整理ChromaDB的SQLite文件（使用ChromaDB服务时由服务进程执行，整理期间检索等待）
+RECLAIM_CHROMA_VACUUM_TIMEOUT = 600  # 请求ChromaDB服务整理数据库文件的超时（秒）
+
+# 文档解析配置
+# auto: Windows且安装了pywin32时使用Word COM（支持加密文档），否则使用纯Python的OOXML解析
+DOCX_EXTRACTOR_BACKEND = os.getenv("DOCX_EXTRACTOR_BACKEND", "auto")  # auto | com | ooxml
+
+# 入库任务队列配置
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))  # 入库工作进程数量
+INGEST_MAX_ATTEMPTS = 3  # 单个任务最大尝试次数
+INGEST_RETRY_BASE_SECONDS = 10  # 重试退避基数（秒），第n次重试等待 base * 2^(n-1)
+INGEST_POLL_INTERVAL = 1.0  # 工作进程空闲时轮询队列的间隔（秒）
+INGEST_SUPERVISE_INTERVAL = 5.0  # 检查工作进程是否异常退出的间隔（秒），退出的进程所领取的任务会被恢复并补启新进程
 
 # 嵌入模型配置
 EMBEDDING_MODEL_NAME = "bge-base-zh-v1.5"
 CHUNK_SIZE = 512
 CHUNK_OVERLAP = 50
+EMBED_BATCH_SIZE = 32  # 每批送入嵌入模型的chunk数量（CPU上32左右吞吐最佳）
+# 嵌入后端
+# torch：HuggingFaceEmbedding（PyTorch fp32）
+# onnx：onnxruntime执行导出的模型（scripts/export_embedding_onnx.py导出并与fp32向量核对），int8动态量化在CPU上更快
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")  # torch | onnx
+EMBEDDING_ONNX_PATH = Path(os.getenv("EMBEDDING_ONNX_PATH", BASE_DIR / "models" / f"{EMBEDDING_MODEL_NAME}-onnx"))
+EMBEDDING_ONNX_VARIANT = os.getenv("EMBEDDING_ONNX_VARIANT", "int8")  # int8 | fp32，对应 model.{variant}.onnx
+EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))  # onnxruntime的线程数，0为默认（物理核数）
+EMBEDDING_MAX_LENGTH = 512  # 编码的最大token数，超出部分截断（与bge-base一致）
+EMBEDDING_MIN_COSINE = 0.99  # 导出的模型与fp32模型向量的最低余弦相似度，低于该值的模型不允许加载
+# 问题编码微批：并发请求的问题在窗口内合并为一批编码（只有一个请求时也会等待一个窗口），0为逐条编码
+EMBED_QUERY_BATCH_WINDOW_MS = float(os.getenv("EMBED_QUERY_BATCH_WINDOW_MS", "5"))
+EMBED_QUERY_MAX_BATCH = 16  # 每批最多合并的问题数
+# 嵌入服务（仅Linux/Mac）：由 python -m scripts.embedding_server 启动的一个进程加载模型，通过Unix socket提供编码，
+# 设置该路径后Web工作进程和入库工作进程不再各自加载模型；为空时在进程内加载
+EMBEDDING_SERVER_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET", "")
+EMBEDDING_SERVER_BULK_SLICE = 8  # 入库批次每次编码的文本数，问题最多等待一个切片即可插队
+EMBEDDING_SERVER_CONNECT_TIMEOUT = 120  # 等待嵌入服务就绪（含加载模型）的秒数
+EMBEDDING_SERVER_REQUEST_TIMEOUT = 300  # 单次编码请求的超时（秒）
+UPSERT_BATCH_SIZE = 1000  # 每批写入ChromaDB的记录数
+
+# 表格切分配置：表格按行组切分，每个行组重复表头，并拥有独立的html_id
+TABLE_CHUNK_MAX_TOKENS = 384  # 每个行组（含表头）的token上限，需留出元数据的空间，避免被节点解析器再次切分
+TABLE_CHUNK_MAX_ROWS = 30  # 每个行组的最大行数
+
+# 单元格直查：问题只包含某行的行名、某列的列名和“是多少”等查询用语时，直接从单元格表返回值，不经过检索和LLM；
+# 问题还问了别的内容时，匹配到的单元格作为优先上下文交给LLM
+CELL_LOOKUP_ENABLED = os.getenv("CELL_LOOKUP_ENABLED", "1") == "1"
+CELL_LOOKUP_MIN_CHARS = 2  # 行名和列名的最短长度，过短的名称容易误匹配
+CELL_LABEL_CACHE_SIZE = 64  # 在内存中缓存行名、列名的版本数，提问时不再扫描单元格表
+
+# 向量缓存配置（按模型和文本内容哈希缓存，新版本文档只需计算变化部分）
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "1") == "1"
+EMBEDDING_CACHE_PATH = DATA_DIR / "embedding_cache.db"
+EMBEDDING_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# 列表分页配置
+PAGE_SIZE = 50  # 聊天记录、文档和版本列表默认每页条数
+MAX_PAGE_SIZE = 200
+
+# 文档预览配置
+PREVIEW_PAGE_SIZE = 200  # 每页返回的内容块数量
+PREVIEW_MAX_PAGE_SIZE = 1000
+
+# 上下文打包配置
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))  # 提示词（含模板和问题）的token上限，按嵌入模型分词器计数
+CONTEXT_MIN_SEGMENT_TOKENS = 64  # 预算剩余不足该值时不再截断放入片段
+
+# 检索配置
+RETRIEVAL_TOP_K = 5
+RETRIEVER_CACHE_SIZE = 32  # 缓存的“版本 -> collection”解析结果数量上限（旧布局的版本各自占用一个collection句柄）
+
+# 混合检索配置（BM25倒排索引 + 向量检索，使用倒数排名融合）
+HYBRID_RETRIEVAL_ENABLED = True
+LEXICAL_INDEX_PATH = DATA_DIR / "lexical_index"
+LEXICAL_CACHE_SIZE = 32  # 内存中保留的版本倒排索引数量上限
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+# 问答缓存配置
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95  # 问题向量余弦相似度达到该值视为同一问题
+ANSWER_CACHE_MAX_ENTRIES_PER_VERSION = 500
+ANSWER_CACHE_HIT_FLUSH_SIZE = 64  # 命中次数在内存中累计，达到该次数时批量写回，查找时不写数据库
+
+# LLM API配置（可通过环境变量指向本地模拟服务）
+LLM_API_ENDPOINT = os.getenv("LLM_API_ENDPOINT", "https://api.volcengine.com/ml-platform/v1/model/invoke")
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "doubao-1-5-thinking-pro-250415")
+LLM_TIMEOUT = 30  # 秒
+LLM_MAX_CONNECTIONS = 20  # 连接池大小
+LLM_KEEPALIVE_EXPIRY = 60  # 空闲长连接保持时间（秒）
+
+# LLM调度配置（每个Web工作进程各自计数，多进程部署时总并发为 进程数 x LLM_MAX_CONCURRENCY）
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))  # 同时进行的上游请求数
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))  # 排队等待的请求数上限，超过时返回429
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))  # 排队超过该时间（秒）返回429
+LLM_MAX_RETRIES = 2  # 连接失败、超时、429和5xx的重试次数
+LLM_RETRY_BASE_SECONDS = 0.5  # 重试退避基数，第n次重试等待 [0, base * 2^n] 内的随机时间
+LLM_RETRY_MAX_SECONDS = 8.0  # 单次退避上限，上游要求的Retry-After超过该值时不再重试
+LLM_BREAKER_FAILURES = 5  # 连续失败该次数后熔断，直接返回503
+LLM_BREAKER_OPEN_SECONDS = 30.0  # 熔断持续时间，之后放行一个探测请求
 
-# LLM API配置
-LLM_API_ENDPOINT = "https://api.volcengine.com/ml-platform/v1/model/invoke"
-LLM_MODEL_NAME = "doubao-1-5-thinking-pro-250415"
+# 指标配置
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"  # 关闭后计时和计数几乎没有开销
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "5"))  # 超过该耗时的请求记录慢请求日志
 
 # 创建必要的目录
 REQUIRED_DIRS = [
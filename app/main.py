@@ -7,9 +7,20 @@ from fastapi import Request
 from contextlib import asynccontextmanager
 import uvicorn
 import os
+import time
+import logging
 
 from app.api.routes import router
+from app.api.middleware import RequestMetricsMiddleware
+from app.config import METRICS_ENABLED, DATA_DIR
+from app.services.file_lock import try_lock
 from app.models.database import init_db
+from app.models.database_manager import engine as async_engine
+from app.services.registry import ServiceRegistry
+from app.services.ingest_worker import IngestWorkerPool
+from app.services.storage_reclaimer import ReclaimScheduler
+
+logger = logging.getLogger(__name__)
 
 # 初始化模板
 templates = Jinja2Templates(directory="app/templates")
@@ -17,10 +28,36 @@ templates = Jinja2Templates(directory="app/templates")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动时执行
+    start = time.perf_counter()
     init_db()
+    
+    # 创建进程级共享服务注册表，并在后台加载、预热嵌入模型
+    app.state.registry = ServiceRegistry()
+    app.state.registry.start_background_load()
+    
+    # 入库工作进程（会先恢复上次中断的任务）和定时回收只在取得文件锁的一个Web工作进程中启动
+    # （run.py --prod --workers N），锁在该进程退出时释放
+    app.state.background_lock = try_lock(DATA_DIR / "background.lock")
+    app.state.ingest_workers = None
+    app.state.reclaim_scheduler = None
+    if app.state.background_lock is not None:
+        app.state.ingest_workers = IngestWorkerPool()
+        app.state.ingest_workers.start()
+        
+        # 定时清理软删除超过保留期的版本
+        app.state.reclaim_scheduler = ReclaimScheduler(app.state.registry)
+        app.state.reclaim_scheduler.start()
+    logger.info(f"服务启动完成，耗时 {time.perf_counter() - start:.2f}s（嵌入模型在后台加载）")
     yield
     # 关闭时执行
-    pass
+    if app.state.reclaim_scheduler is not None:
+        app.state.reclaim_scheduler.stop()
+    if app.state.ingest_workers is not None:
+        app.state.ingest_workers.stop()
+    if app.state.background_lock is not None:
+        app.state.background_lock.close()
+    await app.state.registry.aclose()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="本地智能文档问答助手",
@@ -44,6 +81,10 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+# 请求级计时、请求ID和慢请求日志（关闭指标时不注册）
+if METRICS_ENABLED:
+    app.add_middleware(RequestMetricsMiddleware)
+
 # 挂载静态文件
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
@@ -56,9 +97,19 @@ async def root(request: Request):
 app.include_router(router, prefix="/api")
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "app.main:app",
-        host="127.0.0.1",
-        port=8000,
-        reload=True
-    ) 
\ No newline at end of file
+    # 启动ChromaDB服务，自动重载启动的应用进程和入库工作进程通过它共用向量数据
+    chroma_server = None
+    if not os.getenv("CHROMA_SERVER_URL"):
+        from scripts.chroma_server import start_background
+        chroma_server = start_background()
+    try:
+        uvicorn.run(
+            "app.main:app",
+            host="127.0.0.1",
+            port=8000,
+            reload=True
+        )
+    finally:
+        if chroma_server is not None:
+            chroma_server.terminate()
+            chroma_server.wait(10) 
\ No newline at end of file
@@ -1,16 +1,35 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import create_engine, event, Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Float, LargeBinary, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, sessionmaker
 from datetime import datetime
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+from app.config import (
+    SQLITE_DB_PATH, SQL_ECHO, SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE
+)
 
-DB_PATH = os.getenv("DB_PATH", "./db/app_data.db")
-SQLITE_URL = f"sqlite:///{DB_PATH}"
+SQLITE_URL = f"sqlite:///{SQLITE_DB_PATH}"
 
-engine = create_engine(SQLITE_URL)
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """
+    每个新连接建立时设置SQLite参数（同步引擎、异步引擎和工作进程共用）
+    WAL模式下读写互不阻塞，synchronous=NORMAL在WAL下仍能保证崩溃后数据库一致
+    """
+    cursor = dbapi_connection.cursor()
+    # 只对尚未建表的新数据库生效；已有数据库通过一次完整整理切换（/api/maintenance/reclaim?full_vacuum=true 或 scripts.reclaim_storage --vacuum）
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+# 同步引擎：供入库工作进程、任务队列和缓存使用，接口层使用database_manager中的异步引擎
+engine = create_engine(SQLITE_URL, echo=SQL_ECHO)
+event.listen(engine, "connect", apply_sqlite_pragmas)
+SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
 class Project(Base):
@@ -24,6 +43,9 @@ class Project(Base):
 
 class Document(Base):
     __tablename__ = "documents"
+    __table_args__ = (
+        Index("ix_documents_project_filename", "project_id", "original_filename"),
+    )
     
     doc_base_id = Column(Integer, primary_key=True, autoincrement=True)
     project_id = Column(String, ForeignKey("projects.project_id"), nullable=False)
@@ -35,17 +57,24 @@ class Document(Base):
 
 class DocumentVersion(Base):
     __tablename__ = "document_versions"
+    __table_args__ = (
+        Index("ix_document_versions_doc_latest", "doc_base_id", "is_latest"),
+        Index("ix_document_versions_doc_hash", "doc_base_id", "content_hash"),
+    )
     
     version_id = Column(Integer, primary_key=True, autoincrement=True)
     doc_base_id = Column(Integer, ForeignKey("documents.doc_base_id"), nullable=False)
     version_number = Column(Integer, nullable=False)
     stored_filename = Column(String, nullable=False)
     stored_filepath = Column(String, nullable=False)
+    content_hash = Column(String, nullable=True)  # 原始文件的SHA-256，同一文档重复上传相同内容时不重新入库
     upload_time = Column(DateTime, default=datetime.utcnow)
     status = Column(String, nullable=False, default="processing")
     error_message = Column(String, nullable=True)
     is_latest = Column(Boolean, nullable=False, default=True)
     is_deleted = Column(Boolean, nullable=False, default=False)
+    deleted_at = Column(DateTime, nullable=True)  # 软删除时间，超过保留期后由存储回收任务清理
+    purged_at = Column(DateTime, nullable=True)  # 原始文件、向量和派生数据已被清理的时间
     
     document = relationship("Document", back_populates="versions")
     chat_sessions = relationship("ChatSession", back_populates="document_version")
@@ -63,6 +92,9 @@ class ChatSession(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_session_timestamp", "session_id", "timestamp", "message_id"),
+    )
     
     message_id = Column(Integer, primary_key=True, autoincrement=True)
     session_id = Column(Integer, ForeignKey("chat_sessions.session_id"), nullable=False)
@@ -79,5 +111,91 @@ class Setting(Base):
     key = Column(String, primary_key=True)
     value = Column(String, nullable=False)
 
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+    
+    job_id = Column(Integer, primary_key=True, autoincrement=True)
+    version_id = Column(Integer, ForeignKey("document_versions.version_id"), nullable=False)
+    doc_base_id = Column(Integer, nullable=False)
+    project_id = Column(String, nullable=False)
+    file_path = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued")  # queued | running | done | failed
+    stage = Column(String, nullable=False, default="queued")
+    progress = Column(Float, nullable=False, default=0.0)  # 百分比 0~100
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    next_run_at = Column(DateTime, default=datetime.utcnow)
+    error_message = Column(String, nullable=True)
+    timings = Column(Text, nullable=True)  # 各阶段耗时（JSON）
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class AnswerCacheEntry(Base):
+    __tablename__ = "answer_cache"
+    __table_args__ = (
+        Index("ix_answer_cache_version_query", "version_id", "query_hash"),
+    )
+    
+    entry_id = Column(Integer, primary_key=True, autoincrement=True)
+    version_id = Column(Integer, ForeignKey("document_versions.version_id"), nullable=False)
+    query_hash = Column(String, nullable=False)
+    query_text = Column(Text, nullable=False)
+    query_embedding = Column(LargeBinary, nullable=True)  # float32向量
+    answer = Column(Text, nullable=False)
+    retrieved_chunk_html_ids = Column(String, nullable=True)
+    hit_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class DocumentBlock(Base):
+    __tablename__ = "document_blocks"
+    __table_args__ = (
+        Index("ix_document_blocks_version_sequence", "version_id", "sequence_in_doc", unique=True),
+    )
+    
+    block_id = Column(Integer, primary_key=True, autoincrement=True)
+    version_id = Column(Integer, ForeignKey("document_versions.version_id"), nullable=False)
+    html_id = Column(String, nullable=False)
+    block_type = Column(String, nullable=False)  # paragraph | table
+    sequence_in_doc = Column(Integer, nullable=False)
+    content = Column(Text, nullable=False)  # 原始文本（表格为Markdown）
+    html = Column(Text, nullable=False)  # 入库时预先渲染好的HTML片段
+    fingerprint = Column(String, nullable=True)  # 块类型和规范化文本的哈希，用于版本对比
+
+class TableCell(Base):
+    __tablename__ = "table_cells"
+    __table_args__ = (
+        Index("ix_table_cells_version_table_row", "version_id", "sequence_in_doc", "row_index"),
+    )
+    
+    cell_id = Column(Integer, primary_key=True, autoincrement=True)
+    version_id = Column(Integer, ForeignKey("document_versions.version_id"), nullable=False)
+    sequence_in_doc = Column(Integer, nullable=False)  # 所在表格的块序号
+    html_id = Column(String, nullable=False)  # 所在行组的html_id（引用和高亮用）
+    row_index = Column(Integer, nullable=False)  # 数据行序号，从0开始，不含表头
+    col_index = Column(Integer, nullable=False)
+    row_label = Column(String, nullable=False)  # 该行第一列的值
+    column_name = Column(String, nullable=False)  # 该列的表头
+    value = Column(Text, nullable=False)
+
+class VersionDiff(Base):
+    __tablename__ = "version_diffs"
+    __table_args__ = (
+        Index("ix_version_diffs_pair", "old_version_id", "new_version_id", unique=True),
+    )
+    
+    diff_id = Column(Integer, primary_key=True, autoincrement=True)
+    old_version_id = Column(Integer, ForeignKey("document_versions.version_id"), nullable=False)
+    new_version_id = Column(Integer, ForeignKey("document_versions.version_id"), nullable=False)
+    result = Column(Text, nullable=False)  # 对比结果（JSON）
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 def init_db():
-    Base.metadata.create_all(engine) 
\ No newline at end of file
+    """创建缺失的表，并将已有数据库升级到最新结构（多个工作进程同时启动时串行执行）"""
+    from app.models.migrations import run_migrations
+    from app.services.file_lock import file_lock
+
+    os.makedirs(os.path.dirname(SQLITE_DB_PATH), exist_ok=True)
+    with file_lock(f"{SQLITE_DB_PATH}.init.lock"):
+        Base.metadata.create_all(engine)
+        run_migrations(engine)
+ 
\ No newline at end of file
@@ -1,9 +1,21 @@
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from app.config import SQLITE_DB_PATH
+from app.config import SQLITE_DB_PATH, SQL_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT
+from app.models.database import apply_sqlite_pragmas
 
 # 创建异步数据库引擎
-engine = create_async_engine(f"sqlite+aiosqlite:///{SQLITE_DB_PATH}", echo=True)
+# aiosqlite默认不复用连接（NullPool），这里使用有界连接池，WAL模式下多个连接可以并发读
+engine = create_async_engine(
+    f"sqlite+aiosqlite:///{SQLITE_DB_PATH}",
+    echo=SQL_ECHO,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT
+)
+event.listen(engine.sync_engine, "connect", apply_sqlite_pragmas)
 
 # 创建异步会话工厂
 AsyncSessionLocal = sessionmaker(
@@ -22,4 +34,4 @@ async def get_db():
             await session.rollback()
             raise
         finally:
-            await session.close() 
\ No newline at end of file
+            await session.close()
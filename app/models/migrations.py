@@ -0,0 +1,125 @@
+import os
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+def column_exists(connection: Connection, table: str, column: str) -> bool:
+    rows = connection.execute(text(f"PRAGMA table_info({table})")).fetchall()
+    return any(row[1] == column for row in rows)
+
+def add_column(connection: Connection, table: str, column: str, ddl: str):
+    """为已有表增加列（create_all不会修改已存在的表），列已存在时跳过"""
+    if not column_exists(connection, table, column):
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+def _add_query_indexes(connection: Connection):
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_documents_project_filename "
+        "ON documents (project_id, original_filename)"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_document_versions_doc_latest "
+        "ON document_versions (doc_base_id, is_latest)"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_messages_session_timestamp "
+        "ON messages (session_id, timestamp, message_id)"
+    ))
+
+def _backfill_table_cells(connection: Connection):
+    """
+    为已入库的版本补建单元格表（旧版本的表格没有按行组切分，单元格引用整个表格）
+    已有单元格的版本跳过
+    """
+    from app.models.database import TableCell
+    from app.services.block_store import table_cells
+
+    rows = connection.execute(text(
+        "SELECT version_id, html_id, sequence_in_doc, content FROM document_blocks "
+        "WHERE block_type = 'table' AND version_id NOT IN (SELECT DISTINCT version_id FROM table_cells)"
+    )).fetchall()
+    for version_id, html_id, sequence, content in rows:
+        cells = table_cells(version_id, {'html_id': html_id, 'sequence': sequence, 'content': content})
+        if cells:
+            connection.execute(TableCell.__table__.insert(), cells)
+
+def _add_block_fingerprints(connection: Connection):
+    """为内容块增加指纹列，并为已入库的块补算指纹"""
+    from app.services.version_diff import block_fingerprint
+
+    add_column(connection, "document_blocks", "fingerprint", "VARCHAR")
+    rows = connection.execute(text(
+        "SELECT block_id, block_type, content FROM document_blocks WHERE fingerprint IS NULL"
+    )).fetchall()
+    if rows:
+        connection.execute(
+            text("UPDATE document_blocks SET fingerprint = :fingerprint WHERE block_id = :block_id"),
+            [{"fingerprint": block_fingerprint(block_type, content), "block_id": block_id} for block_id, block_type, content in rows]
+        )
+
+def _add_version_deletion_times(connection: Connection):
+    """
+    为版本增加删除时间和清理时间列
+    已软删除的版本没有记录删除时间，以迁移时间为准，保留期从现在开始计算
+    """
+    add_column(connection, "document_versions", "deleted_at", "DATETIME")
+    add_column(connection, "document_versions", "purged_at", "DATETIME")
+    connection.execute(text(
+        "UPDATE document_versions SET deleted_at = CURRENT_TIMESTAMP "
+        "WHERE is_deleted = 1 AND deleted_at IS NULL"
+    ))
+
+def _add_version_content_hashes(connection: Connection):
+    """为版本增加内容哈希列和索引，并为原始文件仍在的版本补算哈希"""
+    from app.services.uploads import file_sha256
+
+    add_column(connection, "document_versions", "content_hash", "VARCHAR")
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_document_versions_doc_hash "
+        "ON document_versions (doc_base_id, content_hash)"
+    ))
+    rows = connection.execute(text(
+        "SELECT version_id, stored_filepath FROM document_versions WHERE content_hash IS NULL AND purged_at IS NULL"
+    )).fetchall()
+    hashes = [
+        {"content_hash": file_sha256(path), "version_id": version_id}
+        for version_id, path in rows if os.path.exists(path)
+    ]
+    if hashes:
+        connection.execute(
+            text("UPDATE document_versions SET content_hash = :content_hash WHERE version_id = :version_id"),
+            hashes
+        )
+
+# 按顺序执行的迁移：(版本号, 说明, 迁移函数)
+# 新建的数据库由create_all直接建成最新结构，迁移函数需保证重复执行无副作用
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "添加文档、版本和消息的复合索引", _add_query_indexes),
+    (2, "由已有的表格块补建单元格表", _backfill_table_cells),
+    (3, "为内容块增加指纹列（版本对比）", _add_block_fingerprints),
+    (4, "为版本增加删除时间和清理时间列（存储回收）", _add_version_deletion_times),
+    (5, "为版本增加内容哈希列（重复上传检测）", _add_version_content_hashes),
+]
+
+def run_migrations(engine: Engine) -> int:
+    """
+    使用 PRAGMA user_version 记录数据库结构版本，依次执行尚未执行的迁移
+    每个迁移在单独的事务中执行并更新版本号，返回本次执行的迁移数
+    """
+    applied = 0
+    with engine.connect() as connection:
+        current = connection.execute(text("PRAGMA user_version")).scalar() or 0
+        connection.rollback()
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            with connection.begin():
+                migrate(connection)
+                connection.execute(text(f"PRAGMA user_version = {version}"))
+            logger.info(f"数据库已升级到版本 {version}：{description}")
+            applied += 1
+    return applied
@@ -0,0 +1,372 @@
+import json
+import base64
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+
+from fastapi import Depends
+from sqlalchemy import select, update, func, or_, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.database import (
+    Project, Document, DocumentVersion, Message, Setting, IngestionJob, TableCell, DocumentBlock, VersionDiff
+)
+from app.models.database_manager import get_db
+from app.services.lru_cache import LRUCache
+from app.config import CELL_LABEL_CACHE_SIZE
+
+# version_id -> (签名单元格ID, 行名集合, 列名集合)，进程内共享
+_cell_labels = LRUCache(CELL_LABEL_CACHE_SIZE)
+
+def model_to_dict(obj) -> Dict:
+    """将ORM对象转换为可JSON序列化的字典"""
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    """将排序键 (时间, 主键) 编码为不透明的游标字符串"""
+    raw = json.dumps([sort_value.isoformat() if sort_value else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        return (datetime.fromisoformat(sort_value) if sort_value else None), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"无效的分页游标: {cursor}") from e
+
+class Page:
+    """
+    键集分页的一页结果
+    before：取更早一页的游标；after：取更新一页的游标；该方向没有更多数据时为None
+    """
+    def __init__(self, items: List[Dict], before: Optional[str] = None, after: Optional[str] = None):
+        self.items = items
+        self.before = before
+        self.after = after
+
+    def cursors(self) -> Dict:
+        return {"before": self.before, "after": self.after, "count": len(self.items)}
+
+class Repository:
+    """
+    接口层的统一数据访问入口，所有查询都通过ORM表达式构建
+    不负责提交事务，由调用方（请求级会话）统一提交
+    """
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def _keyset_page(
+        self,
+        query,
+        sort_column,
+        id_column,
+        limit: int,
+        before: Optional[str] = None,
+        after: Optional[str] = None
+    ) -> Tuple[List, Optional[str], Optional[str]]:
+        """
+        键集分页，以 (sort_column, id_column) 为稳定排序键，按索引定位，不使用OFFSET
+        不传游标时取最新的一页；before取游标之前（更早）的一页；after取游标之后（更新）的一页
+        返回 (按新到旧排列的行, before游标, after游标)
+        """
+        query = query.add_columns(sort_column.label("_sort_key"), id_column.label("_id_key"))
+        key = tuple_(sort_column, id_column)
+        if after:
+            query = query.where(key > tuple_(*decode_cursor(after))).order_by(sort_column, id_column)
+        else:
+            if before:
+                query = query.where(key < tuple_(*decode_cursor(before)))
+            query = query.order_by(sort_column.desc(), id_column.desc())
+
+        # 多取一条，判断当前方向上是否还有数据
+        rows = (await self.db.execute(query.limit(limit + 1))).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if after:
+            rows.reverse()
+
+        if not rows:
+            return [], after, before
+        newest, oldest = rows[0], rows[-1]
+        older_exists = True if after else has_more
+        newer_exists = has_more if after else bool(before)
+        return (
+            rows,
+            encode_cursor(oldest._sort_key, oldest._id_key) if older_exists else None,
+            encode_cursor(newest._sort_key, newest._id_key) if newer_exists else None
+        )
+
+    # 项目
+    async def list_projects(self) -> List[Dict]:
+        result = await self.db.execute(select(Project).order_by(Project.creation_time.desc()))
+        return [model_to_dict(project) for project in result.scalars()]
+
+    # 文档和版本
+    async def find_document(self, project_id: str, original_filename: str) -> Optional[Document]:
+        """按项目和原始文件名查找文档（命中 ix_documents_project_filename）"""
+        result = await self.db.execute(
+            select(Document).where(
+                Document.project_id == project_id,
+                Document.original_filename == original_filename
+            ).limit(1)
+        )
+        return result.scalars().first()
+
+    async def next_version_number(self, doc_base_id: int) -> int:
+        result = await self.db.execute(
+            select(func.max(DocumentVersion.version_number))
+            .where(DocumentVersion.doc_base_id == doc_base_id)
+        )
+        return (result.scalar() or 0) + 1
+
+    async def clear_latest(self, doc_base_id: int):
+        """将文档的所有版本标记为非最新"""
+        await self.db.execute(
+            update(DocumentVersion)
+            .where(DocumentVersion.doc_base_id == doc_base_id, DocumentVersion.is_latest == True)
+            .values(is_latest=False)
+        )
+
+    async def find_version_by_hash(self, doc_base_id: int, content_hash: str) -> Optional[DocumentVersion]:
+        """文档中内容哈希相同、未删除且未入库失败的最新版本（命中 ix_document_versions_doc_hash）"""
+        result = await self.db.execute(
+            select(DocumentVersion).where(
+                DocumentVersion.doc_base_id == doc_base_id,
+                DocumentVersion.content_hash == content_hash,
+                DocumentVersion.is_deleted == False,
+                DocumentVersion.status != "error"
+            ).order_by(DocumentVersion.version_number.desc()).limit(1)
+        )
+        return result.scalars().first()
+
+    async def list_documents(
+        self,
+        project_id: str,
+        limit: int,
+        before: Optional[str] = None,
+        after: Optional[str] = None
+    ) -> Page:
+        """项目下的文档及其最新版本信息，按 (creation_time, doc_base_id) 从新到旧分页"""
+        query = (
+            select(
+                Document,
+                DocumentVersion.version_number,
+                DocumentVersion.status,
+                DocumentVersion.is_latest,
+                DocumentVersion.version_id
+            )
+            .outerjoin(DocumentVersion, Document.doc_base_id == DocumentVersion.doc_base_id)
+            .where(
+                Document.project_id == project_id,
+                or_(DocumentVersion.is_latest == True, DocumentVersion.is_latest.is_(None))
+            )
+        )
+        rows, older, newer = await self._keyset_page(
+            query, Document.creation_time, Document.doc_base_id, limit, before, after
+        )
+        items = [
+            {
+                **model_to_dict(row.Document),
+                "version_number": row.version_number,
+                "status": row.status,
+                "is_latest": row.is_latest,
+                "version_id": row.version_id
+            }
+            for row in rows
+        ]
+        return Page(items, older, newer)
+
+    async def list_versions(
+        self,
+        doc_base_id: int,
+        limit: int,
+        before: Optional[str] = None,
+        after: Optional[str] = None
+    ) -> Page:
+        """文档未删除的版本，按 (upload_time, version_id) 从新到旧分页"""
+        query = select(DocumentVersion).where(
+            DocumentVersion.doc_base_id == doc_base_id,
+            DocumentVersion.is_deleted == False
+        )
+        rows, older, newer = await self._keyset_page(
+            query, DocumentVersion.upload_time, DocumentVersion.version_id, limit, before, after
+        )
+        return Page([model_to_dict(row.DocumentVersion) for row in rows], older, newer)
+
+    # 聊天
+    async def list_messages(
+        self,
+        session_id: int,
+        limit: int,
+        before: Optional[str] = None,
+        after: Optional[str] = None
+    ) -> Page:
+        """
+        会话消息，按 (timestamp, message_id) 分页（命中 ix_messages_session_timestamp）
+        页内按时间正序排列，便于直接显示
+        """
+        query = select(Message).where(Message.session_id == session_id)
+        rows, older, newer = await self._keyset_page(
+            query, Message.timestamp, Message.message_id, limit, before, after
+        )
+        return Page([model_to_dict(row.Message) for row in reversed(rows)], older, newer)
+
+    # 内容块和版本对比
+    async def block_fingerprints(self, version_id: int) -> List[Dict]:
+        """按文档顺序返回版本全部内容块的指纹（不读取正文，命中 ix_document_blocks_version_sequence）"""
+        result = await self.db.execute(
+            select(DocumentBlock.html_id, DocumentBlock.block_type, DocumentBlock.fingerprint)
+            .where(DocumentBlock.version_id == version_id)
+            .order_by(DocumentBlock.sequence_in_doc)
+        )
+        return [dict(row._mapping) for row in result]
+
+    async def block_contents(self, version_id: int, html_ids: List[str], batch_size: int = 500) -> Dict[str, str]:
+        """读取指定内容块的正文（分批查询，避免超出SQLite的参数个数限制）"""
+        contents = {}
+        for start in range(0, len(html_ids), batch_size):
+            result = await self.db.execute(
+                select(DocumentBlock.html_id, DocumentBlock.content).where(
+                    DocumentBlock.version_id == version_id,
+                    DocumentBlock.html_id.in_(html_ids[start:start + batch_size])
+                )
+            )
+            contents.update({html_id: content for html_id, content in result})
+        return contents
+
+    async def get_version_diff(self, old_version_id: int, new_version_id: int) -> Optional[VersionDiff]:
+        result = await self.db.execute(
+            select(VersionDiff).where(
+                VersionDiff.old_version_id == old_version_id,
+                VersionDiff.new_version_id == new_version_id
+            )
+        )
+        return result.scalars().first()
+
+    async def save_version_diff(self, old_version_id: int, new_version_id: int, result: str):
+        """保存对比结果，并发请求重复计算时以后写入的为准"""
+        statement = sqlite_insert(VersionDiff).values(
+            old_version_id=old_version_id,
+            new_version_id=new_version_id,
+            result=result,
+            created_at=datetime.utcnow()
+        )
+        await self.db.execute(statement.on_conflict_do_update(
+            index_elements=[VersionDiff.old_version_id, VersionDiff.new_version_id],
+            set_={"result": statement.excluded.result, "created_at": statement.excluded.created_at}
+        ))
+
+    # 表格单元格
+    async def find_cells(
+        self,
+        version_id: int,
+        row: Optional[str] = None,
+        column: Optional[str] = None,
+        sequence_in_doc: Optional[int] = None,
+        limit: int = 100
+    ) -> List[Dict]:
+        """按行名（第一列的值）、列名（表头）和所在表格查询单元格"""
+        query = select(TableCell).where(TableCell.version_id == version_id)
+        if row is not None:
+            query = query.where(TableCell.row_label == row)
+        if column is not None:
+            query = query.where(TableCell.column_name == column)
+        if sequence_in_doc is not None:
+            query = query.where(TableCell.sequence_in_doc == sequence_in_doc)
+        query = query.order_by(TableCell.sequence_in_doc, TableCell.row_index, TableCell.col_index).limit(limit)
+        return [model_to_dict(cell) for cell in (await self.db.execute(query)).scalars()]
+
+    async def cell_labels(self, version_id: int) -> Optional[Tuple[frozenset, frozenset]]:
+        """
+        版本表格的 (行名集合, 列名集合)，没有单元格时返回None
+        每次只按索引取一条单元格ID作为签名（同时判断是否有单元格）；单元格在入库完成时整体写入、清理时整体删除，
+        ID变化说明单元格已被替换，此时才重新读取行名和列名
+        """
+        signature = (await self.db.execute(
+            select(TableCell.cell_id).where(TableCell.version_id == version_id).limit(1)
+        )).scalar()
+        if signature is None:
+            _cell_labels.pop(version_id)
+            return None
+        cached = _cell_labels.get(version_id)
+        if cached is not None and cached[0] == signature:
+            return cached[1], cached[2]
+        rows = (await self.db.execute(
+            select(TableCell.row_label, TableCell.column_name)
+            .where(TableCell.version_id == version_id, TableCell.col_index > 0)
+            .distinct()
+        )).all()
+        row_labels = frozenset(row.row_label for row in rows)
+        column_names = frozenset(row.column_name for row in rows)
+        _cell_labels.put(version_id, (signature, row_labels, column_names))
+        return row_labels, column_names
+
+    async def match_cells(self, version_id: int, text: str, min_chars: int, limit: int = 20) -> List[Dict]:
+        """
+        查找行名和列名都出现在text中的单元格（不含第一列本身），按匹配长度从长到短排列
+        先用内存中的行名、列名判断，都有出现时才按名称读取单元格；版本没有表格时不查询单元格
+        """
+        labels = await self.cell_labels(version_id)
+        if labels is None:
+            return []
+        rows = [label for label in labels[0] if len(label) >= min_chars and label in text]
+        columns = [name for name in labels[1] if len(name) >= min_chars and name in text]
+        if not rows or not columns:
+            return []
+        matched = func.length(TableCell.row_label) + func.length(TableCell.column_name)
+        query = (
+            select(TableCell)
+            .where(
+                TableCell.version_id == version_id,
+                TableCell.col_index > 0,
+                TableCell.row_label.in_(rows),
+                TableCell.column_name.in_(columns)
+            )
+            .order_by(matched.desc(), TableCell.sequence_in_doc, TableCell.row_index)
+            .limit(limit)
+        )
+        return [model_to_dict(cell) for cell in (await self.db.execute(query)).scalars()]
+
+    # 入库任务
+    async def latest_job_id(self, version_id: int) -> Optional[int]:
+        result = await self.db.execute(
+            select(func.max(IngestionJob.job_id)).where(IngestionJob.version_id == version_id)
+        )
+        return result.scalar()
+
+    async def ingestion_job_counts(self) -> Dict[str, int]:
+        """各状态的入库任务数"""
+        result = await self.db.execute(
+            select(IngestionJob.status, func.count(IngestionJob.job_id)).group_by(IngestionJob.status)
+        )
+        return {status: count for status, count in result}
+
+    async def ingestion_stage_totals(self, stages: Tuple[str, ...]) -> Tuple[int, Dict[str, float]]:
+        """
+        已完成入库任务的数量及各阶段累计耗时（秒）
+        入库在独立的工作进程中执行，耗时记录在任务的timings字段中
+        """
+        columns = [
+            func.coalesce(func.sum(func.json_extract(IngestionJob.timings, f"$.{stage}")), 0.0)
+            for stage in stages
+        ]
+        row = (await self.db.execute(
+            select(func.count(IngestionJob.job_id), *columns)
+            .where(IngestionJob.status == "done", IngestionJob.timings.isnot(None))
+        )).one()
+        return row[0], dict(zip(stages, row[1:]))
+
+    # 设置
+    async def get_setting(self, key: str) -> Optional[str]:
+        result = await self.db.execute(select(Setting.value).where(Setting.key == key))
+        return result.scalar()
+
+    async def set_setting(self, key: str, value: str):
+        await self.db.merge(Setting(key=key, value=value))
+
+async def get_repository(db: AsyncSession = Depends(get_db)) -> Repository:
+    return Repository(db)
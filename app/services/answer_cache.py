@@ -0,0 +1,183 @@
+import threading
+from array import array
+from typing import List, Dict, Optional
+
+import numpy as np
+from sqlalchemy import func, update
+
+from app.models.database import SessionLocal, AnswerCacheEntry
+from app.services.embedding_cache import text_hash
+from app.services.metrics import ANSWER_CACHE_TOTAL
+from app.config import (
+    ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    ANSWER_CACHE_MAX_ENTRIES_PER_VERSION,
+    ANSWER_CACHE_HIT_FLUSH_SIZE
+)
+
+def _pack(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+class AnswerCache:
+    """
+    按文档版本缓存问答结果，命中时无需调用LLM
+    两级查找：
+    1. 精确匹配 —— 规范化后的问题文本哈希相同
+    2. 语义匹配 —— 问题向量与已缓存问题的余弦相似度不低于阈值
+    版本重新入库时该版本的缓存会被清空（见JobQueue.complete）
+    命中次数先在内存中累计，攒够ANSWER_CACHE_HIT_FLUSH_SIZE次或写入新条目时批量写回，查找本身不写数据库
+    """
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        similarity_threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        max_entries_per_version: int = ANSWER_CACHE_MAX_ENTRIES_PER_VERSION
+    ):
+        self.session_factory = session_factory
+        self.similarity_threshold = similarity_threshold
+        self.max_entries_per_version = max_entries_per_version
+        self._lock = threading.Lock()
+        # entry_id -> 尚未写回的命中次数
+        self._pending_hits: Dict[int, int] = {}
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "bypassed": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+        ANSWER_CACHE_TOTAL.inc(result=name)
+
+    def _record_hit(self, entry_id: int):
+        with self._lock:
+            self._pending_hits[entry_id] = self._pending_hits.get(entry_id, 0) + 1
+            full = sum(self._pending_hits.values()) >= ANSWER_CACHE_HIT_FLUSH_SIZE
+        if full:
+            self.flush_hits()
+
+    def flush_hits(self, db=None):
+        """把累计的命中次数写回数据库；传入db时在调用方的事务中执行，由调用方提交"""
+        with self._lock:
+            pending, self._pending_hits = self._pending_hits, {}
+        if not pending:
+            return
+        if db is not None:
+            self._write_hits(db, pending)
+            return
+        with self.session_factory() as db:
+            self._write_hits(db, pending)
+            db.commit()
+
+    @staticmethod
+    def _write_hits(db, pending: Dict[int, int]):
+        for entry_id, hits in pending.items():
+            db.execute(
+                update(AnswerCacheEntry)
+                .where(AnswerCacheEntry.entry_id == entry_id)
+                .values(hit_count=AnswerCacheEntry.hit_count + hits)
+            )
+
+    @staticmethod
+    def _to_result(entry: AnswerCacheEntry, match: str, similarity: float = 1.0) -> Dict:
+        return {
+            "answer": entry.answer,
+            "retrieved_chunk_html_ids": entry.retrieved_chunk_html_ids,
+            "match": match,
+            "similarity": similarity
+        }
+
+    def lookup_exact(self, version_id: int, query: str) -> Optional[Dict]:
+        with self.session_factory() as db:
+            entry = db.query(AnswerCacheEntry).filter_by(
+                version_id=version_id,
+                query_hash=text_hash(query)
+            ).first()
+            if entry is None:
+                return None
+            result = self._to_result(entry, "exact")
+        self._record_hit(entry.entry_id)
+        self._count("exact_hits")
+        return result
+
+    def lookup_similar(self, version_id: int, query_embedding: List[float]) -> Optional[Dict]:
+        """
+        语义查找，未命中时计入miss
+        只读取条目ID和问题向量，一次矩阵乘法算出全部余弦相似度，再按ID读取最相似的条目
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = float(np.linalg.norm(query))
+        with self.session_factory() as db:
+            rows = db.query(AnswerCacheEntry.entry_id, AnswerCacheEntry.query_embedding).filter(
+                AnswerCacheEntry.version_id == version_id,
+                AnswerCacheEntry.query_embedding.isnot(None)
+            ).all()
+            # 切换嵌入模型前写入的条目维度不同，不参与比较
+            rows = [row for row in rows if len(row.query_embedding) == query.nbytes]
+            best_entry = None
+            if rows and query_norm:
+                matrix = np.frombuffer(b"".join(row.query_embedding for row in rows), dtype=np.float32)
+                matrix = matrix.reshape(len(rows), query.size)
+                norms = np.linalg.norm(matrix, axis=1) * query_norm
+                similarities = np.divide(matrix @ query, norms, out=np.zeros(len(rows), dtype=np.float32), where=norms > 0)
+                best = int(np.argmax(similarities))
+                best_similarity = float(similarities[best])
+                if best_similarity >= self.similarity_threshold:
+                    best_entry = db.get(AnswerCacheEntry, rows[best].entry_id)
+
+            if best_entry is None:
+                self._count("misses")
+                return None
+            result = self._to_result(best_entry, "semantic", best_similarity)
+        self._record_hit(best_entry.entry_id)
+        self._count("semantic_hits")
+        return result
+
+    def record_miss(self):
+        self._count("misses")
+
+    def record_bypass(self):
+        self._count("bypassed")
+
+    def store(
+        self,
+        version_id: int,
+        query: str,
+        query_embedding: Optional[List[float]],
+        answer: str,
+        retrieved_chunk_html_ids: str
+    ):
+        """保存问答结果（同时写回累计的命中次数），超过单版本上限时删除最早的条目"""
+        with self.session_factory() as db:
+            self.flush_hits(db)
+            db.add(AnswerCacheEntry(
+                version_id=version_id,
+                query_hash=text_hash(query),
+                query_text=query,
+                query_embedding=_pack(query_embedding) if query_embedding else None,
+                answer=answer,
+                retrieved_chunk_html_ids=retrieved_chunk_html_ids
+            ))
+            db.flush()
+
+            count = db.query(func.count(AnswerCacheEntry.entry_id)).filter_by(version_id=version_id).scalar()
+            overflow = count - self.max_entries_per_version
+            if overflow > 0:
+                oldest = db.query(AnswerCacheEntry.entry_id).filter_by(version_id=version_id) \
+                    .order_by(AnswerCacheEntry.entry_id).limit(overflow).subquery()
+                db.query(AnswerCacheEntry).filter(AnswerCacheEntry.entry_id.in_(oldest.select())) \
+                    .delete(synchronize_session=False)
+            db.commit()
+
+    @staticmethod
+    def invalidate_version(db, version_id: int) -> int:
+        """清空某个版本的缓存（在调用方的事务中执行）"""
+        return db.query(AnswerCacheEntry).filter_by(version_id=version_id).delete()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["exact_hits"] + counters["semantic_hits"] + counters["misses"]
+        counters["hit_rate"] = (
+            (counters["exact_hits"] + counters["semantic_hits"]) / lookups if lookups else 0.0
+        )
+        self.flush_hits()
+        with self.session_factory() as db:
+            counters["entries"] = db.query(func.count(AnswerCacheEntry.entry_id)).scalar()
+        return counters
@@ -0,0 +1,123 @@
+import re
+import html
+from typing import List, Dict, Optional
+
+from sqlalchemy import or_
+
+from app.models.database import DocumentBlock, TableCell, VersionDiff
+from app.services.version_diff import block_fingerprint
+
+# 未转义的竖线才是Markdown表格的列分隔符
+_CELL_SEPARATOR = re.compile(r"(?<!\\)\|")
+_SEPARATOR_ROW = re.compile(r"^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$")
+
+def parse_markdown_table(markdown: str) -> List[List[str]]:
+    """将Markdown表格解析为二维单元格列表（第一行为表头，不含分隔行）"""
+    rows = []
+    for line in markdown.strip().splitlines():
+        line = line.strip()
+        if not line or _SEPARATOR_ROW.match(line):
+            continue
+        if line.startswith("|"):
+            line = line[1:]
+        if line.endswith("|") and not line.endswith("\\|"):
+            line = line[:-1]
+        rows.append([cell.strip().replace("\\|", "|") for cell in _CELL_SEPARATOR.split(line)])
+    return rows
+
+def _render_rows(rows: List[List[str]]) -> str:
+    return "".join(
+        "<tr>" + "".join(f"<td>{html.escape(cell)}</td>" for cell in row) + "</tr>"
+        for row in rows
+    )
+
+def render_table(markdown: str, row_groups: Optional[List[Dict]] = None) -> str:
+    """
+    将Markdown表格渲染为HTML表格
+    表格切分为多个行组时，每个行组渲染为带id的<tbody>，引用可以精确定位到行组
+    """
+    rows = parse_markdown_table(markdown)
+    if not rows:
+        return f"<pre>{html.escape(markdown)}</pre>"
+
+    header = "".join(f"<th>{html.escape(cell)}</th>" for cell in rows[0])
+    data_rows = rows[1:]
+    if row_groups and len(row_groups) > 1:
+        body = "".join(
+            f'<tbody id="{html.escape(group["html_id"], quote=True)}">'
+            f'{_render_rows(data_rows[group["row_start"]:group["row_end"]])}</tbody>'
+            for group in row_groups
+        )
+    else:
+        body = f"<tbody>{_render_rows(data_rows)}</tbody>"
+    return f"<table><thead><tr>{header}</tr></thead>{body}</table>"
+
+def render_block(block: Dict) -> str:
+    """
+    渲染单个内容块
+    段落 -> <p id="html_id">...</p>
+    表格 -> <div id="html_id"><table>...</table></div>
+    """
+    html_id = html.escape(block['html_id'], quote=True)
+    if block['type'] == 'table':
+        table = render_table(block["content"], block.get('row_groups'))
+        return f'<div id="{html_id}" class="doc-block doc-table">{table}</div>'
+    text = html.escape(block['content']).replace("\n", "<br>")
+    return f'<p id="{html_id}" class="doc-block">{text}</p>'
+
+def table_cells(version_id: int, block: Dict) -> List[Dict]:
+    """
+    将表格块展开为单元格记录（不含表头行）
+    每个单元格记录所在行组的html_id，行名取该行第一列的值，列名取表头
+    """
+    rows = parse_markdown_table(block['content'])
+    if len(rows) < 2:
+        return []
+    header = rows[0]
+    groups = block.get('row_groups') or [{'html_id': block['html_id'], 'row_start': 0, 'row_end': len(rows) - 1}]
+
+    cells = []
+    for group in groups:
+        for row_index in range(group['row_start'], min(group['row_end'], len(rows) - 1)):
+            row = rows[row_index + 1]
+            for col_index, value in enumerate(row):
+                cells.append({
+                    'version_id': version_id,
+                    'sequence_in_doc': block['sequence'],
+                    'html_id': group['html_id'],
+                    'row_index': row_index,
+                    'col_index': col_index,
+                    'row_label': row[0],
+                    'column_name': header[col_index] if col_index < len(header) else "",
+                    'value': value
+                })
+    return cells
+
+def save_version_blocks(db, version_id: int, processed_blocks: List[Dict]) -> int:
+    """
+    保存版本的全部内容块及其预渲染HTML，并将表格展开到单元格表（在调用方的事务中执行）
+    重复入库时先删除旧块和涉及该版本的对比缓存，保证幂等
+    """
+    db.query(DocumentBlock).filter_by(version_id=version_id).delete()
+    db.query(TableCell).filter_by(version_id=version_id).delete()
+    db.query(VersionDiff).filter(
+        or_(VersionDiff.old_version_id == version_id, VersionDiff.new_version_id == version_id)
+    ).delete(synchronize_session=False)
+    db.bulk_insert_mappings(DocumentBlock, [
+        {
+            'version_id': version_id,
+            'html_id': block['html_id'],
+            'block_type': block['type'],
+            'sequence_in_doc': block['sequence'],
+            'content': block['content'],
+            'html': render_block(block),
+            'fingerprint': block_fingerprint(block['type'], block['content'])
+        }
+        for block in processed_blocks
+    ])
+    db.bulk_insert_mappings(TableCell, [
+        cell
+        for block in processed_blocks if block['type'] == 'table'
+        for cell in table_cells(version_id, block)
+    ])
+    return len(processed_blocks)
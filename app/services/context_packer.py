@@ -0,0 +1,239 @@
+import re
+import logging
+from typing import List, Dict, Optional, Callable
+
+from app.config import CONTEXT_MIN_SEGMENT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+_CJK_CHAR = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+_WORD = re.compile(r"[A-Za-z0-9]+")
+
+# 重叠检测的最短重叠长度（字符），更短的重复视为巧合
+_MIN_OVERLAP = 8
+
+def estimate_tokens(text: str) -> int:
+    """没有分词器时的估算：中文每字一个token，其余按单词和符号计"""
+    cjk = len(_CJK_CHAR.findall(text))
+    words = len(_WORD.findall(text))
+    others = sum(1 for c in _CJK_CHAR.sub("", _WORD.sub("", text)) if not c.isspace())
+    return cjk + words + others
+
+def create_token_counter(embed_model=None) -> Callable[[str], int]:
+    """
+    使用嵌入模型的分词器计数（bge为BERT分词器，中文基本一字一token，与LLM计数接近）
+    取不到分词器时退回估算
+    """
+    tokenizer = getattr(embed_model, "_tokenizer", None) if embed_model is not None else None
+    if tokenizer is None:
+        return estimate_tokens
+
+    def count(text: str) -> int:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return count
+
+def merge_overlapping(first: str, second: str) -> str:
+    """
+    拼接同一段落相邻的两个chunk，去掉second开头与first结尾重叠的部分
+    second已完整包含在first中时直接返回first
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+
+    probe = second[:_MIN_OVERLAP]
+    position = first.rfind(probe) if len(probe) == _MIN_OVERLAP else -1
+    while position != -1:
+        tail = first[position:]
+        if second.startswith(tail):
+            return first + second[len(tail):]
+        position = first.rfind(probe, 0, position)
+    return first + "\n" + second
+
+class PackedContext:
+    """
+    打包后的上下文
+    segments：按文档顺序排列的片段，每个片段由一个或多个相邻块合并而成
+    html_ids：被放入提示词的块（用作引用来源）
+    tokens：上下文部分的token数；prompt_tokens由LLMService在生成完整提示词后填写
+    """
+    def __init__(self, segments: List[Dict], tokens: int, dropped: int = 0, truncated: int = 0):
+        self.segments = segments
+        self.tokens = tokens
+        self.dropped = dropped
+        self.truncated = truncated
+        self.prompt_tokens: Optional[int] = None
+
+    @property
+    def html_ids(self) -> List[str]:
+        return [html_id for segment in self.segments for html_id in segment['html_ids']]
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(segment['text'] for segment in self.segments)
+
+    def stats(self) -> Dict:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "context_tokens": self.tokens,
+            "segments": len(self.segments),
+            "dropped": self.dropped,
+            "truncated": self.truncated
+        }
+
+class ContextPacker:
+    """
+    上下文打包：
+    1. 同一块的多个chunk按chunk_index拼接并去掉重叠文本
+    2. sequence_in_doc相邻的块合并为一个片段
+    3. 按片段得分从高到低放入，直到达到token预算；放不下的大表格按行截断、长段落按长度截断
+    4. 最终按文档顺序输出，保持上下文连贯
+    """
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int] = estimate_tokens,
+        min_segment_tokens: int = CONTEXT_MIN_SEGMENT_TOKENS
+    ):
+        self.count_tokens = count_tokens
+        self.min_segment_tokens = min_segment_tokens
+
+    @staticmethod
+    def _format_block(block: Dict) -> str:
+        if block['block_type'] == 'table':
+            return f"表格内容：\n{block['text']}"
+        return block['text']
+
+    def _group_blocks(self, context_blocks: List[Dict]) -> List[Dict]:
+        """按html_id合并chunk，返回按文档顺序排列的块"""
+        groups: Dict[str, Dict] = {}
+        for block in context_blocks:
+            metadata = block['metadata']
+            html_id = metadata['html_id']
+            group = groups.setdefault(html_id, {
+                'html_id': html_id,
+                'block_type': metadata.get('block_type', 'paragraph'),
+                'sequence': metadata.get('sequence_in_doc', 0),
+                'score': block.get('score') or 0.0,
+                'chunks': {}
+            })
+            group['score'] = max(group['score'], block.get('score') or 0.0)
+            group['chunks'].setdefault(metadata.get('chunk_index', 0), block['content'])
+
+        for group in groups.values():
+            text = ""
+            for _, chunk in sorted(group.pop('chunks').items()):
+                text = merge_overlapping(text, chunk) if text else chunk
+            group['text'] = text
+        return sorted(groups.values(), key=lambda group: group['sequence'])
+
+    def _merge_adjacent(self, blocks: List[Dict]) -> List[Dict]:
+        segments = []
+        for block in blocks:
+            last = segments[-1] if segments else None
+            if last is not None and block['sequence'] == last['sequence_end'] + 1:
+                last['blocks'].append(block)
+                last['sequence_end'] = block['sequence']
+                last['score'] = max(last['score'], block['score'])
+            else:
+                segments.append({
+                    'blocks': [block],
+                    'sequence_start': block['sequence'],
+                    'sequence_end': block['sequence'],
+                    'score': block['score']
+                })
+        for segment in segments:
+            segment['html_ids'] = [block['html_id'] for block in segment['blocks']]
+            segment['text'] = "\n".join(self._format_block(block) for block in segment['blocks'])
+            segment['tokens'] = self.count_tokens(segment['text'])
+        return segments
+
+    def _truncate(self, segment: Dict, budget: int) -> Optional[Dict]:
+        """将片段截断到预算内：逐块放入，放不下的表格按行截断、段落按长度截断"""
+        parts, html_ids, used = [], [], 0
+        for block in segment['blocks']:
+            text = self._format_block(block)
+            tokens = self.count_tokens(text)
+            if used + tokens > budget:
+                remaining = budget - used
+                if remaining >= self.min_segment_tokens:
+                    if block['block_type'] == 'table':
+                        text = self._truncate_table(block['text'], remaining)
+                    else:
+                        text = self._truncate_text(text, remaining)
+                    if text:
+                        parts.append(text)
+                        html_ids.append(block['html_id'])
+                        used += self.count_tokens(text)
+                break
+            parts.append(text)
+            html_ids.append(block['html_id'])
+            used += tokens
+
+        if not parts:
+            return None
+        return {**segment, 'html_ids': html_ids, 'text': "\n".join(parts), 'tokens': used}
+
+    def _truncate_table(self, markdown: str, budget: int) -> str:
+        """保留表头和分隔行，逐行放入直到预算用完，并注明截断"""
+        lines = markdown.split("\n")
+        header, rows = lines[:2], lines[2:]
+        note = f"（表格共{len(rows)}行，仅列出前{{}}行）"
+        used = self.count_tokens("表格内容：\n" + "\n".join(header) + "\n" + note.format(len(rows)))
+        kept = []
+        for row in rows:
+            # 逐行累加计数，避免每加一行都重新计算整张表
+            tokens = self.count_tokens(row) + 1
+            if used + tokens > budget:
+                break
+            kept.append(row)
+            used += tokens
+        if not kept:
+            return ""
+        return "表格内容：\n" + "\n".join(header + kept) + "\n" + note.format(len(kept))
+
+    def _truncate_text(self, text: str, budget: int) -> str:
+        """二分查找预算内能保留的最长前缀"""
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(text[:middle] + "……") <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low] + "……" if low else ""
+
+    def pack(self, context_blocks: List[Dict], budget: int) -> PackedContext:
+        """在budget个token内打包检索结果"""
+        segments = self._merge_adjacent(self._group_blocks(context_blocks))
+
+        selected, used, dropped, truncated = [], 0, 0, 0
+        for segment in sorted(segments, key=lambda segment: segment['score'], reverse=True):
+            remaining = budget - used
+            if segment['tokens'] <= remaining:
+                selected.append(segment)
+                used += segment['tokens']
+                continue
+            partial = self._truncate(segment, remaining) if remaining >= self.min_segment_tokens else None
+            if partial is None:
+                dropped += 1
+                continue
+            selected.append(partial)
+            used += partial['tokens']
+            truncated += 1
+
+        selected.sort(key=lambda segment: segment['sequence_start'])
+        segments = [
+            {
+                'html_ids': segment['html_ids'],
+                'sequence_start': segment['sequence_start'],
+                'sequence_end': segment['sequence_end'],
+                'score': segment['score'],
+                'tokens': segment['tokens'],
+                'text': segment['text']
+            }
+            for segment in selected
+        ]
+        if dropped or truncated:
+            logger.info(f"上下文超出预算：丢弃 {dropped} 个片段，截断 {truncated} 个片段（预算 {budget} tokens）")
+        return PackedContext(segments, used, dropped, truncated)
@@ -1,32 +1,90 @@
+import os
 import json
-from typing import List, Dict
-from llama_index import Document, VectorStoreIndex, ServiceContext
+import logging
+import threading
+from typing import List, Dict, Optional, Tuple
+from llama_index import Document
 from llama_index.node_parser import SimpleNodeParser
-from llama_index.embeddings import HuggingFaceEmbedding
-from llama_index.vector_stores import ChromaVectorStore
-import chromadb
 from app.config import (
     CHROMA_DB_PATH,
-    EMBEDDING_MODEL_NAME,
+    VECTOR_BACKEND,
     CHUNK_SIZE,
-    CHUNK_OVERLAP
+    CHUNK_OVERLAP,
+    RETRIEVAL_TOP_K,
+    EMBED_QUERY_BATCH_WINDOW_MS,
+    EMBEDDING_SERVER_SOCKET,
+    EMBEDDING_CACHE_ENABLED,
+    HYBRID_RETRIEVAL_ENABLED
 )
+from app.services.vector_store import VectorStore, create_chroma_client
+from app.services.mmap_index import MmapVectorStore
+from app.services.ingestion import IngestionPipeline, ProgressCallback
+from app.services.embedding_cache import EmbeddingCache
+from app.services.embeddings import create_embed_model, embed_queries, QueryEmbeddingBatcher
+from app.services.lexical_index import LexicalIndexStore, looks_like_identifier, reciprocal_rank_fusion
+from app.services.metrics import span
+from app.services.context_packer import create_token_counter
+from app.services.tables import split_table
+
+logger = logging.getLogger(__name__)
+
+# LlamaIndex写入ChromaDB时附加的内部元数据字段和分片的删除标记，不对外返回
+_INTERNAL_METADATA_KEYS = {"document_id", "doc_id", "ref_doc_id", "is_deleted", "live_version_id"}
 
 class DocumentProcessor:
     def __init__(self):
-        # 初始化ChromaDB客户端
-        self.chroma_client = chromadb.PersistentClient(path=str(CHROMA_DB_PATH))
-        
-        # 初始化嵌入模型
-        self.embed_model = HuggingFaceEmbedding(
-            model_name=EMBEDDING_MODEL_NAME
-        )
+        # 初始化嵌入模型（按EMBEDDING_BACKEND使用PyTorch或ONNX，或连接嵌入服务），向量缓存按模型名区分后端
+        self.embed_model = create_embed_model()
+        self.embed_model_name = self.embed_model.model_name
+        # 并发请求的问题合并为微批编码（使用嵌入服务时由服务端跨进程合并）
+        self.query_batcher = QueryEmbeddingBatcher(
+            lambda queries: embed_queries(self.embed_model, queries)
+        ) if EMBED_QUERY_BATCH_WINDOW_MS > 0 and not EMBEDDING_SERVER_SOCKET else None
         
         # 初始化节点解析器
         self.node_parser = SimpleNodeParser.from_defaults(
             chunk_size=CHUNK_SIZE,
             chunk_overlap=CHUNK_OVERLAP
         )
+        # 表格行组按嵌入模型的分词器计数
+        self.count_tokens = create_token_counter(self.embed_model)
+        
+        # 入库流水线：切分一次、分批向量化、批量写入
+        self.embedding_cache = EmbeddingCache() if EMBEDDING_CACHE_ENABLED else None
+        self.lexical_store = LexicalIndexStore()
+        self.pipeline = IngestionPipeline(
+            self.embed_model,
+            self.node_parser,
+            model_name=self.embed_model_name,
+            embedding_cache=self.embedding_cache,
+            lexical_store=self.lexical_store
+        )
+        
+        # 向量库：VECTOR_BACKEND为mmap时使用内存映射索引，未转换的旧版本从ChromaDB读取；
+        # 否则按VECTOR_LAYOUT每版本一个collection或写入固定数量的分片（分片需要ChromaDB服务）
+        self._chroma_store: Optional[VectorStore] = None
+        self._chroma_lock = threading.Lock()
+        if VECTOR_BACKEND == "mmap":
+            self.vector_store = MmapVectorStore(fallback=self.legacy_chroma_store)
+        else:
+            self.vector_store = self.chroma_store()
+
+    def chroma_store(self) -> VectorStore:
+        """ChromaDB向量库，首次使用时创建客户端（配置了ChromaDB服务时经HTTP访问）"""
+        with self._chroma_lock:
+            if self._chroma_store is None:
+                self._chroma_store = VectorStore(create_chroma_client())
+            return self._chroma_store
+
+    def legacy_chroma_store(self) -> Optional[VectorStore]:
+        """mmap后端读取旧版本用的ChromaDB向量库，数据目录不存在时返回None（不创建空库）"""
+        if self._chroma_store is None and not os.path.exists(CHROMA_DB_PATH):
+            return None
+        return self.chroma_store()
+        
+    def warm_up(self):
+        """执行一次预热编码，使模型权重和计算图在首个请求前加载完毕"""
+        self.embed_model.get_text_embedding("预热")
         
     def process_document(
         self,
@@ -42,6 +100,26 @@ class DocumentProcessor:
         3. 向量化并存储到ChromaDB
         4. 返回处理后的块信息（包含html_id）
         """
+        processed_blocks, _ = self.ingest_document(
+            content_blocks,
+            version_id,
+            doc_base_id,
+            project_id
+        )
+        return processed_blocks
+        
+    def ingest_document(
+        self,
+        content_blocks: List[Dict],
+        version_id: int,
+        doc_base_id: int,
+        project_id: str,
+        progress_callback: Optional[ProgressCallback] = None
+    ) -> Tuple[List[Dict], Dict]:
+        """
+        与process_document相同，额外返回入库流水线的统计信息（各阶段耗时等）
+        同一版本重复入库是幂等的，不会产生重复向量
+        """
         # 为每个内容块创建唯一的html_id
         processed_blocks = []
         for block in content_blocks:
@@ -56,88 +134,153 @@ class DocumentProcessor:
                 'doc_base_id': doc_base_id,
                 'project_id': project_id
             }
+            if block_type == 'table':
+                # 表格按整行切分为行组，每个行组重复表头并拥有独立的html_id
+                processed_block['row_groups'] = split_table(block['content'], html_id, self.count_tokens)
             processed_blocks.append(processed_block)
             
-        # 创建Document对象
-        documents = [
-            Document(
-                text=block['content'],
-                metadata={
-                    'html_id': block['html_id'],
-                    'version_id': version_id,
-                    'doc_base_id': doc_base_id,
-                    'project_id': project_id,
-                    'block_type': block['type'],
-                    'sequence_in_doc': block['sequence']
-                }
-            )
-            for block in processed_blocks
-        ]
-        
-        # 解析为节点
-        nodes = self.node_parser.get_nodes_from_documents(documents)
-        
-        # 获取或创建collection
-        collection_name = f"version_{version_id}"
-        collection = self.chroma_client.get_or_create_collection(
-            name=collection_name,
-            metadata={"version_id": version_id}
-        )
+        # 创建Document对象（表格的每个行组单独成为一个Document）
+        documents = []
+        for block in processed_blocks:
+            metadata = {
+                'html_id': block['html_id'],
+                'version_id': version_id,
+                'doc_base_id': doc_base_id,
+                'project_id': project_id,
+                'block_type': block['type'],
+                'sequence_in_doc': block['sequence']
+            }
+            if block['type'] != 'table':
+                documents.append(Document(text=block['content'], metadata=metadata))
+                continue
+            for group in block['row_groups']:
+                documents.append(Document(
+                    text=group['content'],
+                    metadata={
+                        **metadata,
+                        'html_id': group['html_id'],
+                        'table_html_id': block['html_id'],
+                        'row_start': group['row_start'],
+                        'row_end': group['row_end']
+                    }
+                ))
         
-        # 创建向量存储
-        vector_store = ChromaVectorStore(
-            chroma_collection=collection
-        )
+        # 切分、向量化并写入向量库（ChromaDB按VECTOR_LAYOUT写入collection，或写入内存映射索引）
+        stats = self.pipeline.run(documents, self.vector_store, version_id, progress_callback)
         
-        # 创建索引
-        service_context = ServiceContext.from_defaults(
-            embed_model=self.embed_model,
-            node_parser=self.node_parser
-        )
-        index = VectorStoreIndex.from_documents(
-            documents,
-            service_context=service_context,
-            vector_store=vector_store
-        )
+        return processed_blocks, stats
         
-        return processed_blocks
+    def count_chunks(self, version_id: int) -> int:
+        """版本在向量库中的chunk数（已软删除的版本为0）"""
+        return self.vector_store.count(version_id)
         
-    def query_document(
+    def mark_version_deleted(self, version_id: int, deleted: bool = True) -> int:
+        """更新向量库中版本记录的is_deleted标记，检索时不再返回已删除版本的内容"""
+        return self.vector_store.set_deleted(version_id, deleted)
+        
+    def prewarm(self, version_id: int) -> bool:
+        """预先打开指定版本所在的collection，返回是否成功"""
+        try:
+            self.vector_store.prewarm(version_id)
+            return True
+        except Exception as e:
+            logger.warning(f"预热版本 {version_id} 的检索器失败: {str(e)}")
+            return False
+            
+    @staticmethod
+    def _distance_to_score(distance: float, space: str) -> float:
+        """
+        将ChromaDB返回的距离转换为相似度分数
+        bge向量已归一化，l2距离（平方）与余弦相似度满足 cos = 1 - d / 2
+        """
+        if space == "cosine":
+            return 1.0 - distance
+        if space == "ip":
+            return -distance
+        return 1.0 - distance / 2.0
+        
+    def embed_query(self, query_text: str) -> List[float]:
+        """对问题编码"""
+        with span("embed_query"):
+            if self.query_batcher is not None:
+                return self.query_batcher.embed(query_text)
+            return self.embed_model.get_query_embedding(query_text)
+        
+    def _vector_search(
         self,
         query_text: str,
         version_id: int,
-        top_k: int = 5
+        top_k: int,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Dict]:
         """
-        查询文档内容
-        返回相关的文档块及其元数据
+        仅检索：对问题编码一次，直接在collection中查询top-k
+        不经过LlamaIndex查询引擎，因此不会触发额外的回答合成步骤
         """
-        collection_name = f"version_{version_id}"
-        collection = self.chroma_client.get_collection(name=collection_name)
-        
-        # 创建查询索引
-        vector_store = ChromaVectorStore(chroma_collection=collection)
-        index = VectorStoreIndex.from_vector_store(
-            vector_store,
-            service_context=ServiceContext.from_defaults(
-                embed_model=self.embed_model
-            )
-        )
+        if query_embedding is None:
+            query_embedding = self.embed_query(query_text)
         
-        # 执行查询
-        query_engine = index.as_query_engine(
-            similarity_top_k=top_k
-        )
-        response = query_engine.query(query_text)
+        with span("vector_search"):
+            result, space = self.vector_store.query(version_id, query_embedding, top_k)
         
-        # 提取结果
-        source_nodes = response.source_nodes
         results = []
-        for node in source_nodes:
+        for chunk_id, text, metadata, distance in zip(
+            result["ids"][0],
+            result["documents"][0],
+            result["metadatas"][0],
+            result["distances"][0]
+        ):
+            metadata = {
+                key: value for key, value in (metadata or {}).items()
+                if not key.startswith("_") and key not in _INTERNAL_METADATA_KEYS
+            }
             results.append({
-                'content': node.text,
-                'metadata': node.metadata,
-                'score': node.score if hasattr(node, 'score') else None
+                'id': chunk_id,
+                'content': text,
+                'metadata': metadata,
+                'score': self._distance_to_score(distance, space)
             })
             
-        return results 
\ No newline at end of file
+        return results
+        
+    def retrieve(
+        self,
+        query_text: str,
+        version_id: int,
+        top_k: int = RETRIEVAL_TOP_K,
+        query_embedding: Optional[List[float]] = None
+    ) -> List[Dict]:
+        """
+        混合检索：BM25倒排索引与向量检索结果按倒数排名融合
+        零件号、条款号等编号类问题直接走倒排索引，不调用嵌入模型；
+        未建立倒排索引的旧版本只使用向量检索
+        已有问题向量时可通过query_embedding传入，避免重复编码
+        """
+        lexical_index = self.lexical_store.get(version_id) if HYBRID_RETRIEVAL_ENABLED else None
+        if lexical_index is None:
+            return self._vector_search(query_text, version_id, top_k, query_embedding)
+            
+        if looks_like_identifier(query_text):
+            with span("lexical_search"):
+                results = lexical_index.search(query_text, top_k)
+            if results:
+                return results
+                
+        # 两路各多取一些候选，融合后再截断
+        candidates = top_k * 2
+        vector_results = self._vector_search(query_text, version_id, candidates, query_embedding)
+        with span("lexical_search"):
+            lexical_results = lexical_index.search(query_text, candidates)
+        return reciprocal_rank_fusion([vector_results, lexical_results])[:top_k]
+        
+    def query_document(
+        self,
+        query_text: str,
+        version_id: int,
+        top_k: int = RETRIEVAL_TOP_K
+    ) -> List[Dict]:
+        """
+        查询文档内容
+        返回相关的文档块及其元数据
+        """
+        return self.retrieve(query_text, version_id, top_k)
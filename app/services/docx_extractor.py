@@ -0,0 +1,192 @@
+import os
+import zipfile
+import logging
+import xml.etree.ElementTree as ET
+from typing import List, Dict
+
+logger = logging.getLogger(__name__)
+
+# WordprocessingML命名空间
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+def _w(tag: str) -> str:
+    return f"{{{W_NS}}}{tag}"
+
+W_BODY = _w("body")
+W_P = _w("p")
+W_TBL = _w("tbl")
+W_TR = _w("tr")
+W_TC = _w("tc")
+W_T = _w("t")
+W_TAB = _w("tab")
+W_BR = _w("br")
+W_CR = _w("cr")
+W_TC_PR = _w("tcPr")
+W_GRID_SPAN = _w("gridSpan")
+W_V_MERGE = _w("vMerge")
+W_VAL = _w("val")
+
+# 正文中可以包裹段落/表格的容器（内容控件）
+_TRANSPARENT_CONTAINERS = {_w("sdt"), _w("sdtContent")}
+
+class DocxExtractor:
+    """
+    纯Python的.docx内容提取器，与WordProcessor保持相同的extract_content约定
+    直接读取OOXML压缩包中的word/document.xml，使用增量解析，
+    段落和表格按其在文档中的真实顺序输出，不依赖Word和COM组件
+    注意：无法打开加密文档，加密文档仍需使用WordProcessor
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    @staticmethod
+    def _paragraph_text(paragraph: ET.Element) -> str:
+        """提取段落文本（忽略修订中被删除的文本）"""
+        parts = []
+        for node in paragraph.iter():
+            if node.tag == W_T:
+                parts.append(node.text or "")
+            elif node.tag == W_TAB:
+                parts.append("\t")
+            elif node.tag in (W_BR, W_CR):
+                parts.append("\n")
+        return "".join(parts).strip()
+
+    @classmethod
+    def _cell_text(cls, cell: ET.Element) -> str:
+        """提取单元格文本，单元格内的多个段落（含嵌套表格）以空格连接"""
+        texts = [cls._paragraph_text(p) for p in cell.iter(W_P)]
+        text = " ".join(t for t in texts if t)
+        # Markdown表格中换行和竖线需要转义
+        return text.replace("\n", " ").replace("|", "\\|")
+
+    @staticmethod
+    def _cell_props(cell: ET.Element):
+        """返回单元格的横向合并列数和纵向合并状态"""
+        span = 1
+        v_merge = None
+        tc_pr = cell.find(W_TC_PR)
+        if tc_pr is not None:
+            grid_span = tc_pr.find(W_GRID_SPAN)
+            if grid_span is not None:
+                try:
+                    span = max(1, int(grid_span.get(W_VAL, "1")))
+                except ValueError:
+                    span = 1
+            merge = tc_pr.find(W_V_MERGE)
+            if merge is not None:
+                # 缺省val表示延续上方的合并单元格
+                v_merge = merge.get(W_VAL, "continue")
+        return span, v_merge
+
+    @classmethod
+    def table_to_rows(cls, table: ET.Element) -> List[List[str]]:
+        """
+        将表格展开为二维文本网格
+        横向合并（gridSpan）的单元格在其覆盖的每一列重复内容，
+        纵向合并（vMerge）的延续单元格沿用上方单元格的内容
+        """
+        rows: List[List[str]] = []
+        for tr in table.findall(W_TR):
+            row: List[str] = []
+            for tc in tr.findall(W_TC):
+                span, v_merge = cls._cell_props(tc)
+                if v_merge == "continue":
+                    col = len(row)
+                    above = rows[-1] if rows else []
+                    text = above[col] if col < len(above) else ""
+                else:
+                    text = cls._cell_text(tc)
+                row.extend([text] * span)
+            rows.append(row)
+        return rows
+
+    @classmethod
+    def convert_table_to_markdown(cls, table: ET.Element) -> str:
+        """将表格转换为Markdown格式（与WordProcessor输出格式一致）"""
+        rows = cls.table_to_rows(table)
+        if not rows:
+            return ""
+        cols = max(len(row) for row in rows)
+        if cols == 0:
+            return ""
+        rows = [row + [""] * (cols - len(row)) for row in rows]
+
+        header = "|" + "".join(f" {cell} |" for cell in rows[0])
+        separator = "|" + " --- |" * cols
+        content = ["|" + "".join(f" {cell} |" for cell in row) for row in rows[1:]]
+        return f"{header}\n{separator}\n" + "\n".join(content)
+
+    def extract_content(self, file_path: str) -> List[Dict]:
+        """
+        从Word文档中提取内容
+        返回格式: List[Dict]，每个Dict包含:
+        {
+            'type': 'paragraph' | 'table',
+            'content': str,
+            'sequence': int
+        }
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"文件不存在: {file_path}")
+
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                with archive.open("word/document.xml") as stream:
+                    return self._extract_from_stream(stream)
+        except zipfile.BadZipFile as e:
+            logger.error(f"处理Word文档失败（不是有效的docx文件或文件已加密）: {str(e)}")
+            raise
+        except Exception as e:
+            logger.error(f"处理Word文档失败: {str(e)}")
+            raise
+
+    def _extract_from_stream(self, stream) -> List[Dict]:
+        content_blocks = []
+        sequence = 0
+
+        # stack记录从根节点到当前节点的路径，用于判断元素是否位于正文顶层
+        stack: List[ET.Element] = []
+        for event, elem in ET.iterparse(stream, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                continue
+
+            stack.pop()
+            if elem.tag not in (W_P, W_TBL) or not self._is_top_level(stack):
+                continue
+
+            if elem.tag == W_P:
+                text = self._paragraph_text(elem)
+                if text:  # 只添加非空段落
+                    content_blocks.append({
+                        'type': 'paragraph',
+                        'content': text,
+                        'sequence': sequence
+                    })
+                    sequence += 1
+            else:
+                markdown_table = self.convert_table_to_markdown(elem)
+                if markdown_table:
+                    content_blocks.append({
+                        'type': 'table',
+                        'content': markdown_table,
+                        'sequence': sequence
+                    })
+                    sequence += 1
+
+            # 已处理的顶层元素从树中移除，保持内存占用与文档大小无关
+            stack[-1].remove(elem)
+
+        return content_blocks
+
+    @staticmethod
+    def _is_top_level(ancestors: List[ET.Element]) -> bool:
+        """判断元素是否直接位于正文中（允许被内容控件包裹）"""
+        for index, ancestor in enumerate(ancestors):
+            if ancestor.tag == W_BODY:
+                return all(a.tag in _TRANSPARENT_CONTAINERS for a in ancestors[index + 1:])
+        return False
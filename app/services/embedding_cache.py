@@ -0,0 +1,134 @@
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import logging
+from array import array
+from typing import List, Dict
+
+from app.config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+def normalize_text(text: str) -> str:
+    """规范化文本：全半角统一（NFKC）并合并空白，使格式微调不影响缓存命中"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    以内容寻址的持久化向量缓存
+    键为（模型名称, 规范化文本哈希），存储在独立的SQLite文件中，
+    总大小超过上限时按最近使用时间淘汰
+    同一文档的新版本入库时，未变化的段落和表格直接复用已有向量
+    """
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model_name TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model_name, text_hash)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _pack(vector: List[float]) -> bytes:
+        return array("f", vector).tobytes()
+
+    @staticmethod
+    def _unpack(blob: bytes) -> List[float]:
+        vector = array("f")
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def get_many(self, model_name: str, hashes: List[str]) -> Dict[str, List[float]]:
+        """批量查询，返回命中的 {text_hash: vector}，并刷新命中条目的使用时间"""
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # SQLite单条语句的参数数量有限，分批查询
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model_name = ? AND text_hash IN ({placeholders})",
+                    [model_name, *batch]
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = self._unpack(blob)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model_name = ? AND text_hash = ?",
+                    [(now, model_name, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model_name: str, items: Dict[str, List[float]]):
+        """批量写入 {text_hash: vector}，写入后按容量上限淘汰"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model_name, text_hash, vector, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                [(model_name, key, self._pack(vector), now) for key, vector in items.items()]
+            )
+            self._conn.commit()
+        self.evict()
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()[0]
+
+    def evict(self) -> int:
+        """超出容量上限时，淘汰最久未使用的条目直至降到上限的90%，返回淘汰条数"""
+        total = self.size_bytes()
+        if total <= self.max_bytes:
+            return 0
+
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT model_name, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_used"
+            )
+            victims = []
+            for model_name, key, length in cursor:
+                if total <= target:
+                    break
+                victims.append((model_name, key))
+                total -= length
+            self._conn.executemany(
+                "DELETE FROM embeddings WHERE model_name = ? AND text_hash = ?",
+                victims
+            )
+            self._conn.commit()
+            removed = len(victims)
+        logger.info(f"向量缓存淘汰 {removed} 条记录")
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
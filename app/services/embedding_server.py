@@ -0,0 +1,373 @@
+import os
+import json
+import time
+import socket
+import struct
+import logging
+import threading
+import socketserver
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.config import (
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_BACKEND,
+    EMBEDDING_ONNX_PATH,
+    EMBEDDING_SERVER_SOCKET,
+    EMBEDDING_SERVER_BULK_SLICE,
+    EMBEDDING_SERVER_CONNECT_TIMEOUT,
+    EMBEDDING_SERVER_REQUEST_TIMEOUT,
+    EMBED_QUERY_BATCH_WINDOW_MS,
+    EMBED_QUERY_MAX_BATCH
+)
+from app.services.embeddings import embed_queries
+
+logger = logging.getLogger(__name__)
+
+# 帧格式：JSON头长度、载荷长度（网络字节序uint32），随后是UTF-8 JSON头和二进制载荷
+# 编码结果以float32矩阵作为载荷返回，避免JSON序列化浮点数的开销
+_FRAME = struct.Struct("!II")
+
+LANES = ("query", "bulk")
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks, remaining = [], size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            raise ConnectionError("嵌入服务连接已关闭")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+def send_frame(sock: socket.socket, header: Dict, payload: bytes = b""):
+    data = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    sock.sendall(_FRAME.pack(len(data), len(payload)) + data + payload)
+
+def recv_frame(sock: socket.socket) -> Tuple[Dict, bytes]:
+    header_size, payload_size = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    header = json.loads(_recv_exact(sock, header_size))
+    return header, _recv_exact(sock, payload_size) if payload_size else b""
+
+def _require_unix_socket():
+    if not hasattr(socket, "AF_UNIX"):
+        raise RuntimeError("当前平台不支持Unix socket，嵌入服务只能在Linux/Mac上使用")
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    # 每个Web和入库工作进程的每个线程一条连接，默认的监听队列（5）在启动时容易被占满
+    request_queue_size = 128
+    daemon_threads = True
+
+class _Job:
+    __slots__ = ("texts", "future", "vectors", "done", "enqueued")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+        self.vectors: List[List[float]] = []
+        self.done = 0
+        self.enqueued = time.monotonic()
+
+class EmbeddingServer:
+    """
+    本地嵌入服务：一个进程加载模型，通过Unix socket为多个Web工作进程和入库工作进程编码
+    请求分为两条通道，由一个模型线程按优先级执行：
+    - query：问题编码，始终优先；窗口内到达的问题合并为一批（最多max_query_batch条）
+    - bulk：入库批次，按bulk_slice条切片编码，每个切片之间检查query通道，问题最多等待一个切片
+    """
+    def __init__(
+        self,
+        embed_model,
+        socket_path: str = EMBEDDING_SERVER_SOCKET,
+        bulk_slice: int = EMBEDDING_SERVER_BULK_SLICE,
+        window_ms: float = EMBED_QUERY_BATCH_WINDOW_MS,
+        max_query_batch: int = EMBED_QUERY_MAX_BATCH,
+        tokenizer: Optional[str] = None
+    ):
+        _require_unix_socket()
+        self.embed_model = embed_model
+        self.socket_path = str(socket_path)
+        self.bulk_slice = bulk_slice
+        self.window = window_ms / 1000
+        self.max_query_batch = max_query_batch
+        self.tokenizer = tokenizer
+        self._lanes = {lane: deque() for lane in LANES}
+        self._condition = threading.Condition()
+        self._stopping = threading.Event()
+        self._server: Optional[_UnixServer] = None
+        self._model_thread: Optional[threading.Thread] = None
+        self.counts = {lane: {"requests": 0, "texts": 0, "batches": 0, "wait_seconds": 0.0} for lane in LANES}
+
+    def info(self) -> Dict:
+        return {
+            "model_name": self.embed_model.model_name,
+            "tokenizer": self.tokenizer,
+            "pid": os.getpid(),
+            "stats": self.stats()
+        }
+
+    def stats(self) -> Dict:
+        with self._condition:
+            depth = {lane: len(jobs) for lane, jobs in self._lanes.items()}
+            counts = {lane: dict(values) for lane, values in self.counts.items()}
+        for lane, values in counts.items():
+            values["queued"] = depth[lane]
+            values["mean_wait_ms"] = values["wait_seconds"] * 1000 / values["requests"] if values["requests"] else 0.0
+        return counts
+
+    def submit(self, lane: str, texts: List[str]) -> np.ndarray:
+        """提交编码请求并等待结果（在连接处理线程中调用）"""
+        if lane not in self._lanes:
+            raise ValueError(f"未知的通道: {lane}")
+        job = _Job(texts)
+        with self._condition:
+            if self._stopping.is_set():
+                raise ConnectionError("嵌入服务已停止")
+            self._lanes[lane].append(job)
+            self._condition.notify()
+        return np.asarray(job.future.result(), dtype=np.float32)
+
+    def _next_queries(self) -> Optional[List[_Job]]:
+        """
+        在锁内调用：query通道非空时，等待最早的问题的窗口结束（或凑满一批），取出一批问题
+        等待期间不执行bulk切片，窗口只有几毫秒
+        """
+        queries = self._lanes["query"]
+        if not queries:
+            return None
+        deadline = queries[0].enqueued + self.window
+        while sum(len(job.texts) for job in queries) < self.max_query_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._condition.wait(remaining)
+
+        batch = [queries.popleft()]
+        size = len(batch[0].texts)
+        while queries and size + len(queries[0].texts) <= self.max_query_batch:
+            job = queries.popleft()
+            batch.append(job)
+            size += len(job.texts)
+        return batch
+
+    def _record(self, lane: str, jobs: List[_Job], texts: int):
+        now = time.monotonic()
+        with self._condition:
+            counts = self.counts[lane]
+            counts["batches"] += 1
+            counts["texts"] += texts
+            for job in jobs:
+                counts["requests"] += 1
+                counts["wait_seconds"] += now - job.enqueued
+
+    def _run_queries(self, batch: List[_Job]):
+        texts = [text for job in batch for text in job.texts]
+        try:
+            vectors = embed_queries(self.embed_model, texts)
+        except Exception as e:
+            for job in batch:
+                job.future.set_exception(e)
+            return
+        self._record("query", batch, len(texts))
+        start = 0
+        for job in batch:
+            job.future.set_result(vectors[start:start + len(job.texts)])
+            start += len(job.texts)
+
+    def _run_bulk_slice(self, job: _Job):
+        """只有模型线程取出bulk任务，切片完成后任务仍在队首，全部完成才出队"""
+        texts = job.texts[job.done:job.done + self.bulk_slice]
+        try:
+            job.vectors.extend(self.embed_model.get_text_embedding_batch(texts))
+        except Exception as e:
+            with self._condition:
+                self._lanes["bulk"].popleft()
+            job.future.set_exception(e)
+            return
+        job.done += len(texts)
+        if job.done >= len(job.texts):
+            with self._condition:
+                self._lanes["bulk"].popleft()
+            self._record("bulk", [job], len(job.texts))
+            job.future.set_result(job.vectors)
+
+    def _model_loop(self):
+        while not self._stopping.is_set():
+            with self._condition:
+                while not self._lanes["query"] and not self._lanes["bulk"]:
+                    if self._stopping.is_set():
+                        return
+                    self._condition.wait(1.0)
+                batch = self._next_queries()
+                bulk = self._lanes["bulk"][0] if batch is None else None
+            if batch is not None:
+                self._run_queries(batch)
+            else:
+                self._run_bulk_slice(bulk)
+
+    def _handler(self):
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    try:
+                        header, _ = recv_frame(self.request)
+                    except (ConnectionError, OSError):
+                        return
+                    # 服务停止后关闭连接，客户端会重连到新的服务进程
+                    if server._stopping.is_set():
+                        return
+                    try:
+                        if header.get("op") == "info":
+                            send_frame(self.request, {"ok": True, **server.info()})
+                            continue
+                        texts = header.get("texts") or []
+                        vectors = server.submit(header.get("lane", "bulk"), texts) if texts else np.zeros((0, 0), np.float32)
+                        send_frame(self.request, {"ok": True, "shape": list(vectors.shape)}, vectors.tobytes())
+                    except (ConnectionError, OSError):
+                        return
+                    except Exception as e:
+                        logger.exception("编码请求失败")
+                        send_frame(self.request, {"ok": False, "error": str(e)})
+        return Handler
+
+    def serve_forever(self):
+        """监听Unix socket直至shutdown；socket文件仅当前用户可访问"""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        previous_umask = os.umask(0o177)
+        try:
+            self._server = _UnixServer(self.socket_path, self._handler())
+        finally:
+            os.umask(previous_umask)
+        self._model_thread = threading.Thread(target=self._model_loop, name="embedding-model", daemon=True)
+        self._model_thread.start()
+        logger.info(f"嵌入服务已启动：{self.socket_path}（模型 {self.embed_model.model_name}）")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def shutdown(self):
+        """停止服务，排队中的请求以连接错误结束（客户端重连后重新提交）"""
+        with self._condition:
+            self._stopping.set()
+            pending = [job for jobs in self._lanes.values() for job in jobs]
+            for jobs in self._lanes.values():
+                jobs.clear()
+            self._condition.notify_all()
+        for job in pending:
+            if not job.future.done():
+                job.future.set_exception(ConnectionError("嵌入服务已停止"))
+        if self._server is not None:
+            self._server.shutdown()
+
+def tokenizer_source(backend: str = EMBEDDING_BACKEND) -> str:
+    """客户端加载分词器（上下文打包计数用）的位置，与服务端模型一致"""
+    return str(EMBEDDING_ONNX_PATH) if backend == "onnx" else EMBEDDING_MODEL_NAME
+
+class EmbeddingClient:
+    """
+    嵌入服务客户端，接口与HuggingFaceEmbedding一致，DocumentProcessor可直接替换使用
+    问题编码走query通道，入库批次走bulk通道；每个线程一条长连接，连接断开时重连一次
+    分词器在本地加载（不加载模型权重），加载失败时上下文打包退回估算计数
+    """
+    def __init__(
+        self,
+        socket_path: str = EMBEDDING_SERVER_SOCKET,
+        connect_timeout: float = EMBEDDING_SERVER_CONNECT_TIMEOUT,
+        request_timeout: float = EMBEDDING_SERVER_REQUEST_TIMEOUT
+    ):
+        _require_unix_socket()
+        self.socket_path = str(socket_path)
+        self.request_timeout = request_timeout
+        self._local = threading.local()
+        info = self._wait_ready(connect_timeout)
+        self.model_name = info["model_name"]
+        self._tokenizer = self._load_tokenizer(info.get("tokenizer"))
+
+    @staticmethod
+    def _load_tokenizer(source: Optional[str]):
+        if not source:
+            return None
+        try:
+            from transformers import AutoTokenizer
+            return AutoTokenizer.from_pretrained(source)
+        except Exception as e:
+            logger.warning(f"加载分词器失败，上下文打包使用估算计数: {str(e)}")
+            return None
+
+    def _wait_ready(self, timeout: float) -> Dict:
+        """等待嵌入服务启动并加载完模型"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.info()
+            except (ConnectionError, OSError) as e:
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"无法连接嵌入服务 {self.socket_path}: {str(e)}")
+                time.sleep(0.5)
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # 先以阻塞方式连接（设置超时后Unix socket在监听队列满时立即返回EAGAIN），再设置请求超时
+        sock.connect(self.socket_path)
+        sock.settimeout(self.request_timeout)
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+            self._local.sock = None
+
+    def _request(self, header: Dict) -> Tuple[Dict, bytes]:
+        for attempt in range(2):
+            try:
+                if getattr(self._local, "sock", None) is None:
+                    self._local.sock = self._connect()
+                send_frame(self._local.sock, header)
+                response, payload = recv_frame(self._local.sock)
+                break
+            except socket.timeout:
+                # 超时不重试，避免服务繁忙时重复提交
+                self._close()
+                raise
+            except (ConnectionError, OSError):
+                # 连接失效（如服务重启）时重连一次
+                self._close()
+                if attempt:
+                    raise
+        if not response.get("ok"):
+            raise RuntimeError(f"嵌入服务编码失败: {response.get('error')}")
+        return response, payload
+
+    def info(self) -> Dict:
+        return self._request({"op": "info"})[0]
+
+    def _embed(self, lane: str, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        response, payload = self._request({"op": "embed", "lane": lane, "texts": texts})
+        return np.frombuffer(payload, dtype=np.float32).reshape(response["shape"]).tolist()
+
+    def get_text_embedding(self, text: str) -> List[float]:
+        return self._embed("bulk", [text])[0]
+
+    def get_text_embedding_batch(self, texts: List[str], **kwargs) -> List[List[float]]:
+        return self._embed("bulk", texts)
+
+    def get_query_embedding(self, query: str) -> List[float]:
+        return self._embed("query", [query])[0]
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        return self._embed("query", queries)
@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import List, Dict, Optional, Callable
+
+import numpy as np
+
+from app.config import (
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_BACKEND,
+    EMBEDDING_ONNX_PATH,
+    EMBEDDING_ONNX_VARIANT,
+    EMBEDDING_ONNX_THREADS,
+    EMBEDDING_MAX_LENGTH,
+    EMBEDDING_MIN_COSINE,
+    EMBEDDING_SERVER_SOCKET,
+    EMBED_BATCH_SIZE,
+    EMBED_QUERY_BATCH_WINDOW_MS,
+    EMBED_QUERY_MAX_BATCH
+)
+from app.services.metrics import EMBED_QUERY_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 导出目录中记录与fp32模型核对结果的文件
+VALIDATION_FILE = "validation.json"
+
+def onnx_model_file(variant: str) -> str:
+    return f"model.{variant}.onnx"
+
+def load_validation_report(model_dir, variant: str) -> Optional[Dict]:
+    """读取导出模型的核对报告，没有报告时返回None"""
+    path = os.path.join(str(model_dir), VALIDATION_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get(variant)
+
+def compare_embeddings(reference: np.ndarray, candidate: np.ndarray, top_k: int = 5) -> Dict:
+    """
+    核对候选模型与fp32模型对同一批文本的向量（均已归一化）：
+    - 逐条余弦相似度的最小值、均值和1%分位数
+    - 以每条文本为问题、候选模型编码，在fp32向量中检索top-k，与fp32问题向量检索结果的重合率
+      （切换后端后已入库的向量不重新计算，检索正是这种组合）
+    """
+    cosines = np.sum(reference * candidate, axis=1)
+    k = min(top_k, len(reference))
+    expected = np.argsort(-(reference @ reference.T), axis=1)[:, :k]
+    actual = np.argsort(-(candidate @ reference.T), axis=1)[:, :k]
+    overlap = np.mean([len(set(a) & set(e)) / k for a, e in zip(actual, expected)])
+    return {
+        "samples": len(reference),
+        "cosine_min": round(float(cosines.min()), 6),
+        "cosine_mean": round(float(cosines.mean()), 6),
+        "cosine_p01": round(float(np.percentile(cosines, 1)), 6),
+        f"recall_at_{k}": round(float(overlap), 4)
+    }
+
+class OnnxEmbedding:
+    """
+    以onnxruntime执行导出的嵌入模型，接口与检索和入库用到的HuggingFaceEmbedding方法一致
+    与HuggingFaceEmbedding相同：取[CLS]向量并归一化，问题不加指令前缀
+    加载前检查导出时写入的核对报告，未通过（或没有报告）的模型不加载；min_cosine为None时跳过检查（仅供导出脚本核对）
+    """
+    def __init__(
+        self,
+        model_dir=EMBEDDING_ONNX_PATH,
+        variant: str = EMBEDDING_ONNX_VARIANT,
+        threads: int = EMBEDDING_ONNX_THREADS,
+        max_length: int = EMBEDDING_MAX_LENGTH,
+        embed_batch_size: int = EMBED_BATCH_SIZE,
+        min_cosine: Optional[float] = EMBEDDING_MIN_COSINE
+    ):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        model_dir = str(model_dir)
+        report = load_validation_report(model_dir, variant)
+        if min_cosine is not None and (report is None or report.get("cosine_min", 0.0) < min_cosine):
+            raise RuntimeError(
+                f"{os.path.join(model_dir, onnx_model_file(variant))} 未通过与fp32模型的核对"
+                f"（最低余弦相似度需不低于 {min_cosine}），请执行 scripts/export_embedding_onnx.py"
+            )
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, onnx_model_file(variant)),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {item.name for item in self.session.get_inputs()}
+        self._tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model_name = f"{EMBEDDING_MODEL_NAME}+onnx-{variant}"
+        self.variant = variant
+        self.max_length = max_length
+        self.embed_batch_size = embed_batch_size
+        self.validation = report
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        encoded = self._tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+        )
+        feeds = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+        hidden = self.session.run(None, feeds)[0]
+        vectors = hidden[:, 0]
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors.tolist()
+
+    def get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+    def get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([query])[0]
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        return self._embed(queries)
+
+    def get_text_embedding_batch(self, texts: List[str], **kwargs) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.embed_batch_size):
+            vectors.extend(self._embed(texts[start:start + self.embed_batch_size]))
+        return vectors
+
+def create_embed_model(backend: str = EMBEDDING_BACKEND, server_socket: str = EMBEDDING_SERVER_SOCKET):
+    """按EMBEDDING_BACKEND创建嵌入模型；配置了嵌入服务时返回其客户端，模型由服务进程加载"""
+    if server_socket:
+        from app.services.embedding_server import EmbeddingClient
+        return EmbeddingClient(server_socket)
+    if backend == "onnx":
+        return OnnxEmbedding()
+    if backend != "torch":
+        raise ValueError(f"不支持的嵌入后端: {backend}，可选 torch、onnx")
+
+    from llama_index.embeddings import HuggingFaceEmbedding
+    return HuggingFaceEmbedding(model_name=EMBEDDING_MODEL_NAME, embed_batch_size=EMBED_BATCH_SIZE)
+
+def embed_queries(embed_model, queries: List[str]) -> List[List[float]]:
+    """一次前向计算编码多个问题，结果与逐条调用get_query_embedding相同"""
+    batch = getattr(embed_model, "get_query_embedding_batch", None)
+    if batch is not None:
+        return batch(queries)
+    # HuggingFaceEmbedding：与get_query_embedding一样添加问题指令（bge本地模型名没有对应的指令，为原文），再批量编码
+    from llama_index.embeddings.huggingface_utils import format_query
+    return embed_model._embed([
+        format_query(query, embed_model.model_name, embed_model.query_instruction) for query in queries
+    ])
+
+class QueryEmbeddingBatcher:
+    """
+    问题编码微批：调用线程提交问题后等待结果，后台线程收到第一个问题后再等待window_ms，
+    把期间到达的问题（最多max_batch个）合并为一次前向计算
+    并发提问时模型每次只做一次批量计算，避免多个batch-of-one前向计算争抢CPU
+    """
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        window_ms: float = EMBED_QUERY_BATCH_WINDOW_MS,
+        max_batch: int = EMBED_QUERY_MAX_BATCH
+    ):
+        self.embed_batch = embed_batch
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+        self.queries = 0
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="query-embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def embed(self, query: str) -> List[float]:
+        future: Future = Future()
+        self._ensure_thread()
+        self._queue.put((query, future))
+        return future.result()
+
+    def _collect(self) -> List:
+        """取出第一个问题后在窗口内继续收集，窗口结束前已排队的问题一并合并"""
+        batch = [self._queue.get()]
+        end = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = end - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                vectors = self.embed_batch([query for query, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.queries += len(batch)
+            EMBED_QUERY_BATCH_SIZE.observe(len(batch))
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def stats(self) -> Dict:
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch_size": self.queries / self.batches if self.batches else 0.0
+        }
@@ -0,0 +1,33 @@
+import sys
+import logging
+
+from app.config import DOCX_EXTRACTOR_BACKEND
+from app.services.docx_extractor import DocxExtractor
+
+logger = logging.getLogger(__name__)
+
+def resolve_backend(backend: str = DOCX_EXTRACTOR_BACKEND) -> str:
+    """
+    解析提取器后端
+    auto: Windows且安装了pywin32时使用COM（支持加密文档），否则使用OOXML
+    """
+    if backend != "auto":
+        return backend
+    if sys.platform == "win32":
+        try:
+            import win32com.client  # noqa: F401
+            return "com"
+        except ImportError:
+            pass
+    return "ooxml"
+
+def create_extractor(backend: str = DOCX_EXTRACTOR_BACKEND):
+    """创建提取器实例，两种后端都支持 with ... as extractor: extractor.extract_content(path)"""
+    backend = resolve_backend(backend)
+    if backend == "com":
+        # 仅在需要时导入，非Windows平台没有win32com
+        from app.services.word_processor import WordProcessor
+        return WordProcessor()
+    if backend == "ooxml":
+        return DocxExtractor()
+    raise ValueError(f"未知的文档提取器后端: {backend}")
@@ -0,0 +1,39 @@
+import os
+from contextlib import contextmanager
+from typing import Optional, IO
+
+def _lock(handle: IO, blocking: bool) -> bool:
+    """对文件加排他锁（Linux/Mac用flock，Windows用msvcrt），非阻塞时取不到锁返回False"""
+    try:
+        import fcntl
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except ImportError:
+        import msvcrt
+        # LK_LOCK最多重试10秒，阻塞模式下循环等待
+        while True:
+            try:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if not blocking:
+                    return False
+    except OSError:
+        return False
+    return True
+
+def try_lock(path) -> Optional[IO]:
+    """尝试取得文件锁，成功时返回持有锁的文件对象（关闭或进程退出时释放），否则返回None"""
+    os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+    handle = open(path, "a+")
+    if not _lock(handle, blocking=False):
+        handle.close()
+        return None
+    return handle
+
+@contextmanager
+def file_lock(path):
+    """阻塞等待文件锁，用于多个进程串行执行同一段初始化"""
+    os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+    with open(path, "a+") as handle:
+        _lock(handle, blocking=True)
+        yield
@@ -0,0 +1,141 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from typing import List, Optional
+
+from app.config import INGEST_WORKERS, INGEST_POLL_INTERVAL, INGEST_SUPERVISE_INTERVAL
+from app.services.job_queue import JobQueue
+
+logger = logging.getLogger(__name__)
+
+def run_job(job, processor, queue: JobQueue):
+    """执行单个入库任务：解析文档、切分、向量化并写入，返回 (各阶段耗时, 内容块)"""
+    from app.services.extractors import create_extractor
+
+    queue.update_progress(job.job_id, "extract", 0.0)
+    start = time.perf_counter()
+    with create_extractor() as extractor:
+        content_blocks = extractor.extract_content(job.file_path)
+    extract_seconds = time.perf_counter() - start
+    queue.update_progress(job.job_id, "extract", 1.0)
+
+    processed_blocks, stats = processor.ingest_document(
+        content_blocks,
+        job.version_id,
+        job.doc_base_id,
+        job.project_id,
+        progress_callback=lambda stage, fraction: queue.update_progress(job.job_id, stage, fraction)
+    )
+    return {"extract": extract_seconds, **stats["timings"]}, processed_blocks
+
+def worker_main(stop_event, current_job=None, poll_interval: float = INGEST_POLL_INTERVAL):
+    """
+    工作进程入口：加载一次模型，循环领取并执行任务
+    current_job为与进程池共享的整数，执行任务期间保存其job_id，进程异常退出时进程池据此恢复任务
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    queue = JobQueue()
+    processor = None
+    logger.info(f"入库工作进程 {os.getpid()} 已启动")
+
+    while not stop_event.is_set():
+        job = queue.claim_next()
+        if job is None:
+            stop_event.wait(poll_interval)
+            continue
+
+        if current_job is not None:
+            current_job.value = job.job_id
+        try:
+            # 首个任务到来时才导入依赖库并加载模型，空闲的工作进程不占用内存；加载失败时任务按失败重试
+            if processor is None:
+                from app.services.document_processor import DocumentProcessor
+                processor = DocumentProcessor()
+            timings, processed_blocks = run_job(job, processor, queue)
+            queue.complete(job.job_id, timings, processed_blocks)
+            stages = ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in timings.items())
+            logger.info(f"入库任务 {job.job_id}（版本 {job.version_id}）完成，各阶段耗时: {stages}")
+        except Exception as e:
+            logger.exception(f"入库任务 {job.job_id} 执行失败")
+            queue.fail(job.job_id, str(e))
+        if current_job is not None:
+            current_job.value = 0
+
+class IngestWorkerPool:
+    """
+    入库工作进程池，随应用启动和关闭
+    监督线程每隔INGEST_SUPERVISE_INTERVAL检查工作进程，异常退出（内存不足、解析或嵌入时的原生崩溃）的进程
+    所领取的任务按recover_interrupted的重试计数重新排队或标记失败，并启动新的工作进程补足数量
+    """
+
+    def __init__(self, workers: int = INGEST_WORKERS, supervise_interval: float = INGEST_SUPERVISE_INTERVAL):
+        self.workers = workers
+        self.supervise_interval = supervise_interval
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._processes: List[multiprocessing.Process] = []
+        # 与_processes一一对应：各工作进程正在执行的job_id（0表示空闲）
+        self._current_jobs = []
+        self._queue = JobQueue()
+        self._supervisor_stop = threading.Event()
+        self._supervisor: Optional[threading.Thread] = None
+        self.restarts = 0
+
+    def _spawn(self, index: int):
+        current_job = self._context.Value("q", 0, lock=False)
+        process = self._context.Process(
+            target=worker_main,
+            args=(self._stop_event, current_job),
+            name=f"ingest-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        return process, current_job
+
+    def start(self):
+        """恢复中断的任务，启动工作进程和监督线程"""
+        self._queue.recover_interrupted()
+        for index in range(self.workers):
+            process, current_job = self._spawn(index)
+            self._processes.append(process)
+            self._current_jobs.append(current_job)
+        self._supervisor = threading.Thread(target=self._supervise, name="ingest-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def _supervise(self):
+        while not self._supervisor_stop.wait(self.supervise_interval):
+            for index, process in enumerate(self._processes):
+                if process.is_alive() or self._stop_event.is_set():
+                    continue
+                self._replace(index, process)
+
+    def _replace(self, index: int, process: multiprocessing.Process):
+        """恢复退出的工作进程领取的任务，并在同一位置启动新的工作进程"""
+        job_id = self._current_jobs[index].value
+        logger.error(f"入库工作进程 {process.name}（pid {process.pid}）异常退出，退出码 {process.exitcode}")
+        if job_id:
+            try:
+                self._queue.recover_job(job_id, f"工作进程异常退出（退出码 {process.exitcode}）")
+            except Exception:
+                logger.exception(f"恢复入库任务 {job_id} 失败，下次启动时恢复")
+        self._processes[index], self._current_jobs[index] = self._spawn(index)
+        self.restarts += 1
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        """
+        通知工作进程退出；超时仍在执行任务的进程会被终止，
+        其任务保持running状态，下次启动时自动恢复
+        """
+        self._supervisor_stop.set()
+        self._stop_event.set()
+        if self._supervisor is not None:
+            self._supervisor.join()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        self._current_jobs = []
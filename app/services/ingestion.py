@@ -0,0 +1,158 @@
+import time
+import logging
+from typing import List, Dict, Callable, Optional, Tuple
+
+from app.config import EMBED_BATCH_SIZE, UPSERT_BATCH_SIZE
+from app.services.embedding_cache import EmbeddingCache, text_hash
+from app.services.lexical_index import LexicalIndexStore
+
+logger = logging.getLogger(__name__)
+
+# 进度回调：callback(stage, fraction)，fraction为该阶段完成比例(0~1)
+ProgressCallback = Callable[[str, float], None]
+
+def make_chunk_id(html_id: str, chunk_index: int) -> str:
+    """根据html_id生成确定性的向量ID，重复入库时覆盖而不是追加"""
+    return f"{html_id}#{chunk_index}"
+
+class IngestionPipeline:
+    """
+    文档入库流水线：
+    1. parse  —— 节点解析器只切分一次
+    2. embed  —— 先查向量缓存，只把新增或变化的文本按批次送入嵌入模型
+    3. upsert —— 以确定性ID写入向量库（ChromaDB或内存映射索引），并清理该版本中已不存在的旧向量
+    4. lexical —— 为该版本建立倒排索引，供混合检索使用
+    每个阶段的耗时记录在返回的统计信息中
+    """
+    def __init__(
+        self,
+        embed_model,
+        node_parser,
+        model_name: str,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        lexical_store: Optional[LexicalIndexStore] = None,
+        batch_size: int = EMBED_BATCH_SIZE,
+        upsert_batch_size: int = UPSERT_BATCH_SIZE
+    ):
+        self.embed_model = embed_model
+        self.node_parser = node_parser
+        self.model_name = model_name
+        self.embedding_cache = embedding_cache
+        self.lexical_store = lexical_store
+        self.batch_size = batch_size
+        self.upsert_batch_size = upsert_batch_size
+
+    def parse(self, documents) -> List[Dict]:
+        """切分文档，返回带确定性ID的chunk列表"""
+        nodes = self.node_parser.get_nodes_from_documents(documents)
+
+        chunks = []
+        chunk_counters: Dict[str, int] = {}
+        for node in nodes:
+            metadata = dict(node.metadata)
+            html_id = metadata['html_id']
+            chunk_index = chunk_counters.get(html_id, 0)
+            chunk_counters[html_id] = chunk_index + 1
+            metadata['chunk_index'] = chunk_index
+
+            chunks.append({
+                'id': make_chunk_id(html_id, chunk_index),
+                'text': node.get_content(),
+                'metadata': metadata
+            })
+        return chunks
+
+    def embed(
+        self,
+        texts: List[str],
+        progress_callback: Optional[ProgressCallback] = None
+    ) -> Tuple[List[List[float]], Dict]:
+        """
+        分批向量化，返回向量列表和缓存命中统计
+        相同内容（规范化后）只计算一次，已缓存的内容不再经过模型
+        """
+        hashes = [text_hash(text) for text in texts]
+        vectors: Dict[str, List[float]] = {}
+        if self.embedding_cache is not None:
+            vectors = self.embedding_cache.get_many(self.model_name, hashes)
+
+        # 需要计算的去重文本
+        pending: Dict[str, str] = {}
+        for key, text in zip(hashes, texts):
+            if key not in vectors and key not in pending:
+                pending[key] = text
+
+        pending_keys = list(pending)
+        computed: Dict[str, List[float]] = {}
+        for start in range(0, len(pending_keys), self.batch_size):
+            batch_keys = pending_keys[start:start + self.batch_size]
+            batch_vectors = self.embed_model.get_text_embedding_batch(
+                [pending[key] for key in batch_keys]
+            )
+            computed.update(zip(batch_keys, batch_vectors))
+            if progress_callback:
+                progress_callback("embed", min(1.0, (start + len(batch_keys)) / len(pending_keys)))
+
+        if self.embedding_cache is not None:
+            self.embedding_cache.put_many(self.model_name, computed)
+        vectors.update(computed)
+
+        hits = sum(1 for key in hashes if key not in computed)
+        cache_stats = {
+            'hits': hits,
+            'misses': len(hashes) - hits,
+            'embedded': len(computed),
+            'hit_rate': hits / len(hashes) if hashes else 0.0
+        }
+        return [vectors[key] for key in hashes], cache_stats
+
+    def upsert(self, vector_store, chunks: List[Dict], embeddings: List[List[float]], version_id: int) -> int:
+        """写入版本的全部chunk，返回清理的旧向量数"""
+        return vector_store.write_version(version_id, chunks, embeddings, self.upsert_batch_size)
+
+    def run(
+        self,
+        documents,
+        vector_store,
+        version_id: int,
+        progress_callback: Optional[ProgressCallback] = None
+    ) -> Dict:
+        """执行完整流水线，返回各阶段耗时和数量统计"""
+        timings = {}
+        total_start = time.perf_counter()
+
+        start = time.perf_counter()
+        chunks = self.parse(documents)
+        timings['parse'] = time.perf_counter() - start
+        if progress_callback:
+            progress_callback("parse", 1.0)
+
+        start = time.perf_counter()
+        embeddings, cache_stats = self.embed([chunk['text'] for chunk in chunks], progress_callback)
+        timings['embed'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        removed = self.upsert(vector_store, chunks, embeddings, version_id)
+        timings['upsert'] = time.perf_counter() - start
+        if progress_callback:
+            progress_callback("upsert", 1.0)
+
+        if self.lexical_store is not None:
+            start = time.perf_counter()
+            self.lexical_store.build(version_id, chunks)
+            timings['lexical'] = time.perf_counter() - start
+
+        timings['total'] = time.perf_counter() - total_start
+
+        stats = {
+            'chunks': len(chunks),
+            'removed_stale': removed,
+            'embedding_cache': cache_stats,
+            'timings': timings
+        }
+        logger.info(
+            "入库完成: %d 个chunk, parse %.2fs, embed %.2fs, upsert %.2fs, 向量缓存命中率 %.1f%%",
+            len(chunks), timings['parse'], timings['embed'], timings['upsert'],
+            cache_stats['hit_rate'] * 100
+        )
+        return stats
@@ -0,0 +1,217 @@
+import json
+import random
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.database import SessionLocal, IngestionJob, DocumentVersion
+from app.services.answer_cache import AnswerCache
+from app.services.block_store import save_version_blocks
+from app.config import INGEST_MAX_ATTEMPTS, INGEST_RETRY_BASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 各阶段在总进度中所占的区间（百分比）
+STAGE_PROGRESS = {
+    "extract": (0, 20),
+    "parse": (20, 30),
+    "embed": (30, 90),
+    "upsert": (90, 100)
+}
+
+async def enqueue_job(
+    db: AsyncSession,
+    version_id: int,
+    file_path: str,
+    doc_base_id: int,
+    project_id: str
+) -> IngestionJob:
+    """在当前事务中创建入库任务，与版本记录一起提交，保证任务不会丢失"""
+    job = IngestionJob(
+        version_id=version_id,
+        file_path=file_path,
+        doc_base_id=doc_base_id,
+        project_id=project_id,
+        max_attempts=INGEST_MAX_ATTEMPTS
+    )
+    db.add(job)
+    await db.flush()
+    return job
+
+def job_to_dict(job: IngestionJob) -> Dict:
+    return {
+        "job_id": job.job_id,
+        "version_id": job.version_id,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": round(job.progress, 1),
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "error_message": job.error_message,
+        "timings": json.loads(job.timings) if job.timings else None,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at
+    }
+
+class JobQueue:
+    """
+    基于SQLite的持久化任务队列（供工作进程使用的同步接口）
+    任务的领取通过带状态条件的UPDATE完成，多个工作进程不会领取到同一个任务
+    """
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+
+    def recover_interrupted(self) -> int:
+        """
+        将因崩溃或重启而中断的任务重新放回队列，返回恢复的任务数
+        中断的那次尝试在领取时已计入attempts，已达到最大尝试次数的任务（例如每次都让工作进程崩溃的文档）
+        标记为failed，不再无限重试
+        """
+        with self.session_factory() as db:
+            jobs = db.query(IngestionJob).filter(IngestionJob.status == "running").all()
+            recovered = sum(self._requeue_or_fail(db, job) for job in jobs)
+            db.commit()
+            if recovered:
+                logger.info(f"恢复了 {recovered} 个中断的入库任务")
+            return recovered
+
+    def recover_job(self, job_id: int, error: str) -> bool:
+        """
+        恢复执行中退出的工作进程领取的任务（与recover_interrupted相同的重试计数），返回是否重新排队
+        任务已不是running状态（已完成或已记录失败）时不做修改
+        """
+        with self.session_factory() as db:
+            job = db.get(IngestionJob, job_id)
+            if job is None or job.status != "running":
+                return False
+            job.error_message = error
+            requeued = self._requeue_or_fail(db, job)
+            db.commit()
+            if requeued:
+                logger.warning(f"入库任务 {job_id} 中断，重新排队: {error}")
+            return requeued
+
+    def _requeue_or_fail(self, db, job: IngestionJob) -> bool:
+        """中断的任务未达到最大尝试次数时立即重新排队，否则标记为failed（不提交）"""
+        now = datetime.utcnow()
+        if job.attempts < job.max_attempts:
+            job.status = "queued"
+            job.stage = "queued"
+            job.next_run_at = now
+            job.updated_at = now
+            return True
+        self._mark_failed(db, job, job.error_message or "任务执行中断（工作进程退出）且已达到最大重试次数")
+        logger.error(f"入库任务 {job.job_id} 中断且已达到最大重试次数，标记为失败")
+        return False
+
+    def claim_next(self) -> Optional[IngestionJob]:
+        """
+        领取一个到期的排队任务，没有任务时返回None
+        先查询候选任务，再用带 status = 'queued' 条件的UPDATE领取（不依赖SQLite 3.35的RETURNING），
+        影响行数为0说明已被其他工作进程领取，重新查询
+        """
+        now = datetime.utcnow()
+        with self.session_factory() as db:
+            while True:
+                job_id = db.execute(text(
+                    "SELECT job_id FROM ingestion_jobs "
+                    "WHERE status = 'queued' AND next_run_at <= :now "
+                    "ORDER BY job_id LIMIT 1"
+                ), {"now": now}).scalar()
+                if job_id is None:
+                    db.rollback()
+                    return None
+
+                result = db.execute(text(
+                    "UPDATE ingestion_jobs "
+                    "SET status = 'running', stage = 'extract', progress = 0, "
+                    "attempts = attempts + 1, updated_at = :now "
+                    "WHERE job_id = :job_id AND status = 'queued'"
+                ), {"now": now, "job_id": job_id})
+                db.commit()
+                if result.rowcount == 1:
+                    break
+
+            job = db.get(IngestionJob, job_id)
+            db.expunge(job)
+            return job
+
+    def update_progress(self, job_id: int, stage: str, fraction: float):
+        """更新任务当前阶段和进度，fraction为该阶段内的完成比例"""
+        low, high = STAGE_PROGRESS.get(stage, (0, 100))
+        progress = low + (high - low) * max(0.0, min(1.0, fraction))
+        with self.session_factory() as db:
+            db.execute(text(
+                "UPDATE ingestion_jobs SET stage = :stage, progress = :progress, updated_at = :now "
+                "WHERE job_id = :job_id"
+            ), {"stage": stage, "progress": progress, "now": datetime.utcnow(), "job_id": job_id})
+            db.commit()
+
+    def complete(
+        self,
+        job_id: int,
+        timings: Optional[Dict] = None,
+        processed_blocks: Optional[List[Dict]] = None
+    ):
+        """
+        标记任务完成，并将对应版本状态置为ready
+        内容块（预览用）与状态在同一事务中写入，版本变为ready时预览一定可用
+        """
+        with self.session_factory() as db:
+            job = db.get(IngestionJob, job_id)
+            if processed_blocks is not None:
+                save_version_blocks(db, job.version_id, processed_blocks)
+                
+            job.status = "done"
+            job.stage = "done"
+            job.progress = 100.0
+            job.error_message = None
+            job.timings = json.dumps(timings) if timings else None
+
+            version = db.get(DocumentVersion, job.version_id)
+            if version:
+                version.status = "ready"
+                version.error_message = None
+                
+            # 内容已重新入库，旧的问答缓存失效
+            AnswerCache.invalidate_version(db, job.version_id)
+            db.commit()
+
+    def fail(self, job_id: int, error: str) -> bool:
+        """
+        记录任务失败
+        未超过最大重试次数时按指数退避（带随机抖动）重新排队并返回True，
+        否则标记为failed、版本状态置为error并返回False
+        """
+        with self.session_factory() as db:
+            job = db.get(IngestionJob, job_id)
+            job.error_message = error
+
+            if job.attempts < job.max_attempts:
+                delay = INGEST_RETRY_BASE_SECONDS * (2 ** (job.attempts - 1))
+                delay *= random.uniform(0.8, 1.2)
+                job.status = "queued"
+                job.stage = "queued"
+                job.next_run_at = datetime.utcnow() + timedelta(seconds=delay)
+                db.commit()
+                logger.warning(f"入库任务 {job_id} 失败，{delay:.0f}s 后第 {job.attempts + 1} 次重试: {error}")
+                return True
+
+            self._mark_failed(db, job, error)
+            db.commit()
+            logger.error(f"入库任务 {job_id} 失败且已达到最大重试次数: {error}")
+            return False
+
+    @staticmethod
+    def _mark_failed(db, job: IngestionJob, error: str):
+        """任务标记为failed，对应版本状态置为error（不提交）"""
+        job.status = "failed"
+        job.stage = "failed"
+        job.error_message = error
+        version = db.get(DocumentVersion, job.version_id)
+        if version:
+            version.status = "error"
+            version.error_message = error
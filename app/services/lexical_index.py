@@ -0,0 +1,176 @@
+import os
+import re
+import gzip
+import json
+import math
+import heapq
+import unicodedata
+from collections import Counter, defaultdict
+from typing import List, Dict, Optional
+
+from app.config import LEXICAL_INDEX_PATH, LEXICAL_CACHE_SIZE, BM25_K1, BM25_B, RRF_K
+from app.services.lru_cache import LRUCache
+
+# 编号类词元：字母数字串，可由 . _ - / 连接，如 GB/T、1234-2008、3.2.1、A-01
+_IDENTIFIER_TOKEN = re.compile(r"[a-z0-9]+(?:[._\-/][a-z0-9]+)*")
+_IDENTIFIER_SEPARATORS = re.compile(r"[._\-/]")
+_CJK_RUN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+# 编号类问题：只含字母数字和少量符号，或形如“第5.2条”，此类问题跳过向量检索
+_IDENTIFIER_QUERY = re.compile(r"^[\sA-Za-z0-9._\-/#:()（）]+$")
+_CLAUSE_QUERY = re.compile(r"^第?\s*\d+(?:\.\d+)*\s*[条款章节项]?$")
+
+def tokenize(text: str) -> List[str]:
+    """
+    中文按字的二元组切分（单字片段保留单字），
+    编号类字符串保留整体，同时拆出各组成部分
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for match in _IDENTIFIER_TOKEN.finditer(text):
+        token = match.group()
+        tokens.append(token)
+        parts = _IDENTIFIER_SEPARATORS.split(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    for match in _CJK_RUN.finditer(text):
+        run = match.group()
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+def looks_like_identifier(query: str) -> bool:
+    """判断问题是否是零件号、条款号等编号查询"""
+    query = unicodedata.normalize("NFKC", query).strip()
+    if not query or len(query) > 40:
+        return False
+    if _CLAUSE_QUERY.match(query):
+        return True
+    return bool(_IDENTIFIER_QUERY.match(query)) and any(c.isdigit() for c in query)
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict]], k: int = RRF_K) -> List[Dict]:
+    """
+    倒数排名融合：score = Σ 1 / (k + rank)
+    各结果列表以chunk的id对齐，返回按融合分数降序排列的结果
+    """
+    fused: Dict[str, Dict] = {}
+    scores: Dict[str, float] = defaultdict(float)
+    for results in result_lists:
+        for rank, item in enumerate(results, start=1):
+            scores[item['id']] += 1.0 / (k + rank)
+            fused.setdefault(item['id'], item)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [{**fused[chunk_id], 'score': scores[chunk_id]} for chunk_id in ordered]
+
+class LexicalIndex:
+    """单个文档版本的倒排索引，使用BM25打分"""
+
+    def __init__(self, docs: List[Dict], postings: Dict[str, List[List[int]]], doc_lengths: List[int]):
+        self.docs = docs
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.avgdl = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+
+    @classmethod
+    def build(cls, chunks: List[Dict]) -> "LexicalIndex":
+        """由入库流水线切分出的chunk（id、text、metadata）构建索引"""
+        docs = []
+        doc_lengths = []
+        postings: Dict[str, List[List[int]]] = defaultdict(list)
+        for index, chunk in enumerate(chunks):
+            tokens = tokenize(chunk['text'])
+            for term, tf in Counter(tokens).items():
+                postings[term].append([index, tf])
+            docs.append({'id': chunk['id'], 'text': chunk['text'], 'metadata': chunk['metadata']})
+            doc_lengths.append(len(tokens))
+        return cls(docs, dict(postings), doc_lengths)
+
+    def search(self, query: str, top_k: int, k1: float = BM25_K1, b: float = BM25_B) -> List[Dict]:
+        """BM25检索，返回与向量检索相同格式的结果"""
+        terms = tokenize(query)
+        if not terms or not self.docs:
+            return []
+
+        n_docs = len(self.docs)
+        scores: Dict[int, float] = defaultdict(float)
+        for term, query_tf in Counter(terms).items():
+            term_postings = self.postings.get(term)
+            if not term_postings:
+                continue
+            df = len(term_postings)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for doc_index, tf in term_postings:
+                norm = k1 * (1 - b + b * self.doc_lengths[doc_index] / self.avgdl)
+                scores[doc_index] += query_tf * idf * tf * (k1 + 1) / (tf + norm)
+
+        top = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [
+            {
+                'id': self.docs[doc_index]['id'],
+                'content': self.docs[doc_index]['text'],
+                'metadata': self.docs[doc_index]['metadata'],
+                'score': score
+            }
+            for doc_index, score in top
+        ]
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({
+                'docs': self.docs,
+                'postings': self.postings,
+                'doc_lengths': self.doc_lengths
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data['docs'], data['postings'], data['doc_lengths'])
+
+class LexicalIndexStore:
+    """按版本保存倒排索引文件，已加载的索引保存在有界LRU缓存中"""
+
+    def __init__(self, root=LEXICAL_INDEX_PATH, cache_size: int = LEXICAL_CACHE_SIZE):
+        self.root = str(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.cache = LRUCache(cache_size)
+
+    def path_for(self, version_id: int) -> str:
+        return os.path.join(self.root, f"version_{version_id}.json.gz")
+
+    def build(self, version_id: int, chunks: List[Dict]) -> LexicalIndex:
+        index = LexicalIndex.build(chunks)
+        index.save(self.path_for(version_id))
+        self.cache.pop(version_id)
+        return index
+
+    def get(self, version_id: int) -> Optional[LexicalIndex]:
+        """
+        获取版本的索引，旧版本入库时未建立索引则返回None
+        索引文件由入库工作进程重建，因此以文件修改时间校验缓存是否过期
+        """
+        path = self.path_for(version_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self.cache.pop(version_id)
+            return None
+
+        cached = self.cache.get(version_id)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        index = LexicalIndex.load(path)
+        self.cache.put(version_id, (mtime, index))
+        return index
+
+    def delete(self, version_id: int):
+        self.cache.pop(version_id)
+        path = self.path_for(version_id)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,368 @@
+import time
+import random
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_QUEUE,
+    LLM_QUEUE_TIMEOUT,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BASE_SECONDS,
+    LLM_RETRY_MAX_SECONDS,
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_OPEN_SECONDS
+)
+from app.services.llm_service import LLMUpstreamError, LLMBusy
+from app.services.metrics import LLM_SCHEDULER_TOTAL, record_stage
+
+logger = logging.getLogger(__name__)
+
+class FairLimiter:
+    """
+    并发上限 + 公平排队：名额用完后按tenant（会话）分队列等待，释放的名额轮流交给各tenant的队首，
+    同一会话的连续提问不会挤占其他会话
+    等待者已达max_waiting或等待超过timeout时acquire返回False
+    """
+    def __init__(self, limit: int, max_waiting: int):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    async def acquire(self, tenant: str, timeout: Optional[float]) -> bool:
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            return True
+        if self.waiting >= self.max_waiting:
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(tenant, deque()).append(future)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            self._abandon(tenant, future)
+            return False
+        except BaseException:
+            self._abandon(tenant, future)
+            raise
+
+    def _abandon(self, tenant: str, future: asyncio.Future):
+        """等待者超时或被取消：仍在队列中时移出；名额已交给它时转交下一个等待者"""
+        queue = self._queues.get(tenant)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.waiting -= 1
+            if not queue:
+                del self._queues[tenant]
+        elif future.done() and not future.cancelled():
+            self.release()
+
+    def release(self):
+        """归还名额：有等待者时直接交给下一个tenant的队首（active不变），否则减少active"""
+        while self._queues:
+            tenant, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                self._queues.move_to_end(tenant)
+            else:
+                del self._queues[tenant]
+            self.waiting -= 1
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+class CircuitBreaker:
+    """
+    连续失败failure_threshold次后打开（open），open_seconds内的请求直接拒绝；
+    到期后半开（half_open），只放行一个探测请求：成功则关闭，失败则重新打开
+    上游返回的非临时错误（如API Key错误）说明上游可用，按成功计；429（限流）不计入
+    """
+    def __init__(self, failure_threshold: int, open_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def blocked_for(self) -> Optional[float]:
+        """熔断中返回剩余秒数（不改变状态），否则返回None"""
+        if self.state == "open":
+            remaining = self.opened_at + self.open_seconds - self.clock()
+            if remaining > 0:
+                return remaining
+        elif self.state == "half_open" and self._probing:
+            return 1.0
+        return None
+
+    def allow(self) -> Optional[float]:
+        """即将请求上游：允许时返回None（半开时本次请求即为探测），否则返回建议等待的秒数"""
+        blocked = self.blocked_for()
+        if blocked is not None:
+            return blocked
+        if self.state == "open":
+            self.state = "half_open"
+        if self.state == "half_open":
+            self._probing = True
+        return None
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("LLM上游已恢复，熔断关闭")
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.state = "open"
+            self.opened_at = self.clock()
+            logger.warning(f"LLM上游连续失败 {self.failures} 次，熔断 {self.open_seconds:.0f}s")
+
+    def release_probe(self):
+        """探测请求没有得到上游结果（如被取消），允许下一个请求探测"""
+        self._probing = False
+
+class _StreamFlight:
+    """进行中的流式请求：已产出的片段和结束状态，后加入的相同请求先重放已有片段再等待新片段"""
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.started = asyncio.get_running_loop().create_future()
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+
+    async def publish(self, chunk: str):
+        async with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def finish(self, error: Optional[BaseException] = None):
+        async with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: index < len(self.chunks) or self.done)
+                pending = self.chunks[index:]
+                finished = self.done
+            index += len(pending)
+            for chunk in pending:
+                yield chunk
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+async def _open_stream(factory: Callable[[], AsyncIterator[str]]) -> Tuple[Optional[str], AsyncIterator[str]]:
+    """开始上游流并取得第一个片段，返回 (第一个片段，流为空时为None, 流)；第一个片段之前的失败可以重试"""
+    stream = factory()
+    try:
+        return await stream.__anext__(), stream
+    except StopAsyncIteration:
+        return None, stream
+
+class LLMScheduler:
+    """
+    LLM请求调度（进程内，所有请求共用）：
+    - 合并：提示词相同的进行中请求只调用一次上游，结果（流式为逐段片段）分发给所有等待者
+    - 限流：同时进行的上游请求不超过max_concurrency，其余按会话公平排队；
+      排队已满或超时时抛出LLMBusy(429)，Retry-After按近期上游耗时和排队长度估算
+    - 重试：连接失败、超时、429和5xx以带随机抖动的指数退避重试，退避期间归还并发名额；
+      上游429的Retry-After对所有请求生效，等待超过重试上限时直接抛出LLMBusy(429)
+    - 熔断：连续失败（不含429）后在一段时间内直接抛出LLMBusy(503)，不再请求上游
+    """
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+        max_retries: int = LLM_MAX_RETRIES,
+        retry_base: float = LLM_RETRY_BASE_SECONDS,
+        retry_max: float = LLM_RETRY_MAX_SECONDS,
+        breaker_failures: int = LLM_BREAKER_FAILURES,
+        breaker_open_seconds: float = LLM_BREAKER_OPEN_SECONDS
+    ):
+        self.limiter = FairLimiter(max_concurrency, max_queue)
+        self.breaker = CircuitBreaker(breaker_failures, breaker_open_seconds)
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        # 上游请求耗时的指数移动平均（秒），用于估算Retry-After
+        self.latency = 1.0
+        # 上游429要求的等待截止时间（time.monotonic）
+        self._throttled_until = 0.0
+        self._flights: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+
+    def retry_after(self) -> float:
+        """排队中的请求大约需要的处理时间"""
+        return self.latency * (self.limiter.waiting + 1) / self.limiter.limit
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> Optional[float]:
+        """第attempt次重试前的等待秒数；上游要求的等待超过上限时返回None（不再重试）"""
+        if retry_after is not None:
+            if retry_after > self.retry_max:
+                return None
+            return retry_after + random.uniform(0, self.retry_base)
+        return random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+
+    def _throttle(self, retry_after: Optional[float]):
+        """上游限流并给出Retry-After：在此之前所有请求都不再发往上游"""
+        if retry_after is not None:
+            self._throttled_until = max(self._throttled_until, time.monotonic() + retry_after)
+
+    async def _wait_throttle(self):
+        """上游要求的等待未结束时：不超过重试等待上限则等待（不占用名额），否则抛出LLMBusy(429)"""
+        remaining = self._throttled_until - time.monotonic()
+        if remaining <= 0:
+            return
+        if remaining > self.retry_max:
+            LLM_SCHEDULER_TOTAL.inc(event="rate_limited")
+            raise LLMBusy("LLM服务限流，请稍后重试", 429, remaining)
+        await asyncio.sleep(remaining)
+
+    async def _admit(self, tenant: str):
+        """熔断时立即拒绝，否则排队取得并发名额"""
+        blocked = self.breaker.blocked_for()
+        if blocked is not None:
+            LLM_SCHEDULER_TOTAL.inc(event="circuit_open")
+            raise LLMBusy("LLM服务连续失败，已暂停请求，请稍后重试", 503, blocked)
+        start = time.perf_counter()
+        if not await self.limiter.acquire(tenant, self.queue_timeout):
+            LLM_SCHEDULER_TOTAL.inc(event="rejected")
+            raise LLMBusy("当前提问较多，请稍后重试", 429, self.retry_after())
+        record_stage("llm_queue", time.perf_counter() - start)
+
+    async def _call_with_retries(self, tenant: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        请求上游，临时错误时退避重试；每次尝试前排队取得并发名额，退避等待期间不占用名额
+        成功时返回结果并保留名额（由调用方释放），抛出异常时名额已释放
+        """
+        attempt = 0
+        while True:
+            await self._wait_throttle()
+            await self._admit(tenant)
+            blocked = self.breaker.allow()
+            if blocked is not None:
+                self.limiter.release()
+                LLM_SCHEDULER_TOTAL.inc(event="circuit_open")
+                raise LLMBusy("LLM服务连续失败，已暂停请求，请稍后重试", 503, blocked)
+
+            LLM_SCHEDULER_TOTAL.inc(event="upstream")
+            start = time.perf_counter()
+            try:
+                result = await call()
+            except LLMUpstreamError as e:
+                self.limiter.release()
+                if not e.transient:
+                    self.breaker.record_success()
+                    raise
+                if e.status_code == 429:
+                    # 限流说明上游可用，不计入熔断的连续失败
+                    self.breaker.release_probe()
+                    self._throttle(e.retry_after)
+                else:
+                    self.breaker.record_failure()
+                delay = self._backoff(attempt, e.retry_after) if attempt < self.max_retries else None
+                if delay is None:
+                    if e.status_code == 429:
+                        raise LLMBusy("LLM服务限流，请稍后重试", 429, e.retry_after or self.retry_after()) from e
+                    raise
+                attempt += 1
+                LLM_SCHEDULER_TOTAL.inc(event="retry")
+                logger.warning(f"LLM请求失败，{delay:.1f}s 后第 {attempt} 次重试: {str(e)}")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.limiter.release()
+                self.breaker.release_probe()
+                raise
+
+            self.breaker.record_success()
+            self.latency = 0.8 * self.latency + 0.2 * (time.perf_counter() - start)
+            return result
+
+    async def _run(self, tenant: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        result = await self._call_with_retries(tenant, call)
+        self.limiter.release()
+        return result
+
+    async def complete(self, key: str, tenant: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行一次非流式请求，key相同的进行中请求合并为一次上游调用
+        上游调用在独立的任务中执行，发起请求的客户端断开时不影响其他等待者
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(self._run(tenant, call))
+            self._flights[key] = flight
+            flight.add_done_callback(lambda done: self._flights.pop(key, None) if self._flights.get(key) is done else None)
+        else:
+            LLM_SCHEDULER_TOTAL.inc(event="coalesced")
+        return await asyncio.shield(flight)
+
+    async def _run_stream(self, key: str, tenant: str, factory: Callable[[], AsyncIterator[str]], flight: _StreamFlight):
+        try:
+            try:
+                first, stream = await self._call_with_retries(tenant, lambda: _open_stream(factory))
+            except BaseException as e:
+                flight.started.set_exception(e)
+                return
+
+            flight.started.set_result(None)
+            try:
+                if first is not None:
+                    await flight.publish(first)
+                    async for chunk in stream:
+                        await flight.publish(chunk)
+                await flight.finish()
+            except BaseException as e:
+                await flight.finish(e)
+            finally:
+                self.limiter.release()
+        finally:
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+
+    async def stream(self, key: str, tenant: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        开始流式请求，key相同的进行中请求共享同一个上游流
+        在上游返回第一个片段后才返回迭代器：排队、重试和熔断的错误在此抛出；第一个片段之后不再重试
+        """
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            flight.task = asyncio.ensure_future(self._run_stream(key, tenant, factory, flight))
+        else:
+            LLM_SCHEDULER_TOTAL.inc(event="coalesced")
+        await asyncio.shield(flight.started)
+        return flight.subscribe()
+
+    def stats(self) -> Dict:
+        return {
+            "active": self.limiter.active,
+            "waiting": self.limiter.waiting,
+            "max_concurrency": self.limiter.limit,
+            "in_flight": len(self._flights) + len(self._streams),
+            "breaker_state": self.breaker.state,
+            "latency_seconds": round(self.latency, 3)
+        }
@@ -1,29 +1,109 @@
 import json
-import requests
-from typing import List, Dict, Optional
-from app.config import LLM_API_ENDPOINT, LLM_MODEL_NAME
+import time
+import hashlib
+import httpx
+from typing import List, Dict, Optional, AsyncIterator, TYPE_CHECKING
+from app.config import (
+    LLM_API_ENDPOINT,
+    LLM_MODEL_NAME,
+    LLM_TIMEOUT,
+    LLM_MAX_CONNECTIONS,
+    LLM_KEEPALIVE_EXPIRY,
+    PROMPT_TOKEN_BUDGET
+)
+from app.services.context_packer import ContextPacker, PackedContext
+from app.services.metrics import span, record_stage, LLM_TOKENS_TOTAL, ERRORS_TOTAL
+
+if TYPE_CHECKING:
+    from app.services.llm_scheduler import LLMScheduler
+
+class LLMError(Exception):
+    """调用LLM API失败"""
+    pass
+
+class LLMUpstreamError(LLMError):
+    """
+    上游返回错误或请求失败
+    transient表示可以重试（连接失败、超时、429、5xx），retry_after为上游Retry-After头要求的等待秒数
+    """
+    def __init__(self, message: str, transient: bool = False, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.transient = transient
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class LLMBusy(LLMError):
+    """
+    请求被调度器拒绝：排队已满、排队超时或上游持续限流时status_code为429，熔断期间为503
+    retry_after为建议客户端等待的秒数（Retry-After头）
+    """
+    def __init__(self, message: str, status_code: int, retry_after: float):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+def _status_error(response: httpx.Response) -> LLMUpstreamError:
+    """HTTP错误响应转换为LLMUpstreamError，429和5xx可重试"""
+    retry_after = None
+    try:
+        retry_after = float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        pass
+    return LLMUpstreamError(
+        f"请求失败: HTTP {response.status_code} {response.text[:200]}",
+        transient=response.status_code == 429 or response.status_code >= 500,
+        status_code=response.status_code,
+        retry_after=retry_after
+    )
+
+def create_http_client() -> httpx.AsyncClient:
+    """创建长连接复用的异步HTTP客户端（进程内共享，应用关闭时释放）"""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+        )
+    )
 
 class LLMService:
-    def __init__(self, api_key: str):
+    """
+    调用LLM生成回答；传入scheduler时上游请求经调度器合并、限流、重试和熔断（见llm_scheduler），
+    未传入时直接请求上游
+    """
+    def __init__(
+        self,
+        api_key: str,
+        client: httpx.AsyncClient,
+        context_packer: Optional[ContextPacker] = None,
+        prompt_token_budget: int = PROMPT_TOKEN_BUDGET,
+        scheduler: Optional["LLMScheduler"] = None
+    ):
         self.api_key = api_key
+        self.client = client
+        self.scheduler = scheduler
         self.api_endpoint = LLM_API_ENDPOINT
         self.model_name = LLM_MODEL_NAME
-        
-    def _build_prompt(self, query: str, context_blocks: List[Dict]) -> str:
+        self.context_packer = context_packer or ContextPacker()
+        self.prompt_token_budget = prompt_token_budget
+
+    def pack_context(self, query: str, context_blocks: List[Dict]) -> PackedContext:
+        """
+        在提示词token预算内打包检索结果
+        预算扣除模板和问题本身占用的token后，剩余部分留给文档内容
+        """
+        with span("context_pack"):
+            count_tokens = self.context_packer.count_tokens
+            overhead = count_tokens(self._build_prompt(query, ""))
+            packed = self.context_packer.pack(context_blocks, max(self.prompt_token_budget - overhead, 0))
+            packed.prompt_tokens = overhead + packed.tokens
+        return packed
+
+    def _build_prompt(self, query: str, context: str) -> str:
         """构建提示词"""
-        context_texts = []
-        for block in context_blocks:
-            content = block['content']
-            block_type = block['metadata']['block_type']
-            if block_type == 'table':
-                context_texts.append(f"表格内容：\n{content}")
-            else:
-                context_texts.append(content)
-                
-        context = "\n\n".join(context_texts)
-        
         prompt = f"""请基于以下文档内容回答用户的问题。如果无法从文档内容中找到答案，请明确说明。
-        
+
 文档内容：
 {context}
 
@@ -31,64 +111,184 @@ class LLMService:
 {query}
 
 请提供准确、完整的回答，并尽可能引用原文内容。"""
-        
+
         return prompt
-        
-    def generate_response(
-        self,
-        query: str,
-        context_blocks: List[Dict]
-    ) -> Dict[str, str]:
-        """
-        生成回答
-        返回：{
-            'answer': str,  # 生成的回答
-            'error': Optional[str]  # 如果发生错误，返回错误信息
-        }
-        """
-        prompt = self._build_prompt(query, context_blocks)
-        
+
+    def _build_request(self, prompt: str, stream: bool = False) -> Dict:
+        """构建请求头和请求体"""
         headers = {
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {self.api_key}'
         }
-        
+
         data = {
             'model': self.model_name,
             'messages': [
                 {'role': 'user', 'content': prompt}
             ]
         }
-        
+        if stream:
+            data['stream'] = True
+
+        return {'headers': headers, 'json': data}
+
+    def _request_key(self, prompt: str, stream: bool) -> str:
+        """相同上游、模型、API Key和提示词的请求可以合并"""
+        payload = json.dumps([self.api_endpoint, self.model_name, self.api_key, prompt, stream], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def _post_completion(self, prompt: str, prompt_tokens: int) -> str:
+        """请求一次上游并返回回答，失败时抛出LLMUpstreamError"""
         try:
-            response = requests.post(
+            response = await self.client.post(
                 self.api_endpoint,
-                headers=headers,
-                json=data,
-                timeout=30
+                **self._build_request(prompt)
             )
-            response.raise_for_status()
-            
-            result = response.json()
-            if 'error' in result:
-                return {
-                    'answer': None,
-                    'error': f"API错误: {result['error']}"
-                }
-                
-            answer = result['choices'][0]['message']['content']
+        except httpx.TransportError as e:
+            raise LLMUpstreamError(f"请求失败: {str(e)}", transient=True) from e
+        if response.status_code >= 400:
+            raise _status_error(response)
+
+        result = response.json()
+        if 'error' in result:
+            raise LLMUpstreamError(f"API错误: {result['error']}")
+
+        answer = result['choices'][0]['message']['content']
+        self._count_tokens(prompt_tokens, len(answer or ""), result.get('usage'))
+        return answer
+
+    async def generate_response(
+        self,
+        query: str,
+        packed: PackedContext,
+        tenant: str = "default"
+    ) -> Dict[str, str]:
+        """
+        生成回答，tenant为调度器公平排队的单位（会话）
+        返回：{
+            'answer': str,  # 生成的回答
+            'error': Optional[str]  # 如果发生错误，返回错误信息
+        }
+        调度器拒绝请求时抛出LLMBusy
+        """
+        with span("prompt_build"):
+            prompt = self._build_prompt(query, packed.text)
+
+        def call():
+            return self._post_completion(prompt, packed.prompt_tokens)
+
+        try:
+            with span("llm_request"):
+                if self.scheduler is None:
+                    answer = await call()
+                else:
+                    answer = await self.scheduler.complete(self._request_key(prompt, stream=False), tenant, call)
             return {
                 'answer': answer,
                 'error': None
             }
-            
-        except requests.RequestException as e:
+
+        except LLMBusy:
+            raise
+        except LLMError as e:
+            ERRORS_TOTAL.inc(kind="llm")
             return {
                 'answer': None,
-                'error': f"请求失败: {str(e)}"
+                'error': str(e)
             }
         except Exception as e:
+            ERRORS_TOTAL.inc(kind="llm")
             return {
                 'answer': None,
                 'error': f"处理失败: {str(e)}"
-            } 
\ No newline at end of file
+            }
+
+    @staticmethod
+    def _count_tokens(prompt_tokens: int, completion_chars: int, usage: Optional[Dict] = None):
+        """累计token用量，上游未返回usage时使用打包时的计数和回答字符数"""
+        usage = usage or {}
+        LLM_TOKENS_TOTAL.inc(usage.get('prompt_tokens') or prompt_tokens or 0, kind="prompt")
+        LLM_TOKENS_TOTAL.inc(usage.get('completion_tokens') or completion_chars, kind="completion")
+
+    async def open_stream(
+        self,
+        query: str,
+        packed: PackedContext,
+        tenant: str = "default"
+    ) -> AsyncIterator[str]:
+        """
+        开始流式生成，返回逐段产出增量文本的异步迭代器
+        经调度器时在取得第一个片段后才返回：排队、重试和熔断产生的错误（LLMBusy或LLMError）在此抛出，
+        调用方可以在开始响应前返回对应的状态码；之后的失败由迭代器抛出LLMError
+        """
+        with span("prompt_build"):
+            prompt = self._build_prompt(query, packed.text)
+
+        def factory():
+            return self._stream_completion(prompt, packed.prompt_tokens)
+
+        if self.scheduler is None:
+            return factory()
+        return await self.scheduler.stream(self._request_key(prompt, stream=True), tenant, factory)
+
+    async def _stream_completion(self, prompt: str, prompt_tokens: int) -> AsyncIterator[str]:
+        """
+        请求一次上游流式接口，逐段产出增量文本
+        上游返回SSE格式（data: {...}），以 data: [DONE] 结束
+        失败时抛出LLMError（HTTP错误和连接失败为LLMUpstreamError）
+        """
+        start = time.perf_counter()
+        first_token = True
+        usage = None
+        completion_chars = 0
+        try:
+            async with self.client.stream(
+                "POST",
+                self.api_endpoint,
+                **self._build_request(prompt, stream=True)
+            ) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    raise _status_error(response)
+
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    if not payload:
+                        continue
+
+                    chunk = json.loads(payload)
+                    if 'error' in chunk:
+                        raise LLMError(f"API错误: {chunk['error']}")
+                    usage = chunk.get('usage') or usage
+
+                    choices = chunk.get('choices') or []
+                    if not choices:
+                        continue
+                    delta = choices[0].get('delta') or {}
+                    text = delta.get('content')
+                    if text:
+                        if first_token:
+                            record_stage("llm_first_token", time.perf_counter() - start)
+                            first_token = False
+                        completion_chars += len(text)
+                        yield text
+
+        except httpx.TransportError as e:
+            ERRORS_TOTAL.inc(kind="llm")
+            raise LLMUpstreamError(f"请求失败: {str(e)}", transient=True) from e
+        except httpx.HTTPError as e:
+            ERRORS_TOTAL.inc(kind="llm")
+            raise LLMError(f"请求失败: {str(e)}") from e
+        except json.JSONDecodeError as e:
+            ERRORS_TOTAL.inc(kind="llm")
+            raise LLMError(f"处理失败: {str(e)}") from e
+        except LLMError:
+            ERRORS_TOTAL.inc(kind="llm")
+            raise
+
+        record_stage("llm_stream", time.perf_counter() - start)
+        self._count_tokens(prompt_tokens, completion_chars, usage)
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+class LRUCache:
+    """线程安全的有界LRU缓存，超出容量时淘汰最久未使用的条目"""
+
+    def __init__(self, capacity: int, on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        if capacity < 1:
+            raise ValueError("capacity必须大于0")
+        self.capacity = capacity
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any):
+        evicted = []
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                evicted.append(self._data.popitem(last=False))
+                self.evictions += 1
+        # 回调放在锁外执行，避免回调中再次访问缓存导致死锁
+        if self.on_evict:
+            for evicted_key, evicted_value in evicted:
+                self.on_evict(evicted_key, evicted_value)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """命中则返回缓存值，否则调用loader加载并放入缓存"""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.put(key, value)
+        return value
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
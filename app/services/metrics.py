@@ -0,0 +1,216 @@
+import time
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.config import METRICS_ENABLED
+
+# 默认的延迟分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 当前请求内各阶段的累计耗时，由中间件在请求开始时设置
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+def _format_labels(labelnames: Sequence[str], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """累积分桶直方图"""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签：[各分桶计数..., +Inf计数], 总和
+        self._values: Dict[Tuple, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """进程内指标注册表，按Prometheus文本格式输出"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> List[str]:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return lines
+
+def format_metric(
+    name: str,
+    help_text: str,
+    samples: Dict[Tuple[Tuple[str, str], ...], float],
+    metric_type: str = "gauge"
+) -> List[str]:
+    """输出在抓取时才计算的指标，samples的键为 ((标签名, 标签值), ...)"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples.items():
+        label_text = "{" + ",".join(f'{key}="{_escape(val)}"' for key, val in labels) + "}" if labels else ""
+        lines.append(f"{name}{label_text} {_format_value(value)}")
+    return lines
+
+REGISTRY = MetricsRegistry()
+
+# 入库任务timings中记录的阶段（chatdoc_ingest_stage_seconds_total按这些阶段汇总）
+INGEST_STAGES = ("extract", "parse", "embed", "upsert", "lexical", "total")
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "chatdoc_stage_seconds", "问答各阶段耗时（秒）", ("stage",)
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "chatdoc_http_request_seconds", "HTTP请求总耗时（秒）", ("method", "route", "status")
+)
+ANSWER_CACHE_TOTAL = REGISTRY.counter(
+    "chatdoc_answer_cache_lookups_total", "问答缓存查找次数（按结果）", ("result",)
+)
+LLM_TOKENS_TOTAL = REGISTRY.counter(
+    "chatdoc_llm_tokens_total", "发送给LLM和LLM返回的token数（上游未返回用量时：提示词按打包时的计数，回答按字符数估算）", ("kind",)
+)
+ERRORS_TOTAL = REGISTRY.counter(
+    "chatdoc_errors_total", "错误次数（按类型）", ("kind",)
+)
+RECLAIMED_BYTES_TOTAL = REGISTRY.counter(
+    "chatdoc_reclaimed_bytes_total", "存储回收释放的字节数（files为原始文件和倒排索引，sqlite/chroma为整理后数据库文件的缩小量）", ("store",)
+)
+LLM_SCHEDULER_TOTAL = REGISTRY.counter(
+    "chatdoc_llm_scheduler_total", "LLM调度事件次数（upstream上游请求、coalesced合并到进行中的相同请求、retry重试、rejected排队已满或超时、rate_limited上游限流期间拒绝、circuit_open熔断拒绝）", ("event",)
+)
+EMBED_QUERY_BATCH_SIZE = REGISTRY.histogram(
+    "chatdoc_embed_query_batch_size", "问题编码微批每批合并的问题数", buckets=(1, 2, 4, 8, 16, 32)
+)
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        record_stage(self.stage, time.perf_counter() - self.start)
+        return False
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(stage: str):
+    """
+    计时一个阶段：计入 chatdoc_stage_seconds，并累加到当前请求的Server-Timing中
+    关闭指标时返回共享的空上下文管理器，几乎没有开销
+    """
+    if not METRICS_ENABLED:
+        return _NOOP_SPAN
+    return _Span(stage)
+
+def record_stage(stage: str, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+def start_request_timings() -> Tuple[Dict[str, float], object]:
+    timings: Dict[str, float] = {}
+    return timings, _request_timings.set(timings)
+
+def reset_request_timings(token):
+    _request_timings.reset(token)
+
+def format_server_timing(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """生成Server-Timing响应头（毫秒）"""
+    parts = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
@@ -0,0 +1,333 @@
+import os
+import json
+import uuid
+import shutil
+import logging
+from datetime import datetime
+from typing import List, Dict, Optional, Callable, Tuple
+
+import numpy as np
+
+from app.config import VECTOR_INDEX_PATH, VECTOR_INDEX_DTYPE, VECTOR_SEARCH_BLOCK_ROWS, RETRIEVER_CACHE_SIZE
+from app.services.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_DTYPES = ("float16", "int8")
+# 索引文件格式：2起保存float32原始向量和量化误差，检索结果精确
+INDEX_FORMAT = 2
+_MANIFEST = "manifest.json"
+_EMPTY_QUERY_RESULT = {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+
+def quantize(embeddings: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    返回 (量化后的矩阵, 每行的缩放系数)
+    float16直接转换，缩放系数为1；int8按行对称量化：x ≈ scale * q，scale = max|x| / 127
+    """
+    if dtype == "float16":
+        return embeddings.astype(np.float16), np.ones(len(embeddings), dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(embeddings).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(embeddings / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"不支持的向量类型: {dtype}")
+
+class VersionIndex:
+    """
+    单个版本的只读索引：vectors（n x d，float16或int8）、exact（n x d，float32原始向量）和
+    records（每行一条JSON：id、text、metadata）以内存映射方式打开，每个映射占用一个文件描述符；
+    norms（原始向量的行范数）、scales（int8的反量化系数）、errors（每行量化误差的相对范数）和
+    records的字节偏移offsets较小，直接读入内存
+    manifest中的deleted为版本的软删除标记
+    """
+    def __init__(self, directory: str, manifest: Dict):
+        self.manifest = manifest
+        self.count = manifest["count"]
+        self.deleted = manifest.get("deleted", False)
+        if not self.count:
+            return
+        prefix = os.path.join(directory, manifest["generation"])
+        self.vectors = np.load(f"{prefix}.vectors.npy", mmap_mode="r")
+        self.norms = np.load(f"{prefix}.norms.npy")
+        self.scales = np.load(f"{prefix}.scales.npy")
+        # 早期格式（format 1）没有原始向量，norms为量化后的行范数，只能近似检索，重新写入后升级
+        self.exact = self.errors = None
+        if manifest.get("format", 1) >= INDEX_FORMAT:
+            self.exact = np.load(f"{prefix}.exact.npy", mmap_mode="r")
+            self.errors = np.load(f"{prefix}.errors.npy")
+        self.offsets = np.load(f"{prefix}.offsets.npy")
+        self.records = np.memmap(f"{prefix}.records.jsonl", dtype=np.uint8, mode="r")
+
+    def record(self, row: int) -> Dict:
+        return json.loads(self.records[self.offsets[row]:self.offsets[row + 1]].tobytes())
+
+    def search(self, query_embedding: List[float], top_k: int, block_rows: int = VECTOR_SEARCH_BLOCK_ROWS) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        精确top-k余弦检索，返回 (行号, 相似度)，结果与float32暴力检索一致，按相似度降序、相同时按行号
+        1. 量化向量与问题做一次矩阵向量乘法得到近似相似度（行数超过block_rows时分块转换为float32，限制临时内存）；
+           每行近似值与真实值之差不超过该行的errors（|x' - x|·|q| / (|x|·|q|)）
+        2. 近似值加误差仍低于第k大的“近似值减误差”的行不可能进入top-k，其余行为候选
+        3. 候选行读取float32原始向量重新计算相似度并排序
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        denominator = np.maximum(self.norms, 1e-12) * max(float(np.linalg.norm(query)), 1e-12)
+        approx = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, block_rows):
+            block = self.vectors[start:start + block_rows].astype(np.float32)
+            np.dot(block, query, out=approx[start:start + len(block)])
+        k = min(top_k, self.count)
+        if self.exact is None:
+            approx /= denominator
+            rows = np.argpartition(-approx, k - 1)[:k]
+            rows = rows[np.lexsort((rows, -approx[rows]))]
+            return rows, approx[rows]
+
+        approx *= self.scales
+        approx /= denominator
+        lower = approx - self.errors
+        threshold = np.partition(lower, self.count - k)[self.count - k]
+        candidates = np.flatnonzero(approx + self.errors >= threshold)
+
+        scores = (self.exact[candidates] @ query) / denominator[candidates]
+        order = np.lexsort((candidates, -scores))[:k]
+        return candidates[order], scores[order]
+
+    def embeddings(self) -> np.ndarray:
+        """全部原始向量（float32）"""
+        if self.exact is None:
+            return self.vectors.astype(np.float32) * self.scales[:, None]
+        return np.array(self.exact)
+
+class MmapVectorStore:
+    """
+    内存映射向量库：每个版本一个目录，保存量化向量、float32原始向量、行范数和记录表
+    检索时扫描量化向量筛选候选，再用原始向量重新排序，结果与float32精确余弦top-k一致；
+    原始向量只读取候选行，页缓存中常驻的主要是量化向量
+    以只读内存映射打开，加载几乎不耗时，多个进程共享同一份页缓存
+    写入时生成新一代文件，再原子替换manifest.json；读取时以manifest的inode和修改时间校验缓存，
+    因此服务进程能看到入库工作进程写入的新数据
+    软删除标记保存在manifest中，检索和计数时排除已删除的版本
+    没有索引的版本（切换后端前入库的数据）交给fallback返回的ChromaDB向量库处理
+    """
+    backend = "mmap"
+
+    def __init__(
+        self,
+        root=VECTOR_INDEX_PATH,
+        dtype: str = VECTOR_INDEX_DTYPE,
+        fallback: Optional[Callable[[], object]] = None,
+        cache_size: int = RETRIEVER_CACHE_SIZE,
+        block_rows: int = VECTOR_SEARCH_BLOCK_ROWS
+    ):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"不支持的向量类型: {dtype}，可选 {', '.join(SUPPORTED_DTYPES)}")
+        self.root = str(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.dtype = dtype
+        self.fallback = fallback
+        self.block_rows = block_rows
+        # version_id -> ((manifest的inode, 修改时间), VersionIndex)
+        self.resolved = LRUCache(cache_size)
+
+    def path_for(self, version_id: int) -> str:
+        return os.path.join(self.root, f"version_{version_id}")
+
+    def _load(self, version_id: int) -> Optional[VersionIndex]:
+        """加载版本的索引，没有索引时返回None"""
+        directory = self.path_for(version_id)
+        manifest_path = os.path.join(directory, _MANIFEST)
+        # 读取manifest后、打开数据文件前，其他进程可能写入了新一代并删除旧文件，此时重新读取一次
+        for attempt in range(2):
+            try:
+                stat = os.stat(manifest_path)
+            except FileNotFoundError:
+                self.resolved.pop(version_id)
+                return None
+
+            # manifest每次写入都是替换为新文件，inode与修改时间不变即索引未变
+            signature = (stat.st_ino, stat.st_mtime_ns)
+            cached = self.resolved.get(version_id)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+            try:
+                with open(manifest_path, encoding="utf-8") as f:
+                    index = VersionIndex(directory, json.load(f))
+            except FileNotFoundError:
+                if attempt:
+                    raise
+                continue
+            self.resolved.put(version_id, (signature, index))
+            return index
+
+    def _fallback(self):
+        return self.fallback() if self.fallback is not None else None
+
+    def write_version(
+        self,
+        version_id: int,
+        chunks: List[Dict],
+        embeddings: List[List[float]],
+        batch_size: Optional[int] = None
+    ) -> int:
+        """
+        一次写入版本的全部chunk（batch_size仅为与ChromaDB向量库的接口一致），返回上一代中本次已不存在的记录数
+        """
+        directory = self.path_for(version_id)
+        os.makedirs(directory, exist_ok=True)
+        previous = self._load(version_id)
+        previous_ids = {previous.record(row)["id"] for row in range(previous.count)} if previous else set()
+
+        generation = uuid.uuid4().hex[:12]
+        prefix = os.path.join(directory, generation)
+        dimension = 0
+        if chunks:
+            matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(chunks), -1)
+            dimension = matrix.shape[1]
+            vectors, scales = quantize(matrix, self.dtype)
+            lines = [
+                json.dumps(
+                    {"id": chunk["id"], "text": chunk["text"], "metadata": chunk["metadata"]},
+                    ensure_ascii=False
+                ).encode("utf-8") + b"\n"
+                for chunk in chunks
+            ]
+            offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+            np.cumsum([len(line) for line in lines], out=offsets[1:])
+
+            norms = np.linalg.norm(matrix, axis=1)
+            # 量化误差的相对范数，检索时据此确定哪些行需要用原始向量重新计算
+            residual = np.linalg.norm(vectors.astype(np.float32) * scales[:, None] - matrix, axis=1)
+            errors = residual / np.maximum(norms, 1e-12)
+            # 加上float32计算自身的舍入余量，保证候选集合不漏掉真正的top-k
+            errors += 1e-5
+
+            np.save(f"{prefix}.vectors.npy", vectors)
+            np.save(f"{prefix}.exact.npy", matrix)
+            np.save(f"{prefix}.norms.npy", norms.astype(np.float32))
+            np.save(f"{prefix}.scales.npy", scales)
+            np.save(f"{prefix}.errors.npy", errors.astype(np.float32))
+            np.save(f"{prefix}.offsets.npy", offsets)
+            with open(f"{prefix}.records.jsonl", "wb") as f:
+                f.writelines(lines)
+
+        self._write_manifest(version_id, {
+            "generation": generation,
+            "format": INDEX_FORMAT,
+            "count": len(chunks),
+            "dim": dimension,
+            "dtype": self.dtype,
+            "deleted": False,
+            "created_at": datetime.utcnow().isoformat(timespec="seconds")
+        })
+        self._remove_old_generations(directory, generation)
+        return len(previous_ids - {chunk["id"] for chunk in chunks})
+
+    def _write_manifest(self, version_id: int, manifest: Dict):
+        """写入临时文件后原子替换manifest.json"""
+        manifest_path = os.path.join(self.path_for(version_id), _MANIFEST)
+        with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+        self.resolved.pop(version_id)
+
+    @staticmethod
+    def _remove_old_generations(directory: str, generation: str):
+        """删除旧一代文件；Windows上仍被其他进程映射的文件删除失败时留到下次写入再删"""
+        for name in os.listdir(directory):
+            if name == _MANIFEST or name.startswith(f"{generation}."):
+                continue
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+    def query(self, version_id: int, query_embedding: List[float], top_k: int) -> Tuple[Dict, str]:
+        """在版本内检索，返回与ChromaDB相同格式的结果，距离为 1 - 余弦相似度"""
+        index = self._load(version_id)
+        if index is None:
+            fallback = self._fallback()
+            if fallback is not None:
+                return fallback.query(version_id, query_embedding, top_k)
+            return _EMPTY_QUERY_RESULT, "cosine"
+        if not index.count or index.deleted:
+            return _EMPTY_QUERY_RESULT, "cosine"
+
+        rows, scores = index.search(query_embedding, top_k, self.block_rows)
+        records = [index.record(row) for row in rows]
+        return {
+            "ids": [[record["id"] for record in records]],
+            "documents": [[record["text"] for record in records]],
+            "metadatas": [[record["metadata"] for record in records]],
+            "distances": [[1.0 - float(score) for score in scores]]
+        }, "cosine"
+
+    def get(self, version_id: int, include: Optional[List[str]] = None, include_deleted: bool = True) -> Dict:
+        """读取版本的全部记录，include可含 documents、metadatas、embeddings"""
+        include = include or []
+        index = self._load(version_id)
+        if index is None:
+            fallback = self._fallback()
+            if fallback is not None:
+                return fallback.get(version_id, include, include_deleted)
+            return {"ids": [], "embeddings": None, "documents": [], "metadatas": []}
+        if index.deleted and not include_deleted:
+            return {"ids": [], "embeddings": None, "documents": [], "metadatas": []}
+
+        records = [index.record(row) for row in range(index.count)]
+        return {
+            "ids": [record["id"] for record in records],
+            "documents": [record["text"] for record in records] if "documents" in include else None,
+            "metadatas": [record["metadata"] for record in records] if "metadatas" in include else None,
+            "embeddings": (
+                index.embeddings().tolist() if index.count else []
+            ) if "embeddings" in include else None
+        }
+
+    def count(self, version_id: int, include_deleted: bool = False) -> int:
+        index = self._load(version_id)
+        if index is None:
+            fallback = self._fallback()
+            return fallback.count(version_id, include_deleted) if fallback is not None else 0
+        return 0 if index.deleted and not include_deleted else index.count
+
+    def set_deleted(self, version_id: int, deleted: bool = True) -> int:
+        """在manifest中写入删除标记，返回版本的记录数；旧数据交给fallback处理"""
+        index = self._load(version_id)
+        if index is None:
+            fallback = self._fallback()
+            return fallback.set_deleted(version_id, deleted) if fallback is not None else 0
+        if index.deleted != deleted:
+            self._write_manifest(version_id, {**index.manifest, "deleted": deleted})
+        return index.count
+
+    def delete_version(self, version_id: int) -> int:
+        """删除版本的索引目录（以及fallback中的旧数据），返回删除的记录数"""
+        index = self._load(version_id)
+        count = index.count if index is not None else 0
+        self.resolved.pop(version_id)
+        shutil.rmtree(self.path_for(version_id), ignore_errors=True)
+        fallback = self._fallback()
+        if fallback is not None:
+            count += fallback.delete_version(version_id)
+        return count
+
+    def vacuum(self) -> Dict:
+        """索引目录删除即释放空间；整理fallback中ChromaDB的数据库文件"""
+        fallback = self._fallback()
+        return fallback.vacuum() if fallback is not None else {"compacted": False, "reason": "no_chroma_data"}
+
+    def invalidate(self, version_id: int):
+        self.resolved.pop(version_id)
+
+    def prewarm(self, version_id: int):
+        if self._load(version_id) is None:
+            fallback = self._fallback()
+            if fallback is not None:
+                fallback.prewarm(version_id)
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.backend,
+            "dtype": self.dtype,
+            "loaded_versions": self.resolved.stats()
+        }
@@ -0,0 +1,172 @@
+import threading
+import time
+import logging
+from typing import Optional, Dict, TYPE_CHECKING
+
+from fastapi import Depends, HTTPException, Request
+
+from app.services.llm_service import create_http_client
+from app.services.llm_scheduler import LLMScheduler
+from app.services.answer_cache import AnswerCache
+from app.services.context_packer import ContextPacker, create_token_counter
+from app.services.storage_reclaimer import StorageReclaimer
+from app.config import ANSWER_CACHE_ENABLED
+
+if TYPE_CHECKING:
+    # 文档处理器依赖llama_index、torch等重量级库，在后台加载模型时才导入
+    from app.services.document_processor import DocumentProcessor
+
+logger = logging.getLogger(__name__)
+
+class ServiceRegistry:
+    """
+    进程级共享服务注册表
+    嵌入模型、ChromaDB客户端和节点解析器在进程内只加载一次，
+    由FastAPI lifespan创建，请求处理与后台任务共用同一个实例
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._loader: Optional[threading.Thread] = None
+        self._document_processor: Optional["DocumentProcessor"] = None
+        self._context_packer: Optional[ContextPacker] = None
+        self._storage_reclaimer: Optional[StorageReclaimer] = None
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        # 加载各阶段耗时：导入依赖库、创建处理器（加载模型和向量库）、预热编码
+        self.load_breakdown: Dict[str, float] = {}
+        
+        # LLM调用共用的异步连接池
+        self.llm_client = create_http_client()
+        # LLM请求的合并、限流、重试和熔断（进程内所有请求共用）
+        self.llm_scheduler = LLMScheduler()
+        
+        # 问答缓存（命中计数在进程内累计）
+        self.answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
+
+    def load(self) -> "DocumentProcessor":
+        """加载模型并执行一次预热编码（线程安全，重复调用只加载一次）"""
+        with self._lock:
+            if self._document_processor is not None:
+                return self._document_processor
+
+            start = time.perf_counter()
+            breakdown = {}
+            try:
+                stage_start = time.perf_counter()
+                from app.services.document_processor import DocumentProcessor
+                breakdown["import"] = time.perf_counter() - stage_start
+
+                stage_start = time.perf_counter()
+                processor = DocumentProcessor()
+                breakdown["init"] = time.perf_counter() - stage_start
+
+                stage_start = time.perf_counter()
+                processor.warm_up()
+                breakdown["warm_up"] = time.perf_counter() - stage_start
+            except Exception as e:
+                self.error = str(e)
+                logger.error(f"加载嵌入模型失败: {str(e)}")
+                raise
+
+            self._document_processor = processor
+            # 上下文打包使用嵌入模型的分词器计数
+            self._context_packer = ContextPacker(create_token_counter(processor.embed_model))
+            # 存储回收与检索共用同一个向量库和倒排索引实例
+            self._storage_reclaimer = StorageReclaimer(processor.vector_store, processor.lexical_store)
+            self.error = None
+            self.load_seconds = time.perf_counter() - start
+            self.load_breakdown = {stage: round(seconds, 3) for stage, seconds in breakdown.items()}
+            self._ready.set()
+            stages = ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in breakdown.items())
+            logger.info(f"嵌入模型加载完成，耗时 {self.load_seconds:.2f}s（{stages}）")
+            return processor
+
+    def start_background_load(self) -> threading.Thread:
+        """在后台线程中加载模型，避免阻塞服务启动"""
+        def _load():
+            try:
+                self.load()
+            except Exception:
+                # 错误已记录在self.error中，由就绪检查接口返回
+                pass
+
+        self._loader = threading.Thread(target=_load, name="model-loader", daemon=True)
+        self._loader.start()
+        return self._loader
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """阻塞等待模型加载完成（供后台任务使用）"""
+        return self._ready.wait(timeout)
+
+    @property
+    def document_processor(self) -> "DocumentProcessor":
+        if not self.is_ready:
+            raise RuntimeError("嵌入模型尚未加载完成")
+        return self._document_processor
+
+    @property
+    def context_packer(self) -> ContextPacker:
+        if not self.is_ready:
+            raise RuntimeError("嵌入模型尚未加载完成")
+        return self._context_packer
+
+    @property
+    def storage_reclaimer(self) -> StorageReclaimer:
+        if not self.is_ready:
+            raise RuntimeError("嵌入模型尚未加载完成")
+        return self._storage_reclaimer
+
+    async def aclose(self):
+        """释放连接池等资源（应用关闭时调用）"""
+        if self.answer_cache is not None:
+            self.answer_cache.flush_hits()
+        await self.llm_client.aclose()
+
+    def status(self) -> Dict:
+        """返回就绪状态信息"""
+        return {
+            "ready": self.is_ready,
+            "embedding_model": self._document_processor.embed_model_name if self.is_ready else None,
+            "load_seconds": self.load_seconds,
+            "load_breakdown": self.load_breakdown,
+            "error": self.error
+        }
+
+# 依赖注入
+def get_registry(request: Request) -> ServiceRegistry:
+    return request.app.state.registry
+
+def get_llm_client(registry: ServiceRegistry = Depends(get_registry)):
+    return registry.llm_client
+
+def get_llm_scheduler(registry: ServiceRegistry = Depends(get_registry)) -> LLMScheduler:
+    return registry.llm_scheduler
+
+def get_answer_cache(registry: ServiceRegistry = Depends(get_registry)):
+    return registry.answer_cache
+
+def get_document_processor(
+    registry: ServiceRegistry = Depends(get_registry)
+) -> "DocumentProcessor":
+    """获取共享的文档处理器，模型未就绪时返回503"""
+    if not registry.is_ready:
+        detail = f"模型加载失败: {registry.error}" if registry.error else "模型加载中，请稍后重试"
+        raise HTTPException(status_code=503, detail=detail)
+    return registry.document_processor
+
+def get_storage_reclaimer(
+    registry: ServiceRegistry = Depends(get_registry),
+    doc_processor: "DocumentProcessor" = Depends(get_document_processor)
+) -> StorageReclaimer:
+    return registry.storage_reclaimer
+
+def get_context_packer(
+    registry: ServiceRegistry = Depends(get_registry),
+    doc_processor: "DocumentProcessor" = Depends(get_document_processor)
+) -> ContextPacker:
+    return registry.context_packer
@@ -0,0 +1,253 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+
+from sqlalchemy import or_, func
+
+from app.models.database import (
+    SessionLocal, DocumentVersion, DocumentBlock, TableCell, VersionDiff, AnswerCacheEntry, IngestionJob
+)
+from app.services.metrics import RECLAIMED_BYTES_TOTAL
+from app.config import (
+    VERSION_RETENTION_DAYS,
+    RECLAIM_INTERVAL_HOURS,
+    RECLAIM_VACUUM_STEP_PAGES,
+    RECLAIM_VACUUM_CHROMA,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_DB_PATH,
+    CHROMA_DB_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+def path_size(path) -> int:
+    """文件或目录的总字节数，不存在时为0"""
+    path = str(path)
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def sqlite_size(path) -> int:
+    """SQLite数据库文件及其WAL文件的字节数"""
+    return sum(path_size(f"{path}{suffix}") for suffix in ("", "-wal"))
+
+class StorageReclaimer:
+    """
+    存储回收：清理软删除超过保留期的版本
+    删除原始.docx、向量、倒排索引文件，以及内容块、单元格、版本对比和问答缓存，版本记录保留并写入purged_at
+    之后整理SQLite和ChromaDB的数据库文件，返回回收的字节数
+    在服务进程内执行，与检索共用同一个向量库实例（删除collection和整理ChromaDB持有检索的读写锁）；
+    仍有排队或执行中入库任务的版本会跳过
+    """
+    def __init__(
+        self,
+        vector_store,
+        lexical_store,
+        session_factory=SessionLocal,
+        retention_days: float = VERSION_RETENTION_DAYS,
+        sqlite_path=SQLITE_DB_PATH,
+        chroma_path=CHROMA_DB_PATH,
+        vacuum_chroma: bool = RECLAIM_VACUUM_CHROMA
+    ):
+        self.vector_store = vector_store
+        self.lexical_store = lexical_store
+        self.session_factory = session_factory
+        self.retention_days = retention_days
+        self.sqlite_path = str(sqlite_path)
+        self.chroma_path = str(chroma_path)
+        self.vacuum_chroma_enabled = vacuum_chroma
+        # 同一时间只执行一次回收（定时任务与手动触发互斥）
+        self._lock = threading.Lock()
+
+    def expired_versions(self, db, now: datetime) -> List[DocumentVersion]:
+        cutoff = now - timedelta(days=self.retention_days)
+        active_jobs = db.query(IngestionJob.version_id).filter(IngestionJob.status.in_(("queued", "running")))
+        return db.query(DocumentVersion).filter(
+            DocumentVersion.is_deleted == True,
+            DocumentVersion.purged_at.is_(None),
+            DocumentVersion.deleted_at <= cutoff,
+            DocumentVersion.version_id.notin_(active_jobs)
+        ).order_by(DocumentVersion.deleted_at).all()
+
+    @staticmethod
+    def _row_counts(db, version_id: int) -> Dict[str, int]:
+        def count(model, *conditions):
+            return db.query(func.count()).select_from(model).filter(*conditions).scalar()
+        return {
+            "document_blocks": count(DocumentBlock, DocumentBlock.version_id == version_id),
+            "table_cells": count(TableCell, TableCell.version_id == version_id),
+            "version_diffs": count(
+                VersionDiff, or_(VersionDiff.old_version_id == version_id, VersionDiff.new_version_id == version_id)
+            ),
+            "answer_cache": count(AnswerCacheEntry, AnswerCacheEntry.version_id == version_id)
+        }
+
+    def _reclaim_version(self, db, version: DocumentVersion, now: datetime, dry_run: bool) -> Dict:
+        version_id = version.version_id
+        # mmap向量后端的索引目录计入文件大小（ChromaDB的数据计入chroma）
+        index_path = self.vector_store.path_for(version_id) if hasattr(self.vector_store, "path_for") else None
+        files = [
+            path for path in (version.stored_filepath, self.lexical_store.path_for(version_id), index_path)
+            if path and os.path.exists(path)
+        ]
+        report = {
+            "version_id": version_id,
+            "doc_base_id": version.doc_base_id,
+            "deleted_at": version.deleted_at.isoformat() if version.deleted_at else None,
+            "files": files,
+            "file_bytes": sum(path_size(path) for path in files),
+            "vector_records": self.vector_store.count(version_id, include_deleted=True),
+            "rows": self._row_counts(db, version_id)
+        }
+        if dry_run:
+            return report
+
+        # 先删除向量和文件（可重复执行），全部成功后再删除数据库中的派生数据并标记清理时间
+        self.vector_store.delete_version(version_id)
+        self.lexical_store.delete(version_id)
+        if version.stored_filepath and os.path.exists(version.stored_filepath):
+            os.remove(version.stored_filepath)
+
+        db.query(DocumentBlock).filter(DocumentBlock.version_id == version_id).delete(synchronize_session=False)
+        db.query(TableCell).filter(TableCell.version_id == version_id).delete(synchronize_session=False)
+        db.query(VersionDiff).filter(
+            or_(VersionDiff.old_version_id == version_id, VersionDiff.new_version_id == version_id)
+        ).delete(synchronize_session=False)
+        db.query(AnswerCacheEntry).filter(AnswerCacheEntry.version_id == version_id).delete(synchronize_session=False)
+        version.purged_at = now
+        db.commit()
+        return report
+
+    def vacuum_sqlite(self, full: bool = False) -> Dict:
+        """
+        整理应用数据库：auto_vacuum为INCREMENTAL时分步回收空闲页，每步是一个短事务，可以在服务运行时执行
+        旧数据库需要一次完整VACUUM才能切换为增量模式（期间写入会等待），只在full时执行
+        （POST /api/maintenance/reclaim?full_vacuum=true 或 python -m scripts.reclaim_storage --vacuum）
+        返回 {"compacted": 是否整理, "method"/"reason": 方式或跳过原因}
+        """
+        connection = sqlite3.connect(self.sqlite_path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        try:
+            if connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+                while free_pages:
+                    # incremental_vacuum每执行一步释放一页，execute只执行一步，executescript会执行到结束
+                    connection.executescript(f"PRAGMA incremental_vacuum({RECLAIM_VACUUM_STEP_PAGES});")
+                    remaining = connection.execute("PRAGMA freelist_count").fetchone()[0]
+                    if remaining >= free_pages:
+                        break
+                    free_pages = remaining
+                    # 让出写锁，等待中的写入可以插入执行
+                    time.sleep(0.01)
+                method = "incremental"
+            elif full:
+                connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                connection.execute("VACUUM")
+                method = "full"
+            else:
+                logger.warning("应用数据库不是增量整理模式，未整理；执行一次完整整理（full_vacuum）后切换为增量模式")
+                return {"compacted": False, "reason": "not_incremental"}
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return {"compacted": True, "method": method}
+        finally:
+            connection.close()
+
+    def run(self, dry_run: bool = False, full_vacuum: bool = False) -> Dict:
+        """
+        执行一次回收，返回报告：清理的版本、各存储回收的字节数和耗时
+        dry_run时只统计待清理的版本和文件大小，不做任何修改
+        full_vacuum时即使没有可回收的版本也整理数据库文件，并对旧数据库执行完整VACUUM（期间写入会等待）
+        报告的compaction给出每个存储是否实际整理，未整理时给出原因
+        """
+        with self._lock:
+            start = time.perf_counter()
+            now = datetime.utcnow()
+            sizes_before = {"sqlite": sqlite_size(self.sqlite_path), "chroma": path_size(self.chroma_path)}
+
+            reports, failed = [], []
+            with self.session_factory() as db:
+                for version in self.expired_versions(db, now):
+                    try:
+                        reports.append(self._reclaim_version(db, version, now, dry_run))
+                    except Exception as e:
+                        db.rollback()
+                        logger.exception(f"回收版本 {version.version_id} 失败")
+                        failed.append({"version_id": version.version_id, "error": str(e)})
+
+            reclaimed = {"files": sum(report["file_bytes"] for report in reports), "sqlite": 0, "chroma": 0}
+            skipped = {"compacted": False, "reason": "dry_run" if dry_run else "nothing_reclaimed"}
+            compaction = {"sqlite": skipped, "chroma": skipped}
+            if (reports or full_vacuum) and not dry_run:
+                vacuums = {"sqlite": lambda: self.vacuum_sqlite(full=full_vacuum)}
+                if self.vacuum_chroma_enabled:
+                    vacuums["chroma"] = self.vector_store.vacuum
+                else:
+                    compaction["chroma"] = {"compacted": False, "reason": "disabled"}
+                for name, vacuum in vacuums.items():
+                    try:
+                        compaction[name] = vacuum()
+                    except Exception as e:
+                        logger.warning(f"整理{name}数据库失败: {str(e)}")
+                        compaction[name] = {"compacted": False, "reason": f"error: {e}"}
+                reclaimed["sqlite"] = max(sizes_before["sqlite"] - sqlite_size(self.sqlite_path), 0)
+                reclaimed["chroma"] = max(sizes_before["chroma"] - path_size(self.chroma_path), 0)
+                for store, size in reclaimed.items():
+                    RECLAIMED_BYTES_TOTAL.inc(size, store=store)
+
+            summary = {
+                "dry_run": dry_run,
+                "retention_days": self.retention_days,
+                "versions": reports,
+                "failed": failed,
+                "bytes_reclaimed": {**reclaimed, "total": sum(reclaimed.values())},
+                "compaction": compaction,
+                "seconds": round(time.perf_counter() - start, 3)
+            }
+            if reports or failed:
+                action = "可回收" if dry_run else "已回收"
+                logger.info(
+                    f"存储回收：{action} {len(reports)} 个版本，失败 {len(failed)} 个，"
+                    f"释放 {summary['bytes_reclaimed']['total'] / 1024 / 1024:.1f} MB"
+                )
+            return summary
+
+class ReclaimScheduler:
+    """在服务进程内按固定间隔执行存储回收，随应用启动和关闭"""
+
+    def __init__(self, registry, interval_hours: float = RECLAIM_INTERVAL_HOURS):
+        self.registry = registry
+        self.interval = interval_hours * 3600
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_report: Optional[Dict] = None
+
+    def _loop(self):
+        # 等待模型加载完成（向量库随文档处理器一起创建），加载失败时不执行
+        while not self.registry.wait_ready(timeout=5):
+            if self._stop_event.is_set() or self.registry.error:
+                return
+        # 启动后等待一个间隔再执行，重启不会在服务开始处理请求时立即触发回收
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.last_report = self.registry.storage_reclaimer.run()
+            except Exception:
+                logger.exception("定时存储回收失败")
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._loop, name="storage-reclaimer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,110 @@
+import re
+from typing import List, Dict, Optional, Callable
+
+from app.config import TABLE_CHUNK_MAX_TOKENS, TABLE_CHUNK_MAX_ROWS
+
+# 去掉行名和列名后，问题剩余部分中可忽略的标点、语气和引导用语
+_LOOKUP_FILLER = re.compile(r"[\s?？。.!！,，:：、\"“”'‘’]|请问|请告诉我|告诉我|查询|查一下|表格?[中里]|的|呢|啊")
+# 剩余部分只能是这些查询用语（或为空），才直接返回单元格的值
+_LOOKUP_PHRASES = frozenset({
+    "", "是", "为", "是多少", "为多少", "是什么", "是几", "为几", "有多少", "多少",
+    "是多少钱", "多少钱", "等于多少", "是啥", "值", "值是多少", "值为多少", "数值", "数值是多少", "取值"
+})
+
+def row_group_html_id(table_html_id: str, row_start: int) -> str:
+    """行组的html_id，与预览中<tbody id>一致"""
+    return f"{table_html_id}_r{row_start}"
+
+def split_table(
+    markdown: str,
+    table_html_id: str,
+    count_tokens: Callable[[str], int],
+    max_tokens: int = TABLE_CHUNK_MAX_TOKENS,
+    max_rows: int = TABLE_CHUNK_MAX_ROWS
+) -> List[Dict]:
+    """
+    将Markdown表格按整行切分为行组，每个行组重复表头和分隔行
+    返回 [{'html_id', 'row_start', 'row_end', 'content'}]，row_start/row_end为数据行序号（不含表头，左闭右开）
+    只有一个行组时沿用表格本身的html_id
+    """
+    lines = markdown.split("\n")
+    header, rows = lines[:2], lines[2:]
+    if not rows:
+        return [{'html_id': table_html_id, 'row_start': 0, 'row_end': 0, 'content': markdown}]
+
+    header_tokens = count_tokens("\n".join(header))
+    bounds = []
+    start, used = 0, header_tokens
+    for index, row in enumerate(rows):
+        tokens = count_tokens(row) + 1
+        # 单行超出上限时独占一个行组，由节点解析器继续切分
+        if index > start and (used + tokens > max_tokens or index - start >= max_rows):
+            bounds.append((start, index))
+            start, used = index, header_tokens
+        used += tokens
+    bounds.append((start, len(rows)))
+
+    return [
+        {
+            'html_id': table_html_id if len(bounds) == 1 else row_group_html_id(table_html_id, row_start),
+            'row_start': row_start,
+            'row_end': row_end,
+            'content': "\n".join(header + rows[row_start:row_end])
+        }
+        for row_start, row_end in bounds
+    ]
+
+def _best_cells(cells: List[Dict]) -> List[Dict]:
+    """只保留匹配最长（行名加列名最长）的候选"""
+    matched = max(len(cell['row_label']) + len(cell['column_name']) for cell in cells)
+    return [cell for cell in cells if len(cell['row_label']) + len(cell['column_name']) == matched]
+
+def is_lookup_question(query: str, row_label: str, column_name: str) -> bool:
+    """问题去掉行名和列名后，只剩“的……是多少？”这类查询用语"""
+    rest = query
+    for label in sorted((row_label, column_name), key=len, reverse=True):
+        rest = rest.replace(label, "", 1)
+    return _LOOKUP_FILLER.sub("", rest) in _LOOKUP_PHRASES
+
+def match_cell_answer(query: str, cells: List[Dict]) -> Optional[Dict]:
+    """
+    从候选单元格（行名和列名都出现在问题中）中确定唯一答案
+    只保留匹配最长的候选；问题中还有查询用语以外的内容（如“产品A单价有没有包含税费”），
+    或候选的值不唯一时返回None，交给检索和LLM回答
+    """
+    if not cells:
+        return None
+    best = _best_cells(cells)
+    cell = best[0]
+    if not is_lookup_question(query, cell['row_label'], cell['column_name']):
+        return None
+    if len({cell['value'] for cell in best}) != 1:
+        return None
+
+    return {
+        'answer': f"根据文档表格，“{cell['row_label']}”的“{cell['column_name']}”为：{cell['value'] or '（空）'}",
+        'sources': list(dict.fromkeys(cell['html_id'] for cell in best)),
+        'cell': cell
+    }
+
+def cell_context_blocks(cells: List[Dict]) -> List[Dict]:
+    """
+    未直接回答时，把匹配最长的候选单元格转换为检索结果格式的上下文块，得分最高，打包时优先放入
+    与所在行组同一个html_id，行组也被检索到时合并在行组内容之前
+    """
+    if not cells:
+        return []
+    best = _best_cells(cells)
+    return [
+        {
+            'content': f"表格中“{cell['row_label']}”行“{cell['column_name']}”列的值为：{cell['value'] or '（空）'}",
+            'metadata': {
+                'html_id': cell['html_id'],
+                'block_type': 'paragraph',
+                'sequence_in_doc': cell['sequence_in_doc'],
+                'chunk_index': index - len(best)
+            },
+            'score': float("inf")
+        }
+        for index, cell in enumerate(best)
+    ]
@@ -0,0 +1,394 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import logging
+import zipfile
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple, IO
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import (
+    DOCS_STORAGE_PATH,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_MAX_BYTES,
+    UPLOAD_SESSION_PATH,
+    UPLOAD_SESSION_TTL_HOURS,
+    BULK_UPLOAD_MAX_FILES,
+    BULK_UPLOAD_MAX_BYTES
+)
+from app.models.database import Document, DocumentVersion
+from app.models.repository import Repository
+from app.services.file_lock import try_lock
+from app.services.job_queue import enqueue_job
+
+logger = logging.getLogger(__name__)
+
+_UPLOAD_ID = re.compile(r"[0-9a-f]{32}")
+_SHA256 = re.compile(r"[0-9a-f]{64}")
+
+class UploadError(ValueError):
+    """上传请求有误，status_code为接口返回的状态码；offset为断点续传中服务端已收到的字节数"""
+    def __init__(self, message: str, status_code: int = 400, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+def is_document(filename: Optional[str]) -> bool:
+    return bool(filename) and filename.lower().endswith(".docx")
+
+def file_sha256(path, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def remove_quietly(path: Optional[str]):
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _incoming_dir() -> str:
+    return os.path.join(str(UPLOAD_SESSION_PATH), "incoming")
+
+def new_incoming_path() -> str:
+    """上传数据的临时文件（与断点续传的会话在同一目录下，完成时可直接改名）"""
+    os.makedirs(_incoming_dir(), exist_ok=True)
+    return os.path.join(_incoming_dir(), f"{uuid.uuid4().hex}.part")
+
+async def iter_upload_file(file, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """按块读取UploadFile（multipart解析时超过1MB的文件已由Starlette暂存到磁盘，不整体读入内存）"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+def _write_chunk(handle: IO, digest, chunk: bytes):
+    handle.write(chunk)
+    if digest is not None:
+        digest.update(chunk)
+
+async def write_stream(chunks: AsyncIterator[bytes], handle: IO, digest, limit: int, written: int = 0) -> int:
+    """
+    把字节流逐块追加写入已打开的文件并更新哈希（digest可为None），返回写入后的总字节数
+    超过limit的数据块不写入，抛出UploadError(413)；写文件和计算哈希在线程池中执行，不阻塞事件循环
+    """
+    async for chunk in chunks:
+        if written + len(chunk) > limit:
+            raise UploadError(f"文件超过大小上限 {limit} 字节", status_code=413, offset=written)
+        await asyncio.to_thread(_write_chunk, handle, digest, chunk)
+        written += len(chunk)
+    return written
+
+async def save_stream(chunks: AsyncIterator[bytes], max_bytes: int = UPLOAD_MAX_BYTES) -> Tuple[str, int, str]:
+    """把上传流写入临时文件，返回 (临时文件路径, 字节数, SHA-256)，失败时删除临时文件"""
+    path = new_incoming_path()
+    digest = hashlib.sha256()
+    try:
+        with open(path, "wb") as f:
+            size = await write_stream(chunks, f, digest, max_bytes)
+    except BaseException:
+        remove_quietly(path)
+        raise
+    return path, size, digest.hexdigest()
+
+async def register_upload(
+    db: AsyncSession,
+    repo: Repository,
+    project_id: str,
+    filename: str,
+    source_path: str,
+    content_hash: str
+) -> Dict:
+    """
+    把已写入临时文件的上传登记为文档的新版本并创建入库任务（在调用方的事务中，由调用方提交）
+    同一文档已有内容哈希相同的版本（未删除、未入库失败）时不创建新版本、不重新入库，删除临时文件并返回该版本；
+    该版本不是最新版本时（如恢复到之前的内容）重新标记为最新
+    """
+    existing_doc = await repo.find_document(project_id, filename)
+
+    if existing_doc:
+        doc_base_id = existing_doc.doc_base_id
+        duplicate = await repo.find_version_by_hash(doc_base_id, content_hash)
+        if duplicate is not None:
+            remove_quietly(source_path)
+            if not duplicate.is_latest:
+                await repo.clear_latest(doc_base_id)
+                duplicate.is_latest = True
+            return {
+                "message": "文档内容与已有版本相同，未重新处理",
+                "duplicate": True,
+                "filename": filename,
+                "doc_base_id": doc_base_id,
+                "version_id": duplicate.version_id,
+                "version_number": duplicate.version_number,
+                "job_id": await repo.latest_job_id(duplicate.version_id)
+            }
+        version_number = await repo.next_version_number(doc_base_id)
+        await repo.clear_latest(doc_base_id)
+    else:
+        doc = Document(project_id=project_id, original_filename=filename)
+        db.add(doc)
+        await db.flush()
+        doc_base_id = doc.doc_base_id
+        version_number = 1
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    stored_filename = f"{doc_base_id}_v{version_number}_{timestamp}.docx"
+    stored_filepath = os.path.join(DOCS_STORAGE_PATH, stored_filename)
+    # 临时目录与文档目录可能不在同一文件系统，move在需要时复制
+    await asyncio.to_thread(shutil.move, source_path, stored_filepath)
+
+    version = DocumentVersion(
+        doc_base_id=doc_base_id,
+        version_number=version_number,
+        stored_filename=stored_filename,
+        stored_filepath=stored_filepath,
+        content_hash=content_hash,
+        status="processing",
+        is_latest=True
+    )
+    db.add(version)
+    await db.flush()
+
+    # 创建入库任务，由工作进程异步处理
+    job = await enqueue_job(db, version.version_id, stored_filepath, doc_base_id, project_id)
+    return {
+        "message": "文档上传成功，正在处理",
+        "duplicate": False,
+        "filename": filename,
+        "doc_base_id": doc_base_id,
+        "version_id": version.version_id,
+        "version_number": version_number,
+        "job_id": job.job_id
+    }
+
+class ChunkedUploadStore:
+    """
+    断点续传：每个上传一个会话目录，meta.json记录项目、文件名、声明的大小（和可选的SHA-256），data.part为已收到的数据
+    客户端按offset顺序发送数据块，offset与已收到的字节数不一致时返回409和服务端的offset，
+    连接中断后查询offset从该位置继续；收齐后complete校验大小和哈希，再由调用方登记为新版本
+    会话保存在磁盘上，服务重启或请求落到其他工作进程都可以继续；同一会话同时只允许一个请求写入（文件锁）
+    """
+    def __init__(
+        self,
+        root=UPLOAD_SESSION_PATH,
+        ttl_hours: float = UPLOAD_SESSION_TTL_HOURS,
+        max_bytes: int = UPLOAD_MAX_BYTES
+    ):
+        self.root = os.path.join(str(root), "sessions")
+        os.makedirs(self.root, exist_ok=True)
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_bytes = max_bytes
+
+    def _dir(self, upload_id: str) -> str:
+        if not _UPLOAD_ID.fullmatch(upload_id or ""):
+            raise UploadError("上传不存在", status_code=404)
+        return os.path.join(self.root, upload_id)
+
+    def _meta(self, upload_id: str) -> Dict:
+        try:
+            with open(os.path.join(self._dir(upload_id), "meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError("上传不存在或已过期", status_code=404)
+
+    def _lock(self, upload_id: str):
+        lock = try_lock(os.path.join(self._dir(upload_id), "lock"))
+        if lock is None:
+            raise UploadError("该上传正在由另一个请求写入", status_code=409)
+        return lock
+
+    def create(self, project_id: str, filename: str, size: int, sha256: Optional[str] = None) -> Dict:
+        if size <= 0:
+            raise UploadError("文件大小必须大于0")
+        if size > self.max_bytes:
+            raise UploadError(f"文件超过大小上限 {self.max_bytes} 字节", status_code=413)
+        if sha256 is not None and not _SHA256.fullmatch(sha256.lower()):
+            raise UploadError("sha256应为64位十六进制字符串")
+        self.cleanup_expired()
+
+        upload_id = uuid.uuid4().hex
+        directory = self._dir(upload_id)
+        os.makedirs(directory)
+        meta = {
+            "project_id": project_id,
+            "filename": filename,
+            "size": size,
+            "sha256": sha256.lower() if sha256 else None,
+            "created_at": datetime.utcnow().isoformat(timespec="seconds")
+        }
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        open(os.path.join(directory, "data.part"), "wb").close()
+        return self.status(upload_id)
+
+    def status(self, upload_id: str) -> Dict:
+        meta = self._meta(upload_id)
+        offset = os.path.getsize(os.path.join(self._dir(upload_id), "data.part"))
+        return {
+            "upload_id": upload_id,
+            "project_id": meta["project_id"],
+            "filename": meta["filename"],
+            "size": meta["size"],
+            "offset": offset,
+            "chunk_size": UPLOAD_CHUNK_SIZE,
+            "complete": offset == meta["size"]
+        }
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict:
+        """从offset处追加数据块；请求中途断开时已写入的部分保留，客户端查询offset后续传"""
+        meta = self._meta(upload_id)
+        lock = self._lock(upload_id)
+        try:
+            data_path = os.path.join(self._dir(upload_id), "data.part")
+            current = os.path.getsize(data_path)
+            if offset != current:
+                raise UploadError(f"offset应为 {current}", status_code=409, offset=current)
+            with open(data_path, "ab") as f:
+                await write_stream(chunks, f, None, meta["size"], current)
+        finally:
+            lock.close()
+        return self.status(upload_id)
+
+    async def complete(self, upload_id: str) -> Tuple[Dict, str, str]:
+        """
+        校验数据已收齐（以及声明的SHA-256），返回 (meta, 数据文件路径, SHA-256)，会话随即删除
+        哈希不一致时丢弃该上传
+        """
+        meta = self._meta(upload_id)
+        lock = self._lock(upload_id)
+        try:
+            data_path = os.path.join(self._dir(upload_id), "data.part")
+            offset = os.path.getsize(data_path)
+            if offset != meta["size"]:
+                raise UploadError(f"尚未收齐：已收到 {offset} / {meta['size']} 字节", status_code=409, offset=offset)
+            content_hash = await asyncio.to_thread(file_sha256, data_path)
+            if meta.get("sha256") and meta["sha256"] != content_hash:
+                self.discard(upload_id)
+                raise UploadError("文件内容与声明的sha256不一致，已丢弃该上传，请重新上传", status_code=422)
+            target = new_incoming_path()
+            os.replace(data_path, target)
+        finally:
+            lock.close()
+        self.discard(upload_id)
+        return meta, target, content_hash
+
+    def discard(self, upload_id: str):
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def cleanup_expired(self) -> int:
+        """删除超过保留时间没有续传的会话，以及中断的上传遗留的临时文件，返回删除的数量"""
+        deadline = time.time() - self.ttl_seconds
+        removed = 0
+        for name in os.listdir(self.root):
+            directory = os.path.join(self.root, name)
+            data_path = os.path.join(directory, "data.part")
+            try:
+                last_write = os.path.getmtime(data_path if os.path.exists(data_path) else directory)
+            except OSError:
+                continue
+            if last_write < deadline:
+                shutil.rmtree(directory, ignore_errors=True)
+                removed += 1
+        if os.path.isdir(_incoming_dir()):
+            for name in os.listdir(_incoming_dir()):
+                path = os.path.join(_incoming_dir(), name)
+                try:
+                    if os.path.getmtime(path) < deadline:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        if removed:
+            logger.info(f"清理了 {removed} 个过期的上传")
+        return removed
+
+_upload_store: Optional[ChunkedUploadStore] = None
+
+def get_upload_store() -> ChunkedUploadStore:
+    global _upload_store
+    if _upload_store is None:
+        _upload_store = ChunkedUploadStore()
+    return _upload_store
+
+def _member_filename(info: zipfile.ZipInfo) -> str:
+    """
+    zip条目的文件名（去掉目录）
+    Windows自带的压缩工具不设置UTF-8标志、中文文件名按GBK编码，Python按cp437解码，这里还原
+    """
+    name = info.filename
+    if not info.flag_bits & 0x800:
+        try:
+            name = name.encode("cp437").decode("gbk")
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return name.replace("\\", "/").rsplit("/", 1)[-1]
+
+def extract_documents(
+    zip_path: str,
+    max_files: int = BULK_UPLOAD_MAX_FILES,
+    max_bytes: int = BULK_UPLOAD_MAX_BYTES,
+    max_file_bytes: int = UPLOAD_MAX_BYTES
+) -> Tuple[List[Dict], List[Dict]]:
+    """
+    逐个解压zip中的.docx到临时文件并计算哈希，返回 (文档 [{filename, path, size, content_hash}], 跳过的条目 [{name, reason}])
+    按实际解压出的字节数检查单个文档和总大小的上限（不信任zip中记录的大小）；出错时删除已解压的临时文件
+    """
+    documents: List[Dict] = []
+    skipped: List[Dict] = []
+    total = 0
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                filename = _member_filename(info)
+                if info.filename.startswith("__MACOSX/") or filename.startswith(("~$", "._")):
+                    skipped.append({"name": info.filename, "reason": "系统或Word临时文件"})
+                    continue
+                if not is_document(filename):
+                    skipped.append({"name": info.filename, "reason": "只支持.docx格式文件"})
+                    continue
+                if len(documents) >= max_files:
+                    raise UploadError(f"zip中的文档超过 {max_files} 个", status_code=413)
+
+                path = new_incoming_path()
+                digest = hashlib.sha256()
+                size = 0
+                try:
+                    with archive.open(info) as source, open(path, "wb") as target:
+                        for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+                            size += len(chunk)
+                            if total + size > max_bytes:
+                                raise UploadError(f"解压后的文档总大小超过上限 {max_bytes} 字节", status_code=413)
+                            if size > max_file_bytes:
+                                raise ValueError(f"超过单个文档的大小上限 {max_file_bytes} 字节")
+                            digest.update(chunk)
+                            target.write(chunk)
+                except UploadError:
+                    remove_quietly(path)
+                    raise
+                except Exception as e:
+                    # 单个条目损坏、加密或超过大小上限时跳过，不影响其他文档
+                    remove_quietly(path)
+                    skipped.append({"name": info.filename, "reason": f"解压失败: {str(e)}"})
+                    continue
+                total += size
+                documents.append({"filename": filename, "path": path, "size": size, "content_hash": digest.hexdigest()})
+    except BaseException as e:
+        for document in documents:
+            remove_quietly(document["path"])
+        if isinstance(e, zipfile.BadZipFile):
+            raise UploadError("不是有效的zip文件")
+        raise
+    return documents, skipped
@@ -0,0 +1,432 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+import urllib.request
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from typing import List, Dict, Optional, Tuple
+
+from app.config import (
+    CHROMA_DB_PATH,
+    CHROMA_SERVER_URL,
+    VECTOR_LAYOUT,
+    VECTOR_SHARD_COUNT,
+    VECTOR_SHARD_PREFIX,
+    VECTOR_MIGRATION_BATCH_SIZE,
+    RETRIEVER_CACHE_SIZE,
+    UPSERT_BATCH_SIZE,
+    RECLAIM_CHROMA_VACUUM_TIMEOUT
+)
+from app.services.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+def create_chroma_client():
+    """配置了CHROMA_SERVER_URL时连接ChromaDB服务，否则以嵌入模式打开本地数据目录"""
+    import chromadb
+
+    if CHROMA_SERVER_URL:
+        url = urlsplit(CHROMA_SERVER_URL)
+        return chromadb.HttpClient(host=url.hostname, port=url.port or 8000, ssl=url.scheme == "https")
+    return chromadb.PersistentClient(path=str(CHROMA_DB_PATH))
+
+def vacuum_chroma_file(persist_directory: str) -> bool:
+    """对ChromaDB数据目录中的chroma.sqlite3执行VACUUM（嵌入模式的应用进程和ChromaDB服务进程共用），文件不存在时返回False"""
+    path = os.path.join(persist_directory, "chroma.sqlite3")
+    if not os.path.exists(path):
+        return False
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+    return True
+
+def resolve_layout(layout: str = VECTOR_LAYOUT, server: bool = bool(CHROMA_SERVER_URL)) -> str:
+    """
+    解析向量库布局：auto等同per_version，sharded只在显式配置时使用（检索延迟见VECTOR_LAYOUT的说明）
+    嵌入模式下配置sharded直接报错，而不是在多进程下丢失向量
+    """
+    if layout == "auto":
+        return "per_version"
+    if layout not in ("per_version", "sharded"):
+        raise ValueError(f"未知的向量库布局: {layout}")
+    if layout == "sharded" and not server:
+        raise ValueError(
+            "VECTOR_LAYOUT=sharded 需要ChromaDB服务（CHROMA_SERVER_URL）：嵌入模式下各进程各自加载分片索引，"
+            "看不到入库工作进程写入的向量，多个进程写同一分片还会互相覆盖索引文件"
+        )
+    return layout
+
+def legacy_collection_name(version_id: int) -> str:
+    """旧布局：每个版本一个collection"""
+    return f"version_{version_id}"
+
+def shard_collection_name(version_id: int, shard_count: int = VECTOR_SHARD_COUNT) -> str:
+    return f"{VECTOR_SHARD_PREFIX}_{version_id % shard_count:02d}"
+
+def deletion_metadata(version_id: int, deleted: bool) -> Dict:
+    """
+    分片记录的删除标记：is_deleted以0/1整数存储（兼容不支持布尔元数据过滤的Chroma版本）
+    live_version_id在未删除时等于version_id、删除后为-1，检索只需一个等值条件，
+    比 version_id AND is_deleted 的组合过滤快约一倍
+    """
+    return {"is_deleted": 1 if deleted else 0, "live_version_id": -1 if deleted else version_id}
+
+def version_filter(version_id: int, include_deleted: bool = False) -> Dict:
+    """分片内按版本过滤的where条件，默认排除已删除的记录"""
+    if include_deleted:
+        return {"version_id": version_id}
+    return {"live_version_id": version_id}
+
+class ReadWriteLock:
+    """
+    读写锁：检索并发持有读锁，删除collection和整理数据库文件持有写锁，等待中的写入优先（避免被持续的检索饿死）
+    不可重入，持有读锁时不能再次获取
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+# 版本在向量库中没有记录时的检索结果
+_EMPTY_QUERY_RESULT = {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+
+class VectorStore:
+    """
+    向量库：per_version布局每个版本写入自己的 version_{id} collection；
+    sharded布局按 version_id % VECTOR_SHARD_COUNT 写入固定数量的collection，打开的HNSW索引数量与版本数无关
+    存在 version_{id} collection 的版本总是从该collection读取，两种布局的数据可以共存，
+    迁移到分片的工具见 scripts/migrate_vector_store.py
+    两种布局的记录都带删除标记，检索时排除软删除的记录（早期写入、没有标记的collection在软删除时补写）
+    layout为None时按配置解析（见resolve_layout）
+    检索持有读锁，删除collection和整理ChromaDB数据库文件持有写锁，不会与进行中的检索交错
+    """
+    def __init__(self, chroma_client, shard_count: int = VECTOR_SHARD_COUNT, layout: Optional[str] = None):
+        self.client = chroma_client
+        self.shard_count = shard_count
+        self.layout = resolve_layout() if layout is None else layout
+        self._shards: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self.rw_lock = ReadWriteLock()
+        # version_id -> (collection, 是否为旧布局, 旧布局的记录是否标记为删除)
+        self.resolved = LRUCache(RETRIEVER_CACHE_SIZE)
+        self.legacy_opens = 0
+
+    def shard(self, version_id: int):
+        """获取（必要时创建）版本所在的分片collection，分片句柄常驻"""
+        name = shard_collection_name(version_id, self.shard_count)
+        with self._lock:
+            collection = self._shards.get(name)
+            if collection is None:
+                collection = self.client.get_or_create_collection(
+                    name=name,
+                    metadata={"layout": "shard", "shard_count": self.shard_count}
+                )
+                self._shards[name] = collection
+            return collection
+
+    def _legacy(self, version_id: int):
+        try:
+            return self.client.get_collection(name=legacy_collection_name(version_id))
+        except Exception:
+            return None
+
+    def _existing_shard(self, version_id: int):
+        """版本所在的分片，per_version布局下分片不存在时返回None（读取时不创建空分片）"""
+        if self.layout != "per_version":
+            return self.shard(version_id)
+        name = shard_collection_name(version_id, self.shard_count)
+        with self._lock:
+            collection = self._shards.get(name)
+        if collection is not None:
+            return collection
+        try:
+            self.client.get_collection(name=name)
+        except Exception:
+            return None
+        return self.shard(version_id)
+
+    @staticmethod
+    def _marked_deleted(collection) -> bool:
+        """version_{id} collection只有一个版本，抽查一条记录即可知道是否整体标记为删除"""
+        sample = collection.get(limit=1, include=["metadatas"])["metadatas"]
+        return bool(sample) and (sample[0] or {}).get("is_deleted") == 1
+
+    def _resolve(self, version_id: int) -> Tuple[Optional[object], bool, bool]:
+        """
+        返回 (collection, 是否为旧布局, 旧布局的记录是否标记为删除)；版本在向量库中没有记录时collection为None，
+        且不缓存该结果（版本可能稍后由入库工作进程写入）
+        """
+        def load():
+            legacy = self._legacy(version_id)
+            if legacy is not None:
+                self.legacy_opens += 1
+                return legacy, True, self._marked_deleted(legacy)
+            return self._existing_shard(version_id), False, False
+        collection, legacy, deleted = self.resolved.get_or_load(version_id, load)
+        if collection is None:
+            self.resolved.pop(version_id)
+        return collection, legacy, deleted
+
+    @staticmethod
+    def _where(version_id: int, legacy: bool, deleted: bool, include_deleted: bool = False) -> Optional[Dict]:
+        """
+        分片按版本和删除标记过滤；version_{id} collection只在标记为删除时按标记过滤（结果为空），
+        未删除时不加条件，避免Chroma 0.4元数据过滤的开销
+        """
+        if legacy:
+            return version_filter(version_id) if deleted and not include_deleted else None
+        return version_filter(version_id, include_deleted)
+
+    def collection_for_write(self, version_id: int):
+        """
+        入库写入的collection：sharded布局写入分片，并删除同一版本残留的旧collection，避免读取到过期数据
+        per_version布局写入该版本自己的collection
+        """
+        self.resolved.pop(version_id)
+        if self.layout == "per_version":
+            return self.client.get_or_create_collection(
+                name=legacy_collection_name(version_id),
+                metadata={"version_id": version_id}
+            )
+        if self._legacy(version_id) is not None:
+            with self.rw_lock.write():
+                self.client.delete_collection(name=legacy_collection_name(version_id))
+                self.resolved.pop(version_id)
+            logger.info(f"版本 {version_id} 重新入库，已删除旧布局的collection")
+        return self.shard(version_id)
+
+    def write_version(
+        self,
+        version_id: int,
+        chunks: List[Dict],
+        embeddings: List[List[float]],
+        batch_size: int = UPSERT_BATCH_SIZE
+    ) -> int:
+        """
+        以确定性ID批量写入版本的全部chunk（带未删除标记），并删除该版本本次未出现的旧ID，返回删除的旧记录数
+        分片collection中有多个版本的数据，清理只针对当前版本
+        """
+        collection = self.collection_for_write(version_id)
+        flags = deletion_metadata(version_id, deleted=False)
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
+            collection.upsert(
+                ids=[chunk['id'] for chunk in batch],
+                embeddings=embeddings[start:start + batch_size],
+                documents=[chunk['text'] for chunk in batch],
+                metadatas=[{**chunk['metadata'], **flags} for chunk in batch]
+            )
+
+        new_ids = {chunk['id'] for chunk in chunks}
+        existing_ids = collection.get(where={'version_id': version_id}, include=[])['ids']
+        stale_ids = [i for i in existing_ids if i not in new_ids]
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+        return len(stale_ids)
+
+    def invalidate(self, version_id: int):
+        self.resolved.pop(version_id)
+
+    def prewarm(self, version_id: int):
+        self._resolve(version_id)
+
+    def query(self, version_id: int, query_embedding: List[float], top_k: int) -> Tuple[Dict, str]:
+        """在版本范围内检索（排除软删除的记录），返回 (Chroma查询结果, 距离空间)"""
+        with self.rw_lock.read():
+            collection, legacy, deleted = self._resolve(version_id)
+            if collection is None:
+                return _EMPTY_QUERY_RESULT, "l2"
+            result = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=top_k,
+                where=self._where(version_id, legacy, deleted),
+                include=["documents", "metadatas", "distances"]
+            )
+            return result, (collection.metadata or {}).get("hnsw:space", "l2")
+
+    def get(self, version_id: int, include: Optional[List[str]] = None, include_deleted: bool = True) -> Dict:
+        """读取版本的全部记录"""
+        with self.rw_lock.read():
+            return self._get(version_id, include, include_deleted)
+
+    def _get(self, version_id: int, include: Optional[List[str]], include_deleted: bool) -> Dict:
+        collection, legacy, deleted = self._resolve(version_id)
+        if collection is None:
+            return {"ids": [], "embeddings": None, "documents": [], "metadatas": []}
+        return collection.get(
+            where=self._where(version_id, legacy, deleted, include_deleted),
+            include=include if include is not None else []
+        )
+
+    def count(self, version_id: int, include_deleted: bool = False) -> int:
+        """版本的记录数，默认不计软删除的记录"""
+        with self.rw_lock.read():
+            collection, legacy, deleted = self._resolve(version_id)
+            if collection is None:
+                return 0
+            if legacy:
+                return 0 if deleted and not include_deleted else collection.count()
+            return len(self._get(version_id, None, include_deleted)["ids"])
+
+    def set_deleted(self, version_id: int, deleted: bool = True) -> int:
+        """
+        更新版本所有记录的删除标记，返回更新的记录数
+        version_{id} collection中没有标记的旧记录同时补写version_id和标记，之后检索按标记过滤
+        """
+        collection, legacy, _ = self._resolve(version_id)
+        if collection is None:
+            return 0
+        records = collection.get(
+            where=None if legacy else version_filter(version_id, include_deleted=True),
+            include=["metadatas"]
+        )
+        if not records["ids"]:
+            return 0
+        flags = {"version_id": version_id, **deletion_metadata(version_id, deleted)}
+        collection.update(
+            ids=records["ids"],
+            metadatas=[{**(metadata or {}), **flags} for metadata in records["metadatas"]]
+        )
+        self.resolved.pop(version_id)
+        return len(records["ids"])
+
+    def delete_version(self, version_id: int) -> int:
+        """
+        删除版本的全部向量，返回删除的记录数
+        旧布局直接删除collection（同时删除其索引目录）；分片中按version_id删除记录，HNSW只标记删除、不缩小索引文件
+        """
+        with self.rw_lock.write():
+            self.resolved.pop(version_id)
+            legacy = self._legacy(version_id)
+            if legacy is not None:
+                count = legacy.count()
+                self.client.delete_collection(name=legacy_collection_name(version_id))
+                return count
+            collection = self._existing_shard(version_id)
+            if collection is None:
+                return 0
+            ids = collection.get(where=version_filter(version_id, include_deleted=True), include=[])["ids"]
+            if ids:
+                collection.delete(ids=ids)
+            return len(ids)
+
+    def vacuum(self) -> Dict:
+        """
+        整理ChromaDB的SQLite文件（删除collection后释放的页），在写锁内执行，检索等待整理结束
+        嵌入模式下直接整理数据目录；使用ChromaDB服务时由服务进程执行（scripts/chroma_server.py的整理接口）
+        返回 {"compacted": 是否整理, "method"/"reason": 方式或跳过原因}；分片布局中删除的记录在HNSW索引中只标记删除，
+        索引文件不会缩小
+        """
+        settings = self.client.get_settings()
+        with self.rw_lock.write():
+            if settings.is_persistent:
+                compacted, method = vacuum_chroma_file(settings.persist_directory), "embedded"
+            else:
+                scheme = "https" if settings.chroma_server_ssl_enabled else "http"
+                url = f"{scheme}://{settings.chroma_server_host}:{settings.chroma_server_http_port}/api/v1/maintenance/vacuum"
+                request = urllib.request.Request(url, method="POST")
+                with urllib.request.urlopen(request, timeout=RECLAIM_CHROMA_VACUUM_TIMEOUT) as response:
+                    compacted, method = json.load(response)["compacted"], "server"
+        report = {"compacted": compacted, "method": method} if compacted else {"compacted": False, "reason": "no_database_file"}
+        if self.layout == "sharded":
+            report["hnsw"] = "marked_deleted"
+        return report
+
+    def stats(self) -> Dict:
+        return {
+            "shard_count": self.shard_count,
+            "open_shards": len(self._shards),
+            "legacy_opens": self.legacy_opens,
+            "resolved_versions": self.resolved.stats()
+        }
+
+    def migrate_legacy(
+        self,
+        deleted_versions: Optional[set] = None,
+        batch_size: int = VECTOR_MIGRATION_BATCH_SIZE,
+        keep_legacy: bool = False,
+        dry_run: bool = False
+    ) -> List[Dict]:
+        """
+        将旧布局的 version_{id} collection 复制到分片中（保留原向量，不重新计算）
+        每个版本复制完成并核对记录数后删除旧collection（keep_legacy时保留）
+        deleted_versions中的版本写入is_deleted=1；返回每个版本的迁移报告
+        """
+        deleted_versions = deleted_versions or set()
+        prefix = legacy_collection_name(0)[:-1]
+        reports = []
+        for collection in self.client.list_collections():
+            name = getattr(collection, "name", collection)
+            suffix = name[len(prefix):] if name.startswith(prefix) else ""
+            if not suffix.isdigit():
+                continue
+            version_id = int(suffix)
+            legacy = self.client.get_collection(name=name)
+            total = legacy.count()
+            report = {"version_id": version_id, "source": name, "target": shard_collection_name(version_id, self.shard_count), "records": total}
+            if dry_run:
+                reports.append(report)
+                continue
+
+            target = self.shard(version_id)
+            flags = deletion_metadata(version_id, version_id in deleted_versions)
+            for offset in range(0, total, batch_size):
+                batch = legacy.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+                target.upsert(
+                    ids=batch["ids"],
+                    embeddings=batch["embeddings"],
+                    documents=batch["documents"],
+                    metadatas=[
+                        {**(metadata or {}), "version_id": version_id, **flags}
+                        for metadata in batch["metadatas"]
+                    ]
+                )
+
+            copied = len(target.get(where=version_filter(version_id, include_deleted=True), include=[])["ids"])
+            report["copied"] = copied
+            if copied != total:
+                report["error"] = "记录数不一致，已保留旧collection"
+                logger.error(f"迁移版本 {version_id} 失败：旧collection {total} 条，分片中 {copied} 条")
+            elif not keep_legacy:
+                with self.rw_lock.write():
+                    self.client.delete_collection(name=name)
+                    self.resolved.pop(version_id)
+                report["legacy_deleted"] = True
+            self.resolved.pop(version_id)
+            reports.append(report)
+            logger.info(f"版本 {version_id} 已迁移到 {report['target']}（{copied} 条）")
+        return reports
@@ -0,0 +1,117 @@
+from difflib import SequenceMatcher
+from typing import List, Dict, Tuple
+
+from app.services.embedding_cache import text_hash
+
+# 替换区间内两个块的文本相似度低于该值时，视为删除旧块、新增新块，而不是修改
+PAIR_MIN_SIMILARITY = 0.3
+
+def block_fingerprint(block_type: str, content: str) -> str:
+    """内容块指纹：块类型加规范化文本的哈希，空白和全半角的差异不算修改"""
+    return text_hash(f"{block_type}\n{content}")
+
+def text_diff(old_text: str, new_text: str, block_type: str) -> List[Dict]:
+    """
+    块内文本差异，返回 [{'op': 'equal' | 'insert' | 'delete', 'text': str}]
+    段落按字符比较，表格按行比较
+    """
+    if block_type == 'table':
+        old_units, new_units, joiner = old_text.split("\n"), new_text.split("\n"), "\n"
+    else:
+        old_units, new_units, joiner = old_text, new_text, ""
+
+    segments = []
+    matcher = SequenceMatcher(None, old_units, new_units, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            segments.append({'op': 'equal', 'text': joiner.join(old_units[i1:i2])})
+            continue
+        if i2 > i1:
+            segments.append({'op': 'delete', 'text': joiner.join(old_units[i1:i2])})
+        if j2 > j1:
+            segments.append({'op': 'insert', 'text': joiner.join(new_units[j1:j2])})
+    return segments
+
+def match_blocks(old_blocks: List[Dict], new_blocks: List[Dict]) -> List[Tuple]:
+    """
+    按指纹对两个版本的内容块做序列差异，返回SequenceMatcher的opcodes
+    old_blocks/new_blocks：按文档顺序排列的 {'html_id', 'block_type', 'fingerprint'}
+    """
+    matcher = SequenceMatcher(
+        None,
+        [block['fingerprint'] for block in old_blocks],
+        [block['fingerprint'] for block in new_blocks],
+        autojunk=False
+    )
+    return matcher.get_opcodes()
+
+def replaced_html_ids(old_blocks: List[Dict], new_blocks: List[Dict], opcodes: List[Tuple]) -> Tuple[List[str], List[str]]:
+    """需要做文本对比的块（位于替换区间内），只有这些块需要读取正文"""
+    old_ids, new_ids = [], []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'replace':
+            old_ids.extend(block['html_id'] for block in old_blocks[i1:i2])
+            new_ids.extend(block['html_id'] for block in new_blocks[j1:j2])
+    return old_ids, new_ids
+
+def build_changes(
+    old_blocks: List[Dict],
+    new_blocks: List[Dict],
+    opcodes: List[Tuple],
+    old_contents: Dict[str, str],
+    new_contents: Dict[str, str]
+) -> Dict:
+    """
+    由块级差异生成对比结果，返回 {'summary': {...}, 'changes': [...]}
+    changes中的old_html_id/new_html_id可直接用于两个版本预览中的高亮
+    """
+    changes = []
+    summary = {'unchanged': 0, 'changed': 0, 'added': 0, 'removed': 0}
+
+    def removed(block):
+        summary['removed'] += 1
+        changes.append({'op': 'removed', 'old_html_id': block['html_id'], 'new_html_id': None, 'block_type': block['block_type']})
+
+    def added(block):
+        summary['added'] += 1
+        changes.append({'op': 'added', 'old_html_id': None, 'new_html_id': block['html_id'], 'block_type': block['block_type']})
+
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            summary['unchanged'] += i2 - i1
+        elif tag == 'delete':
+            for block in old_blocks[i1:i2]:
+                removed(block)
+        elif tag == 'insert':
+            for block in new_blocks[j1:j2]:
+                added(block)
+        else:
+            # 替换区间内按位置配对；类型不同或文本差异过大的视为删除加新增
+            olds, news = old_blocks[i1:i2], new_blocks[j1:j2]
+            for index in range(max(len(olds), len(news))):
+                old = olds[index] if index < len(olds) else None
+                new = news[index] if index < len(news) else None
+                if old is None:
+                    added(new)
+                    continue
+                if new is None:
+                    removed(old)
+                    continue
+                old_text, new_text = old_contents.get(old['html_id'], ""), new_contents.get(new['html_id'], "")
+                if (
+                    old['block_type'] != new['block_type']
+                    or SequenceMatcher(None, old_text, new_text, autojunk=False).quick_ratio() < PAIR_MIN_SIMILARITY
+                ):
+                    removed(old)
+                    added(new)
+                    continue
+                summary['changed'] += 1
+                changes.append({
+                    'op': 'changed',
+                    'old_html_id': old['html_id'],
+                    'new_html_id': new['html_id'],
+                    'block_type': new['block_type'],
+                    'diff': text_diff(old_text, new_text, new['block_type'])
+                })
+
+    return {'summary': summary, 'changes': changes}
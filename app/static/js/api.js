@@ -19,7 +19,13 @@ const API = {
     },
 
     // 文档相关
+    // 超过该大小的文件使用断点续传，网络中断后从服务端已收到的位置继续
+    chunkedUploadThreshold: 8 * 1024 * 1024,
+
     async uploadDocument(projectId, file) {
+        if (file.size > this.chunkedUploadThreshold) {
+            return await this.uploadDocumentChunked(projectId, file);
+        }
         const formData = new FormData();
         formData.append('file', file);
         formData.append('project_id', projectId);
@@ -31,13 +37,76 @@ const API = {
         return await response.json();
     },
 
-    async listDocuments(projectId) {
-        const response = await fetch(`${this.baseUrl}/documents/${projectId}`);
+    async uploadDocumentChunked(projectId, file, maxRetries = 5) {
+        const params = new URLSearchParams({ project_id: projectId, filename: file.name, size: file.size });
+        let response = await fetch(`${this.baseUrl}/uploads/?${params}`, { method: 'POST' });
+        const upload = await response.json();
+        if (!response.ok) {
+            throw new Error(upload.detail || '创建上传失败');
+        }
+
+        let offset = upload.offset;
+        let failures = 0;
+        while (offset < file.size) {
+            try {
+                response = await fetch(`${this.baseUrl}/uploads/${upload.upload_id}?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: file.slice(offset, Math.min(offset + upload.chunk_size, file.size))
+                });
+            } catch (error) {
+                response = null;
+            }
+            if (response && response.ok) {
+                offset = (await response.json()).offset;
+                failures = 0;
+                continue;
+            }
+            if (response && response.status !== 409) {
+                const error = await response.json();
+                throw new Error(error.detail || '上传失败');
+            }
+            // 网络中断或409（中断的请求已写入部分数据）：稍后查询服务端已收到的字节数，从该位置续传
+            if (++failures > maxRetries) {
+                throw new Error('上传多次中断，请稍后重试');
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+            const status = await fetch(`${this.baseUrl}/uploads/${upload.upload_id}`);
+            offset = (await status.json()).offset;
+        }
+
+        response = await fetch(`${this.baseUrl}/uploads/${upload.upload_id}/complete`, { method: 'POST' });
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(result.detail || '上传失败');
+        }
+        return result;
+    },
+
+    // 分页列表：返回 { 列表, page: { before, after } }，传入 page.before 加载更早的一页
+    async listDocuments(projectId, before = null) {
+        const response = await fetch(`${this.baseUrl}/documents/${projectId}${this.pageQuery(before)}`);
+        return await response.json();
+    },
+
+    async listVersions(docBaseId, before = null) {
+        const response = await fetch(`${this.baseUrl}/documents/${docBaseId}/versions${this.pageQuery(before)}`);
+        return await response.json();
+    },
+
+    async getPreview(versionId, start = 0) {
+        const response = await fetch(`${this.baseUrl}/versions/${versionId}/preview?start=${start}`);
         return await response.json();
     },
 
-    async listVersions(docBaseId) {
-        const response = await fetch(`${this.baseUrl}/documents/${docBaseId}/versions`);
+    async getVersionDiff(docBaseId, oldVersionId, newVersionId) {
+        const response = await fetch(
+            `${this.baseUrl}/documents/${docBaseId}/diff?old_version_id=${oldVersionId}&new_version_id=${newVersionId}`
+        );
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.detail || '版本对比失败');
+        }
         return await response.json();
     },
 
@@ -71,11 +140,67 @@ const API = {
         return await response.json();
     },
 
-    async getChatHistory(sessionId) {
-        const response = await fetch(`${this.baseUrl}/chat/${sessionId}/messages`);
+    // 流式问答：逐段回调增量文本，结束时返回 { sources, message_id }
+    async sendMessageStream(sessionId, query, onToken) {
+        const params = new URLSearchParams({ query });
+        const response = await fetch(`${this.baseUrl}/chat/${sessionId}/messages/stream?${params}`, {
+            method: 'POST'
+        });
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.detail || response.statusText);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let result = null;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // SSE事件之间以空行分隔
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const { event, data } = this.parseSseEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+
+                if (event === 'token') {
+                    onToken(data.text);
+                } else if (event === 'done') {
+                    result = data;
+                } else if (event === 'error') {
+                    throw new Error(data.detail);
+                }
+            }
+        }
+        return result;
+    },
+
+    parseSseEvent(raw) {
+        let event = 'message';
+        const dataLines = [];
+        raw.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        return { event, data: JSON.parse(dataLines.join('\n') || '{}') };
+    },
+
+    async getChatHistory(sessionId, before = null) {
+        const response = await fetch(`${this.baseUrl}/chat/${sessionId}/messages${this.pageQuery(before)}`);
         return await response.json();
     },
 
+    pageQuery(before) {
+        return before ? `?${new URLSearchParams({ before })}` : '';
+    },
+
     // 设置相关
     async updateApiKey(apiKey) {
         const response = await fetch(`${this.baseUrl}/settings/api-key`, {
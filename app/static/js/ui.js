@@ -24,7 +24,9 @@ const UI = {
         currentDocBaseId: null,
         currentVersionId: null,
         currentSessionId: null,
-        highlightedBlockId: null
+        highlightedBlockId: null,
+        olderMessagesCursor: null,
+        loadingOlderMessages: false
     },
 
     // 初始化UI
@@ -52,6 +54,13 @@ const UI = {
             }
         });
         
+        // 聊天记录滚动到顶部时加载更早的消息
+        this.elements.chatMessages.addEventListener('scroll', () => {
+            if (this.elements.chatMessages.scrollTop < 50) {
+                this.loadOlderMessages();
+            }
+        });
+        
         // 模态框
         this.elements.modalCancelBtn.addEventListener('click', () => this.hideModal());
     },
@@ -179,39 +188,8 @@ const UI = {
         if (documentsContainer.classList.contains('hidden')) {
             try {
                 this.showLoading();
-                const { documents } = await API.listDocuments(projectId);
-                
-                documentsContainer.innerHTML = documents.map(doc => `
-                    <div class="document-item mb-2 p-2 border rounded hover:bg-gray-100"
-                         data-doc-base-id="${doc.doc_base_id}">
-                        <div class="flex items-center justify-between">
-                            <div>
-                                <span class="font-medium">${doc.original_filename}</span>
-                                ${doc.version_number ? `<span class="text-sm text-gray-500 ml-2">v${doc.version_number}</span>` : ''}
-                            </div>
-                            <button class="upload-version-btn text-primary text-sm">上传新版本</button>
-                        </div>
-                        <div class="versions-container mt-2 ml-4 hidden"></div>
-                    </div>
-                `).join('');
-
-                // 绑定文档点击事件
-                documentsContainer.querySelectorAll('.document-item').forEach(item => {
-                    item.addEventListener('click', (e) => {
-                        if (!e.target.classList.contains('upload-version-btn')) {
-                            this.toggleDocument(item);
-                        }
-                    });
-                });
-
-                // 绑定上传新版本按钮事件
-                documentsContainer.querySelectorAll('.upload-version-btn').forEach(btn => {
-                    btn.addEventListener('click', (e) => {
-                        e.stopPropagation();
-                        const docBaseId = btn.closest('.document-item').dataset.docBaseId;
-                        this.showUploadVersionModal(projectId, docBaseId);
-                    });
-                });
+                documentsContainer.innerHTML = '';
+                await this.loadDocumentsPage(documentsContainer, projectId, null);
 
                 documentsContainer.classList.remove('hidden');
             } catch (error) {
@@ -224,53 +202,123 @@ const UI = {
         }
     },
 
+    // 加载一页文档并追加到列表末尾
+    async loadDocumentsPage(documentsContainer, projectId, before) {
+        const { documents, page } = await API.listDocuments(projectId, before);
+        const wrapper = document.createElement('div');
+        wrapper.innerHTML = documents.map(doc => `
+            <div class="document-item mb-2 p-2 border rounded hover:bg-gray-100"
+                 data-doc-base-id="${doc.doc_base_id}">
+                <div class="flex items-center justify-between">
+                    <div>
+                        <span class="font-medium">${doc.original_filename}</span>
+                        ${doc.version_number ? `<span class="text-sm text-gray-500 ml-2">v${doc.version_number}</span>` : ''}
+                    </div>
+                    <button class="upload-version-btn text-primary text-sm">上传新版本</button>
+                </div>
+                <div class="versions-container mt-2 ml-4 hidden"></div>
+            </div>
+        `).join('');
+
+        // 绑定文档点击事件
+        wrapper.querySelectorAll('.document-item').forEach(item => {
+            item.addEventListener('click', (e) => {
+                if (!e.target.classList.contains('upload-version-btn')) {
+                    this.toggleDocument(item);
+                }
+            });
+        });
+
+        // 绑定上传新版本按钮事件
+        wrapper.querySelectorAll('.upload-version-btn').forEach(btn => {
+            btn.addEventListener('click', (e) => {
+                e.stopPropagation();
+                const docBaseId = btn.closest('.document-item').dataset.docBaseId;
+                this.showUploadVersionModal(projectId, docBaseId);
+            });
+        });
+
+        this.appendPage(documentsContainer, wrapper, page.before,
+            () => this.loadDocumentsPage(documentsContainer, projectId, page.before));
+    },
+
+    // 加载一页版本并追加到列表末尾
+    async loadVersionsPage(versionsContainer, documentItem, before) {
+        const { versions, page } = await API.listVersions(documentItem.dataset.docBaseId, before);
+        const wrapper = document.createElement('div');
+        wrapper.innerHTML = versions.map(version => `
+            <div class="version-item p-2 flex items-center justify-between hover:bg-gray-50 cursor-pointer"
+                 data-version-id="${version.version_id}">
+                <div>
+                    <span>v${version.version_number}</span>
+                    ${version.is_latest ? '<span class="text-primary ml-2">(最新)</span>' : ''}
+                    <span class="text-sm text-gray-500 ml-2">${new Date(version.upload_time).toLocaleString()}</span>
+                </div>
+                ${!version.is_latest ? `
+                    <button class="delete-version-btn text-red-500 text-sm">删除</button>
+                ` : ''}
+            </div>
+        `).join('');
+
+        // 绑定版本点击事件
+        wrapper.querySelectorAll('.version-item').forEach(item => {
+            item.addEventListener('click', () => this.selectVersion(item));
+        });
+
+        // 绑定删除版本按钮事件
+        wrapper.querySelectorAll('.delete-version-btn').forEach(btn => {
+            btn.addEventListener('click', async (e) => {
+                e.stopPropagation();
+                const versionId = btn.closest('.version-item').dataset.versionId;
+                if (confirm('确定要删除这个版本吗？')) {
+                    try {
+                        this.showLoading();
+                        await API.softDeleteVersion(versionId);
+                        await this.toggleDocument(documentItem);
+                    } catch (error) {
+                        alert('删除版本失败: ' + error.message);
+                    } finally {
+                        this.hideLoading();
+                    }
+                }
+            });
+        });
+
+        this.appendPage(versionsContainer, wrapper, page.before,
+            () => this.loadVersionsPage(versionsContainer, documentItem, page.before));
+    },
+
+    // 将一页列表项追加到容器，还有更早的数据时在末尾放置“加载更多”按钮
+    appendPage(container, wrapper, before, loadMore) {
+        container.append(...wrapper.children);
+        if (!before) return;
+
+        const moreBtn = document.createElement('button');
+        moreBtn.className = 'load-more-btn w-full text-sm text-primary py-1';
+        moreBtn.textContent = '加载更多';
+        moreBtn.addEventListener('click', async (e) => {
+            e.stopPropagation();
+            moreBtn.disabled = true;
+            try {
+                await loadMore();
+                moreBtn.remove();
+            } catch (error) {
+                moreBtn.disabled = false;
+                alert('加载失败: ' + error.message);
+            }
+        });
+        container.appendChild(moreBtn);
+    },
+
     // 切换文档展开/折叠
     async toggleDocument(documentItem) {
-        const docBaseId = documentItem.dataset.docBaseId;
         const versionsContainer = documentItem.querySelector('.versions-container');
         
         if (versionsContainer.classList.contains('hidden')) {
             try {
                 this.showLoading();
-                const { versions } = await API.listVersions(docBaseId);
-                
-                versionsContainer.innerHTML = versions.map(version => `
-                    <div class="version-item p-2 flex items-center justify-between hover:bg-gray-50 cursor-pointer"
-                         data-version-id="${version.version_id}">
-                        <div>
-                            <span>v${version.version_number}</span>
-                            ${version.is_latest ? '<span class="text-primary ml-2">(最新)</span>' : ''}
-                            <span class="text-sm text-gray-500 ml-2">${new Date(version.upload_time).toLocaleString()}</span>
-                        </div>
-                        ${!version.is_latest ? `
-                            <button class="delete-version-btn text-red-500 text-sm">删除</button>
-                        ` : ''}
-                    </div>
-                `).join('');
-
-                // 绑定版本点击事件
-                versionsContainer.querySelectorAll('.version-item').forEach(item => {
-                    item.addEventListener('click', () => this.selectVersion(item));
-                });
-
-                // 绑定删除版本按钮事件
-                versionsContainer.querySelectorAll('.delete-version-btn').forEach(btn => {
-                    btn.addEventListener('click', async (e) => {
-                        e.stopPropagation();
-                        const versionId = btn.closest('.version-item').dataset.versionId;
-                        if (confirm('确定要删除这个版本吗？')) {
-                            try {
-                                this.showLoading();
-                                await API.softDeleteVersion(versionId);
-                                await this.toggleDocument(documentItem);
-                            } catch (error) {
-                                alert('删除版本失败: ' + error.message);
-                            } finally {
-                                this.hideLoading();
-                            }
-                        }
-                    });
-                });
+                versionsContainer.innerHTML = '';
+                await this.loadVersionsPage(versionsContainer, documentItem, null);
 
                 versionsContainer.classList.remove('hidden');
             } catch (error) {
@@ -298,11 +346,13 @@ const UI = {
             // 清空聊天记录
             this.elements.chatMessages.innerHTML = '';
             
-            // 加载聊天历史
-            const { messages } = await API.getChatHistory(session_id);
+            // 加载最新一页聊天历史，更早的消息在滚动到顶部时加载
+            const { messages, page } = await API.getChatHistory(session_id);
+            this.state.olderMessagesCursor = page.before;
             this.renderChatMessages(messages);
             
-            // TODO: 加载文档预览
+            // 加载文档预览
+            await this.loadPreview(versionId);
             
         } catch (error) {
             alert('加载版本失败: ' + error.message);
@@ -311,7 +361,41 @@ const UI = {
         }
     },
 
-    // 显示上传新版本模态框
+    // 加载文档预览：首页渲染后立即返回，其余页在后台依次追加
+    async loadPreview(versionId) {
+        this.elements.documentContent.innerHTML = '';
+        this.state.highlightedBlockId = null;
+
+        const page = await API.getPreview(versionId, 0);
+        this.appendPreviewBlocks(page.blocks);
+        if (page.blocks.length === 0) {
+            this.elements.documentContent.innerHTML = page.status === 'ready'
+                ? '<div class="text-gray-500">文档内容为空</div>'
+                : '<div class="text-gray-500">文档正在处理中，请稍后查看</div>';
+        }
+        this.loadRemainingPreview(versionId, page.next_start);
+    },
+
+    async loadRemainingPreview(versionId, start) {
+        while (start !== null && start !== undefined && this.state.currentVersionId === versionId) {
+            try {
+                const page = await API.getPreview(versionId, start);
+                // 加载过程中用户切换了版本则停止
+                if (this.state.currentVersionId !== versionId) return;
+                this.appendPreviewBlocks(page.blocks);
+                start = page.next_start;
+            } catch (error) {
+                console.error('加载文档预览失败:', error);
+                return;
+            }
+        }
+    },
+
+    appendPreviewBlocks(blocks) {
+        this.elements.documentContent.insertAdjacentHTML('beforeend', blocks.map(block => block.html).join(''));
+    },
+
+        // 显示上传新版本模态框
     showUploadVersionModal(projectId, docBaseId) {
         const content = `
             <div class="space-y-4">
@@ -334,9 +418,12 @@ const UI = {
 
             try {
                 this.showLoading();
-                await API.uploadDocument(projectId, file);
+                const result = await API.uploadDocument(projectId, file);
                 await this.loadProjects();
                 this.hideModal();
+                if (result.duplicate) {
+                    alert(result.message);
+                }
             } catch (error) {
                 alert('上传文件失败: ' + error.message);
             } finally {
@@ -368,14 +455,28 @@ const UI = {
             // 清空输入框
             this.elements.questionInput.value = '';
             
-            // 发送问题并获取回答
-            const response = await API.sendMessage(this.state.currentSessionId, query);
+            // 先插入空的系统回答，流式接收时逐段填充
+            const messageElement = this.appendChatMessage({
+                sender: 'system',
+                text: '',
+                timestamp: new Date().toISOString()
+            });
+            const textElement = messageElement.querySelector('.message-text');
+            let answer = '';
             
-            // 添加系统回答到聊天记录
-            this.appendChatMessage({
+            const result = await API.sendMessageStream(this.state.currentSessionId, query, (text) => {
+                // 收到首段内容后即可隐藏加载动画
+                this.hideLoading();
+                answer += text;
+                textElement.textContent = answer;
+                this.elements.chatMessages.scrollTop = this.elements.chatMessages.scrollHeight;
+            });
+            
+            // 回答结束后补充来源引用
+            this.replaceChatMessage(messageElement, {
                 sender: 'system',
-                text: response.answer,
-                retrieved_chunk_html_ids: JSON.stringify(response.sources),
+                text: answer,
+                retrieved_chunk_html_ids: JSON.stringify(result ? result.sources : []),
                 timestamp: new Date().toISOString()
             });
             
@@ -397,6 +498,34 @@ const UI = {
         });
     },
 
+    // 加载更早的一页聊天记录，插入到顶部并保持当前阅读位置
+    async loadOlderMessages() {
+        const sessionId = this.state.currentSessionId;
+        if (!this.state.olderMessagesCursor || this.state.loadingOlderMessages) return;
+
+        this.state.loadingOlderMessages = true;
+        try {
+            const { messages, page } = await API.getChatHistory(sessionId, this.state.olderMessagesCursor);
+            // 加载过程中用户切换了会话则丢弃结果
+            if (this.state.currentSessionId !== sessionId) return;
+
+            const container = this.elements.chatMessages;
+            const previousHeight = container.scrollHeight;
+            const wrapper = document.createElement('div');
+            wrapper.innerHTML = messages.map(msg => this.createMessageHTML(msg)).join('');
+            wrapper.querySelectorAll('.source-reference').forEach(ref => {
+                ref.addEventListener('click', () => this.highlightSource(ref.dataset.htmlId));
+            });
+            container.prepend(...wrapper.children);
+            container.scrollTop += container.scrollHeight - previousHeight;
+            this.state.olderMessagesCursor = page.before;
+        } catch (error) {
+            console.error('加载聊天记录失败:', error);
+        } finally {
+            this.state.loadingOlderMessages = false;
+        }
+    },
+
     // 添加单条聊天消息
     appendChatMessage(message) {
         const messageElement = document.createElement('div');
@@ -408,6 +537,15 @@ const UI = {
         messageElement.querySelectorAll('.source-reference').forEach(ref => {
             ref.addEventListener('click', () => this.highlightSource(ref.dataset.htmlId));
         });
+        return messageElement;
+    },
+
+    // 替换已渲染的单条聊天消息
+    replaceChatMessage(messageElement, message) {
+        messageElement.innerHTML = this.createMessageHTML(message);
+        messageElement.querySelectorAll('.source-reference').forEach(ref => {
+            ref.addEventListener('click', () => this.highlightSource(ref.dataset.htmlId));
+        });
     },
 
     // 创建消息HTML
@@ -419,7 +557,7 @@ const UI = {
             <div class="mb-4 ${isSystem ? 'pl-4' : 'pr-4'}">
                 <div class="flex items-start ${isSystem ? 'flex-row' : 'flex-row-reverse'}">
                     <div class="flex-1 max-w-[80%]">
-                        <div class="rounded-lg p-3 ${isSystem ? 'bg-gray-100' : 'bg-primary text-white'}">
+                        <div class="message-text rounded-lg p-3 ${isSystem ? 'bg-gray-100' : 'bg-primary text-white'}">
                             ${message.text}
                         </div>
                         ${isSystem && sources.length > 0 ? `
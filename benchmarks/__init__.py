@@ -0,0 +1,5 @@
+"""
+离线组件基准测试
+使用合成的.docx文档和本地模拟LLM服务，测量入库、检索和问答各阶段的耗时
+用法见 python -m benchmarks.run --help
+"""
@@ -0,0 +1,120 @@
+import random
+import zipfile
+from typing import List, Dict
+from xml.sax.saxutils import escape
+
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+</Types>"""
+
+_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+_DOCUMENT_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+)
+_DOCUMENT_TAIL = "</w:body></w:document>"
+
+# 合同类文本的常用词，组合成长度不一的句子
+_SUBJECTS = ["甲方", "乙方", "供应商", "采购方", "承包人", "发包人", "监理单位", "双方"]
+_VERBS = ["应当按照", "有权依据", "须在收到", "负责根据", "不得违反", "可以参照", "应于每月按照"]
+_OBJECTS = [
+    "本合同约定的技术标准", "验收报告及相关附件", "付款计划和结算方式", "质量保证条款",
+    "保密义务的具体要求", "违约责任的处理办法", "设备清单和交付进度", "争议解决的相关程序"
+]
+_TAILS = ["履行相应义务", "完成全部交付", "提交书面说明", "承担相应费用", "进行复核确认", "办理变更手续"]
+_TABLE_HEADERS = ["序号", "设备名称", "规格型号", "数量", "单价（元）", "交付日期", "备注", "标准编号"]
+
+def _sentence(rng: random.Random) -> str:
+    return f"{rng.choice(_SUBJECTS)}{rng.choice(_VERBS)}{rng.choice(_OBJECTS)}{rng.choice(_TAILS)}"
+
+def _identifier(rng: random.Random) -> str:
+    return f"GB/T {rng.randint(1000, 99999)}-{rng.randint(1995, 2024)}"
+
+def _paragraph_xml(text: str) -> str:
+    return f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+def _table_xml(rows: List[List[str]]) -> str:
+    body = "".join(
+        "<w:tr>" + "".join(
+            f"<w:tc><w:p><w:r><w:t>{escape(cell)}</w:t></w:r></w:p></w:tc>" for cell in row
+        ) + "</w:tr>"
+        for row in rows
+    )
+    return f"<w:tbl>{body}</w:tbl>"
+
+def generate_docx(
+    path: str,
+    paragraphs: int = 200,
+    tables: int = 4,
+    table_rows: int = 100,
+    table_cols: int = 6,
+    seed: int = 0
+) -> Dict:
+    """
+    生成合成的.docx文档：带条款编号的段落，以及若干大表格（均匀穿插在段落之间）
+    只写入Word打开所需的最少部件，结果可被OOXML解析器和Word正常读取
+    返回文档概况和可用于检索测试的问题（语义问题和编号类问题）
+    """
+    rng = random.Random(seed)
+    table_cols = max(1, min(table_cols, len(_TABLE_HEADERS)))
+    table_positions = {
+        round((index + 1) * paragraphs / (tables + 1)) for index in range(tables)
+    } if tables else set()
+
+    parts = [_DOCUMENT_HEAD]
+    queries = []
+    identifiers = []
+    tables_written = 0
+    for index in range(paragraphs):
+        clause = f"第{index // 10 + 1}.{index % 10 + 1}条"
+        text = clause + "，".join(_sentence(rng) for _ in range(rng.randint(2, 6))) + "。"
+        if rng.random() < 0.2:
+            identifier = _identifier(rng)
+            identifiers.append(identifier)
+            text += f"相关产品应符合{identifier}的要求。"
+        parts.append(_paragraph_xml(text))
+
+        if index in table_positions:
+            rows = [_TABLE_HEADERS[:table_cols]]
+            for row_index in range(table_rows):
+                row = [
+                    str(row_index + 1),
+                    f"设备{rng.randint(1, 500)}",
+                    f"XG-{rng.randint(100, 999)}",
+                    str(rng.randint(1, 50)),
+                    f"{rng.randint(100, 99999)}.00",
+                    f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                    rng.choice(["", "含安装", "含培训", "备品备件"]),
+                    _identifier(rng)
+                ]
+                rows.append(row[:table_cols])
+            parts.append(_table_xml(rows))
+            tables_written += 1
+
+    parts.append(_DOCUMENT_TAIL)
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _RELS)
+        archive.writestr("word/document.xml", "".join(parts))
+
+    for _ in range(max(1, paragraphs // 10)):
+        queries.append(f"{rng.choice(_SUBJECTS)}关于{rng.choice(_OBJECTS)}有什么要求？")
+    queries.extend(identifiers[:max(1, len(queries) // 2)])
+    rng.shuffle(queries)
+
+    return {
+        "path": path,
+        "paragraphs": paragraphs,
+        "tables": tables_written,
+        "table_rows": table_rows,
+        "table_cols": table_cols,
+        "queries": queries
+    }
@@ -0,0 +1,141 @@
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class FakeLLMServer:
+    """
+    本地模拟的LLM接口，兼容LLMService使用的请求和响应格式
+    latency：返回完整回答（或第一个流式片段）前的等待时间（秒）
+    token_interval：流式返回时相邻片段之间的间隔（秒）
+    fail_next()注入故障：接下来的若干个请求返回指定状态码（可带Retry-After），用于测试重试和熔断
+    peak_concurrency：同时处理中的请求数的最大值
+    """
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.2,
+        tokens: int = 40,
+        token_interval: float = 0.0
+    ):
+        self.latency = latency
+        self.tokens = tokens
+        self.token_interval = token_interval
+        self.requests = 0
+        self.concurrency = 0
+        self.peak_concurrency = 0
+        self._failures = 0
+        self._failure_status = 503
+        self._failure_retry_after = None
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def fail_next(self, count: int, status: int = 503, retry_after: float = None):
+        """接下来的count个请求返回status（count为-1时一直失败，直到再次调用fail_next(0)）"""
+        with self._lock:
+            self._failures = count
+            self._failure_status = status
+            self._failure_retry_after = retry_after
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests = 0
+            self.peak_concurrency = 0
+
+    def _take_failure(self):
+        """本次请求需要注入的故障：返回 (状态码, Retry-After) 或None"""
+        with self._lock:
+            if not self._failures:
+                return None
+            if self._failures > 0:
+                self._failures -= 1
+            return self._failure_status, self._failure_retry_after
+
+    def _answer_tokens(self):
+        return [f"回答片段{index}。" for index in range(self.tokens)]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                    server.concurrency += 1
+                    server.peak_concurrency = max(server.peak_concurrency, server.concurrency)
+                try:
+                    self._respond(request)
+                finally:
+                    with server._lock:
+                        server.concurrency -= 1
+
+            def _respond(self, request):
+                failure = server._take_failure()
+                if failure is not None:
+                    status, retry_after = failure
+                    body = json.dumps({"error": {"code": status, "message": "injected failure"}}).encode("utf-8")
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    if retry_after is not None:
+                        self.send_header("Retry-After", str(retry_after))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                time.sleep(server.latency)
+                if request.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    for token in server._answer_tokens():
+                        chunk = {"choices": [{"delta": {"content": token}}]}
+                        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        if server.token_interval:
+                            time.sleep(server.token_interval)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.close_connection = True
+                    return
+
+                body = json.dumps({
+                    "choices": [{"message": {"content": "".join(server._answer_tokens())}}]
+                }, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self) -> "FakeLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
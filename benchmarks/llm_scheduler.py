@@ -0,0 +1,197 @@
+"""
+用本地模拟LLM验证并测量LLM调度器（合并、限流、重试、熔断）：
+
+    python -m benchmarks.llm_scheduler --burst 50 --concurrency 4 --output benchmarks/llm_scheduler.json
+
+场景：
+- identical：burst个相同的问题同时到达，上游只应收到一个请求
+- identical_stream：同上，流式请求共享同一个上游流，每个请求都收到完整回答
+- distinct：burst个不同的问题，上游同时处理的请求不超过并发上限，超出排队上限的请求被拒绝（429）
+- transient：上游连续返回两次503，请求经重试后成功
+- backoff_releases_slot：并发上限为1，一个请求退避等待期间，另一个请求可以使用空出的名额
+- rate_limited：上游返回429且Retry-After超过退避上限，请求以429结束并带上游的Retry-After；
+  限流期间的后续请求不再发往上游，429不计入熔断
+- outage：上游持续失败，连续失败达到阈值后熔断，之后的请求不再发往上游（503），恢复后探测请求关闭熔断
+每个场景输出上游请求数、延迟分布和检查结果，有检查未通过时以非零状态码退出
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+
+import httpx
+
+from benchmarks.fake_llm import FakeLLMServer
+from benchmarks.stats import Recorder, format_summary
+
+SCENARIOS = ("identical", "identical_stream", "distinct", "transient", "backoff_releases_slot", "rate_limited", "outage")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="LLM调度器场景测试")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--burst", type=int, default=40, help="每个场景同时发出的请求数")
+    parser.add_argument("--concurrency", type=int, default=4, help="调度器的并发上限")
+    parser.add_argument("--queue", type=int, default=16, help="调度器的排队上限")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="模拟LLM的响应延迟（秒）")
+    parser.add_argument("--llm-tokens", type=int, default=20, help="模拟LLM回答的片段数")
+    parser.add_argument("--output", default="benchmarks/llm_scheduler.json", help="结果JSON路径")
+    return parser.parse_args(argv)
+
+class Scenario:
+    """一个场景的上下文：新建调度器（熔断和耗时统计互不影响），记录延迟和检查结果"""
+    def __init__(self, name: str, args, llm: FakeLLMServer, client: httpx.AsyncClient, recorder: Recorder, **scheduler_options):
+        from app.services.llm_scheduler import LLMScheduler
+
+        self.name = name
+        self.llm = llm
+        self.client = client
+        self.recorder = recorder
+        self.scheduler = LLMScheduler(**{
+            "max_concurrency": args.concurrency,
+            "max_queue": args.queue,
+            "retry_base": 0.05,
+            "breaker_open_seconds": 1.0,
+            **scheduler_options
+        })
+        self.checks = {}
+        self.outcomes = {}
+        llm.reset_stats()
+        llm.fail_next(0)
+
+    def service(self):
+        from app.services.llm_service import LLMService
+
+        service = LLMService("benchmark-key", self.client, scheduler=self.scheduler)
+        service.api_endpoint = self.llm.url
+        return service
+
+    async def ask(self, query: str, tenant: str = "default", stream: bool = False) -> str:
+        """发出一个问题，返回结果类型：ok、429、503或error，并记录耗时"""
+        from app.services.context_packer import PackedContext
+        from app.services.llm_service import LLMBusy, LLMError
+
+        packed = PackedContext([{"text": "模拟的文档内容", "html_ids": ["p1"]}], tokens=8)
+        packed.prompt_tokens = 8
+        start = time.perf_counter()
+        try:
+            if stream:
+                parts = [text async for text in await self.service().open_stream(query, packed, tenant)]
+                outcome = "ok" if len(parts) == self.llm.tokens else "truncated"
+            else:
+                response = await self.service().generate_response(query, packed, tenant)
+                outcome = "ok" if response["answer"] else "error"
+        except LLMBusy as e:
+            outcome = str(e.status_code)
+            self.outcomes.setdefault("retry_after", []).append(e.retry_after)
+        except LLMError:
+            outcome = "error"
+        self.recorder.record(f"{self.name}_{outcome}", time.perf_counter() - start)
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        return outcome
+
+    def check(self, name: str, passed: bool):
+        self.checks[name] = bool(passed)
+
+    def report(self) -> dict:
+        return {
+            "upstream_requests": self.llm.requests,
+            "peak_upstream_concurrency": self.llm.peak_concurrency,
+            "outcomes": self.outcomes,
+            "scheduler": self.scheduler.stats(),
+            "checks": self.checks
+        }
+
+async def run_scenario(name: str, args, llm: FakeLLMServer, client: httpx.AsyncClient, recorder: Recorder) -> dict:
+    if name in ("identical", "identical_stream"):
+        scenario = Scenario(name, args, llm, client, recorder)
+        stream = name == "identical_stream"
+        await asyncio.gather(*[scenario.ask("相同的问题", str(index), stream) for index in range(args.burst)])
+        scenario.check("single_upstream_request", llm.requests == 1)
+        scenario.check("all_answered", scenario.outcomes.get("ok") == args.burst)
+
+    elif name == "distinct":
+        scenario = Scenario(name, args, llm, client, recorder)
+        await asyncio.gather(*[scenario.ask(f"问题{index}", str(index % 5)) for index in range(args.burst)])
+        accepted = min(args.burst, args.concurrency + args.queue)
+        scenario.check("concurrency_bounded", llm.peak_concurrency <= args.concurrency)
+        scenario.check("queue_bounded", scenario.outcomes.get("ok") == accepted)
+        scenario.check("overflow_rejected_with_429", scenario.outcomes.get("429", 0) == args.burst - accepted)
+        scenario.check("retry_after_positive", all(value >= 1 for value in scenario.outcomes.get("retry_after", [])))
+
+    elif name == "transient":
+        scenario = Scenario(name, args, llm, client, recorder)
+        llm.fail_next(2, status=503)
+        outcome = await scenario.ask("重试的问题")
+        scenario.check("succeeded_after_retries", outcome == "ok")
+        scenario.check("three_upstream_attempts", llm.requests == 3)
+
+    elif name == "backoff_releases_slot":
+        scenario = Scenario(name, args, llm, client, recorder, max_concurrency=1)
+        # 上游503并要求等待1秒：第一个请求退避期间，第二个请求应当立即取得名额
+        llm.fail_next(1, status=503, retry_after=1)
+        first = asyncio.ensure_future(scenario.ask("退避的问题"))
+        await asyncio.sleep(0.1)
+        start = time.perf_counter()
+        second = await scenario.ask("另一个问题")
+        scenario.check("other_request_not_blocked", second == "ok" and time.perf_counter() - start < 1.0)
+        scenario.check("backed_off_request_succeeded", await first == "ok")
+
+    elif name == "rate_limited":
+        scenario = Scenario(name, args, llm, client, recorder, retry_max=2.0, breaker_failures=1)
+        llm.fail_next(1, status=429, retry_after=30)
+        outcome = await scenario.ask("被限流的问题")
+        scenario.check("returned_429", outcome == "429")
+        scenario.check("upstream_retry_after_passed_on", scenario.outcomes.get("retry_after") == [30])
+        scenario.check("no_retry_beyond_limit", llm.requests == 1)
+        outcome = await scenario.ask("限流期间的问题")
+        scenario.check("throttled_without_upstream", outcome == "429" and llm.requests == 1)
+        scenario.check("breaker_not_tripped", scenario.scheduler.breaker.state == "closed")
+
+    elif name == "outage":
+        scenario = Scenario(name, args, llm, client, recorder, breaker_failures=3, max_retries=1)
+        llm.fail_next(-1, status=502)
+        for index in range(4):
+            await scenario.ask(f"故障期间的问题{index}")
+        failed_requests = llm.requests
+        start = time.perf_counter()
+        outcome = await scenario.ask("熔断后的问题")
+        scenario.check("fails_fast_with_503", outcome == "503" and time.perf_counter() - start < 0.05)
+        scenario.check("no_upstream_while_open", llm.requests == failed_requests)
+        llm.fail_next(0)
+        await asyncio.sleep(scenario.scheduler.breaker.open_seconds)
+        scenario.check("probe_closes_breaker", await scenario.ask("恢复后的问题") == "ok")
+        scenario.check("breaker_closed", scenario.scheduler.breaker.state == "closed")
+
+    return scenario.report()
+
+async def run(args) -> dict:
+    recorder = Recorder()
+    reports = {}
+    with FakeLLMServer(latency=args.llm_latency, tokens=args.llm_tokens) as llm:
+        from app.services.llm_service import create_http_client
+        client = create_http_client()
+        try:
+            for name in args.scenarios:
+                reports[name] = await run_scenario(name, args, llm, client, recorder)
+                passed = all(reports[name]["checks"].values())
+                print(f"{name}: {'通过' if passed else '未通过'} {reports[name]['checks']}")
+        finally:
+            await client.aclose()
+    return {"scenarios": reports, "stages": recorder.summary()}
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    result["meta"] = {"timestamp": datetime.now().isoformat(timespec="seconds"), "args": vars(args)}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(format_summary(result["stages"]))
+    print(f"\n结果已写入 {args.output}")
+    failed = [name for name, report in result["scenarios"].items() if not all(report["checks"].values())]
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
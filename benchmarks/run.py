@@ -0,0 +1,257 @@
+"""
+运行基准测试并输出JSON结果
+
+    python -m benchmarks.run --paragraphs 500 --tables 6 --table-rows 200 \
+        --output benchmarks/results.json --baseline benchmarks/baseline.json
+
+所有数据写入临时目录（或 --workdir 指定的目录），不会影响 db/ 下的正式数据
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from benchmarks.docx_generator import generate_docx
+from benchmarks.fake_llm import FakeLLMServer
+from benchmarks.stats import Recorder, compare, format_summary
+
+STAGES = ("extraction", "ingestion", "embedding", "retrieval", "send_message")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="入库、检索和问答的离线基准测试")
+    parser.add_argument("--paragraphs", type=int, default=300, help="合成文档的段落数")
+    parser.add_argument("--tables", type=int, default=4, help="合成文档的表格数")
+    parser.add_argument("--table-rows", type=int, default=100, help="每个表格的行数")
+    parser.add_argument("--table-cols", type=int, default=6, help="每个表格的列数（最多8列）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=3, help="解析和入库的重复次数")
+    parser.add_argument("--queries", type=int, default=50, help="检索和问答的问题数")
+    parser.add_argument("--embed-batches", type=int, default=20, help="单独测量的嵌入批次数")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="模拟LLM的响应延迟（秒）")
+    parser.add_argument("--llm-tokens", type=int, default=40, help="模拟LLM回答的片段数")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="关闭嵌入缓存，测量冷启动入库")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"要运行的阶段，逗号分隔：{','.join(STAGES)}")
+    parser.add_argument("--workdir", help="数据目录，默认使用新建的临时目录")
+    parser.add_argument("--output", default="benchmarks/results.json", help="结果JSON路径")
+    parser.add_argument("--baseline", help="基线结果JSON路径，指定后输出对比")
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果同时保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="判定回退的相对阈值")
+    parser.add_argument("--fail-on-regression", action="store_true", help="存在回退时以非零状态码退出")
+    return parser.parse_args(argv)
+
+def configure_environment(args, workdir: str, llm_url: str):
+    """在导入app之前设置环境变量，使所有数据写入workdir"""
+    data_dir = os.path.join(workdir, "data")
+    os.environ["DATA_DIR"] = data_dir
+    os.environ.pop("DB_PATH", None)
+    os.environ["DOCS_STORAGE_PATH"] = os.path.join(workdir, "docs_storage")
+    os.environ["LLM_API_ENDPOINT"] = llm_url
+    # 入库任务在当前进程内同步执行，不启动工作进程
+    os.environ["INGEST_WORKERS"] = "0"
+    os.environ["DOCX_EXTRACTOR_BACKEND"] = "ooxml"
+    if args.no_embedding_cache:
+        os.environ["EMBEDDING_CACHE_ENABLED"] = "0"
+
+@contextmanager
+def serve_app(app):
+    """
+    在后台线程中用uvicorn启动应用（执行完整的lifespan），产出可访问的基础URL
+    端到端请求经过真实的HTTP连接，与浏览器访问的路径一致
+    """
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="benchmark-server", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("应用启动失败")
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+def bench_extraction(recorder: Recorder, docx_path: str, iterations: int):
+    from app.services.extractors import create_extractor
+
+    for _ in range(iterations):
+        with create_extractor("ooxml") as extractor:
+            start = time.perf_counter()
+            blocks = extractor.extract_content(docx_path)
+            recorder.record("extraction", time.perf_counter() - start, len(blocks))
+
+def bench_ingestion(recorder: Recorder, client, processor, docx_path: str, project_id: str, iterations: int) -> int:
+    """
+    通过上传接口创建新版本，并在当前进程内执行与工作进程相同的入库流程
+    返回最后一个版本的version_id
+    """
+    from app.services.job_queue import JobQueue
+    from app.services.ingest_worker import run_job
+
+    queue = JobQueue()
+    version_id = None
+    for _ in range(iterations):
+        with open(docx_path, "rb") as f:
+            response = client.post(
+                "/api/documents/upload/",
+                params={"project_id": project_id},
+                files={"file": ("benchmark.docx", f, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
+            )
+        response.raise_for_status()
+
+        job = queue.claim_next()
+        timings, processed_blocks = run_job(job, processor, queue)
+        queue.complete(job.job_id, timings, processed_blocks)
+        version_id = job.version_id
+
+        chunks = processor.count_chunks(version_id)
+        recorder.record("chunking", timings["parse"], chunks)
+        recorder.record("embedding", timings["embed"], chunks)
+        recorder.record("upsert", timings["upsert"], chunks)
+        recorder.record("lexical_index", timings.get("lexical", 0.0), chunks)
+        recorder.record("ingestion_total", timings["extract"] + timings["total"], len(processed_blocks))
+    return version_id
+
+def bench_embedding(recorder: Recorder, processor, version_id: int, batches: int):
+    """直接测量嵌入模型单批次的延迟（不经过嵌入缓存）"""
+    from app.config import EMBED_BATCH_SIZE
+
+    texts = processor.vector_store.get(version_id, include=["documents"])["documents"]
+    for index in range(batches):
+        batch = texts[index * EMBED_BATCH_SIZE:(index + 1) * EMBED_BATCH_SIZE]
+        if not batch:
+            break
+        with recorder.measure("embedding_batch", len(batch)):
+            processor.embed_model.get_text_embedding_batch(batch)
+
+def bench_retrieval(recorder: Recorder, processor, version_id: int, queries):
+    processor.retrieve(queries[0], version_id)  # 预热
+    for query in queries:
+        with recorder.measure("retrieval"):
+            processor.retrieve(query, version_id)
+
+def bench_send_message(recorder: Recorder, client, version_id: int, queries):
+    response = client.post("/api/chat/sessions/", params={"version_id": version_id, "prewarm": False})
+    response.raise_for_status()
+    session_id = response.json()["session_id"]
+
+    def send(query):
+        response = client.post(
+            f"/api/chat/{session_id}/messages",
+            params={"query": query, "bypass_cache": True}
+        )
+        response.raise_for_status()
+
+    send(queries[0])  # 预热
+    for query in queries:
+        with recorder.measure("send_message"):
+            send(query)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    stages = {stage.strip() for stage in args.stages.split(",") if stage.strip()}
+    workdir = args.workdir or tempfile.mkdtemp(prefix="chatdoc-bench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    docx_path = os.path.join(workdir, "benchmark.docx")
+    document = generate_docx(
+        docx_path,
+        paragraphs=args.paragraphs,
+        tables=args.tables,
+        table_rows=args.table_rows,
+        table_cols=args.table_cols,
+        seed=args.seed
+    )
+    queries = (document["queries"] * (args.queries // len(document["queries"]) + 1))[:args.queries]
+
+    llm = FakeLLMServer(latency=args.llm_latency, tokens=args.llm_tokens).start()
+    configure_environment(args, workdir, llm.url)
+
+    recorder = Recorder()
+    try:
+        if "extraction" in stages:
+            bench_extraction(recorder, docx_path, args.iterations)
+
+        if stages & {"ingestion", "embedding", "retrieval", "send_message"}:
+            import httpx
+            from app.main import app
+
+            with serve_app(app) as base_url, httpx.Client(base_url=base_url, timeout=300) as client:
+                registry = app.state.registry
+                while not registry.wait_ready(timeout=1.0) and registry.error is None:
+                    pass
+                if registry.error:
+                    print(f"嵌入模型加载失败: {registry.error}", file=sys.stderr)
+                    return 2
+                processor = registry.document_processor
+
+                client.post("/api/projects/", params={"project_id": "benchmark"})
+                client.post("/api/settings/api-key", params={"api_key": "benchmark"})
+
+                # 检索和问答依赖已入库的版本，至少入库一次
+                measure_ingestion = "ingestion" in stages
+                version_id = bench_ingestion(
+                    recorder if measure_ingestion else Recorder(),
+                    client, processor, docx_path, "benchmark",
+                    args.iterations if measure_ingestion else 1
+                )
+                if "embedding" in stages:
+                    bench_embedding(recorder, processor, version_id, args.embed_batches)
+                if "retrieval" in stages:
+                    bench_retrieval(recorder, processor, version_id, queries)
+                if "send_message" in stages:
+                    bench_send_message(recorder, client, version_id, queries)
+    finally:
+        llm.stop()
+
+    summary = recorder.summary()
+    result = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "workdir": workdir,
+            "args": vars(args),
+            "document": {key: value for key, value in document.items() if key != "queries"},
+            "llm_requests": llm.requests
+        },
+        "stages": summary
+    }
+
+    comparison = None
+    if args.baseline and os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        comparison = compare(summary, baseline["stages"], args.tolerance)
+        result["comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance, "rows": comparison}
+
+    _write_json(args.output, result)
+    if args.save_baseline and args.baseline:
+        _write_json(args.baseline, result)
+
+    print(format_summary(summary, comparison))
+    print(f"\n结果已写入 {args.output}")
+
+    if args.fail_on_regression and comparison and any(row["regression"] for row in comparison):
+        return 1
+    return 0
+
+def _write_json(path: str, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import math
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import List, Dict, Optional
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """线性插值计算分位数，sorted_values需已升序排列"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    low, high = math.floor(position), math.ceil(position)
+    if low == high:
+        return sorted_values[low]
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+def summarize(samples: List[float], items: int) -> Dict:
+    """汇总一个阶段的耗时样本（秒），throughput为每秒处理的条目数"""
+    values = sorted(samples)
+    total = sum(values)
+    return {
+        "count": len(values),
+        "items": items,
+        "total_seconds": total,
+        "mean": total / len(values) if values else 0.0,
+        "min": values[0] if values else 0.0,
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": values[-1] if values else 0.0,
+        "throughput": items / total if total else 0.0
+    }
+
+class Recorder:
+    """按阶段记录耗时样本及处理的条目数"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.items: Dict[str, int] = defaultdict(int)
+
+    def record(self, stage: str, seconds: float, items: int = 1):
+        self.samples[stage].append(seconds)
+        self.items[stage] += items
+
+    @contextmanager
+    def measure(self, stage: str, items: int = 1):
+        start = time.perf_counter()
+        yield
+        self.record(stage, time.perf_counter() - start, items)
+
+    def summary(self) -> Dict[str, Dict]:
+        return {stage: summarize(values, self.items[stage]) for stage, values in self.samples.items()}
+
+def compare(
+    current: Dict[str, Dict],
+    baseline: Dict[str, Dict],
+    tolerance: float,
+    metrics=("p50", "p95")
+) -> List[Dict]:
+    """
+    与基线逐阶段比较延迟指标，返回所有指标的对比结果
+    当前值超过 基线 * (1 + tolerance) 时标记为回退
+    """
+    rows = []
+    for stage in sorted(set(current) & set(baseline)):
+        for metric in metrics:
+            before = baseline[stage].get(metric, 0.0)
+            after = current[stage].get(metric, 0.0)
+            change = (after - before) / before if before else 0.0
+            rows.append({
+                "stage": stage,
+                "metric": metric,
+                "baseline": before,
+                "current": after,
+                "change": change,
+                "regression": bool(before) and change > tolerance
+            })
+    return rows
+
+def format_summary(summary: Dict[str, Dict], comparison: Optional[List[Dict]] = None) -> str:
+    lines = [f"{'阶段':<16}{'次数':>6}{'p50(ms)':>11}{'p95(ms)':>11}{'p99(ms)':>11}{'吞吐(条/s)':>13}"]
+    for stage, stats in summary.items():
+        lines.append(
+            f"{stage:<16}{stats['count']:>6}{stats['p50'] * 1000:>11.1f}{stats['p95'] * 1000:>11.1f}"
+            f"{stats['p99'] * 1000:>11.1f}{stats['throughput']:>13.1f}"
+        )
+    if comparison:
+        lines.append("")
+        lines.append("与基线对比:")
+        for row in comparison:
+            flag = "  <-- 回退" if row["regression"] else ""
+            lines.append(
+                f"  {row['stage']:<16}{row['metric']:<5}{row['baseline'] * 1000:>10.1f}ms -> "
+                f"{row['current'] * 1000:>10.1f}ms ({row['change']:+.1%}){flag}"
+            )
+    return "\n".join(lines)
@@ -0,0 +1,209 @@
+"""
+对比向量库布局/后端的检索延迟、召回率和资源占用：
+- legacy：每个版本一个 version_{id} collection（VECTOR_LAYOUT=per_version，默认）
+- sharded：固定数量的分片collection，按version_id元数据过滤（VECTOR_LAYOUT=sharded，需显式开启）
+- mmap_float16 / mmap_int8：内存映射索引（VECTOR_BACKEND=mmap，VECTOR_INDEX_DTYPE=float16 / int8）
+
+    python -m benchmarks.vector_layout --versions 500 --chunks 200 --output benchmarks/vector_layout.json
+
+使用随机归一化向量，不加载嵌入模型；数据写入临时目录，单进程以嵌入模式打开ChromaDB
+检索阶段在新的子进程中执行，cold为进程内首次检索该版本（包含打开索引的开销）；
+召回率以float32精确余弦检索的top-k为基准（mmap后端用原始向量重新排序，应为1.0）
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.stats import Recorder, format_summary
+
+LAYOUTS = ("legacy", "sharded", "mmap_float16", "mmap_int8")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="向量库布局基准测试")
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=list(LAYOUTS))
+    parser.add_argument("--versions", type=int, default=200, help="版本数")
+    parser.add_argument("--chunks", type=int, default=100, help="每个版本的chunk数")
+    parser.add_argument("--dim", type=int, default=768, help="向量维度（bge-base为768）")
+    parser.add_argument("--shards", type=int, default=8, help="分片数")
+    parser.add_argument("--queries", type=int, default=300, help="检索次数")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="数据目录，默认使用新建的临时目录")
+    parser.add_argument("--output", default="benchmarks/vector_layout.json", help="结果JSON路径")
+    return parser.parse_args(argv)
+
+def random_vectors(seed: int, count: int, dim: int) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def version_vectors(version_id: int, args) -> np.ndarray:
+    """每个版本的向量由种子确定，各布局写入相同的数据，基准结果可直接比较"""
+    return random_vectors(args.seed * 100003 + version_id, args.chunks, args.dim)
+
+def query_plan(args):
+    """检索序列：(版本, 问题序号)，以及全部问题向量"""
+    rng = random.Random(args.seed + 1)
+    queries = random_vectors(args.seed + 1, min(args.queries, 50), args.dim)
+    plan = [(rng.randint(1, args.versions), index % len(queries)) for index in range(args.queries)]
+    return plan, queries
+
+def chunk_id(version_id: int, index: int) -> str:
+    return f"doc_{version_id}_paragraph_{index}#0"
+
+def open_file_count() -> int:
+    """当前进程打开的文件描述符数（仅Linux可用，其他平台返回-1）"""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return -1
+
+def directory_stats(path: str):
+    """目录下的文件数和总字节数"""
+    files, size = 0, 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+def open_store(layout: str, path: str, args):
+    if layout.startswith("mmap_"):
+        from app.services.mmap_index import MmapVectorStore
+        return MmapVectorStore(root=path, dtype=layout[len("mmap_"):])
+
+    import chromadb
+    from app.services.vector_store import VectorStore
+    return VectorStore(
+        chromadb.PersistentClient(path=path),
+        shard_count=args.shards,
+        layout="per_version" if layout == "legacy" else "sharded"
+    )
+
+def populate(layout: str, path: str, args):
+    """通过入库流水线使用的 write_version 写入测试数据"""
+    store = open_store(layout, path, args)
+    for version_id in range(1, args.versions + 1):
+        # 与入库流水线写入的元数据字段一致（Chroma过滤的开销与每条记录的字段数成正比）
+        chunks = [
+            {
+                "id": chunk_id(version_id, index),
+                "text": f"内容{index}",
+                "metadata": {
+                    "html_id": f"doc_{version_id}_paragraph_{index}",
+                    "version_id": version_id,
+                    "doc_base_id": version_id,
+                    "project_id": "benchmark",
+                    "block_type": "paragraph",
+                    "sequence_in_doc": index,
+                    "chunk_index": 0
+                }
+            }
+            for index in range(args.chunks)
+        ]
+        store.write_version(version_id, chunks, version_vectors(version_id, args).tolist())
+
+def bench_queries(layout: str, path: str, args) -> dict:
+    """
+    在新建的向量库实例上按检索序列查询：每个版本的首次检索计为cold，其余计为warm
+    返回耗时样本、每次检索的结果ID和检索结束后的资源占用（在子进程中执行）
+    """
+    fds_before = open_file_count()
+    store = open_store(layout, path, args)
+    plan, queries = query_plan(args)
+    recorder = Recorder()
+    touched, results = set(), []
+    for version_id, query_index in plan:
+        stage = f"{layout}_query_{'warm' if version_id in touched else 'cold'}"
+        with recorder.measure(stage):
+            result, _ = store.query(version_id, queries[query_index].tolist(), args.top_k)
+        results.append(result["ids"][0])
+        touched.add(version_id)
+
+    files, size = directory_stats(path)
+    resources = {
+        "versions_touched": len(touched),
+        "open_files_added": open_file_count() - fds_before if fds_before >= 0 else None,
+        "files_on_disk": files,
+        "bytes_on_disk": size
+    }
+    if not layout.startswith("mmap_"):
+        stats = store.stats()
+        resources["collections"] = len(store.client.list_collections())
+        resources["collections_opened"] = stats["open_shards"] + stats["legacy_opens"]
+    return {"samples": dict(recorder.samples), "items": dict(recorder.items), "results": results, "resources": resources}
+
+def exact_results(args):
+    """float32精确余弦检索的top-k（相似度相同时按行号），作为召回率的基准"""
+    plan, queries = query_plan(args)
+    expected = []
+    for version_id, query_index in plan:
+        scores = version_vectors(version_id, args) @ queries[query_index]
+        rows = np.lexsort((np.arange(len(scores)), -scores))[:args.top_k]
+        expected.append([chunk_id(version_id, row) for row in rows])
+    return expected
+
+def accuracy(results, expected, top_k: int) -> dict:
+    recall = sum(len(set(got) & set(want)) for got, want in zip(results, expected)) / (len(expected) * top_k)
+    same_order = sum(got == want for got, want in zip(results, expected)) / len(expected)
+    return {f"recall_at_{top_k}": round(recall, 4), "identical_order": round(same_order, 4)}
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="chatdoc-vector-layout-")
+    os.makedirs(workdir, exist_ok=True)
+
+    recorder = Recorder()
+    resources = {}
+    expected = exact_results(args)
+    # 检索在新的子进程中执行：ChromaDB在进程内按路径缓存客户端，同一进程中无法测得真实的冷启动
+    context = multiprocessing.get_context("spawn")
+    for layout in args.layouts:
+        path = os.path.join(workdir, layout)
+        print(f"写入 {layout} 布局：{args.versions} 个版本 x {args.chunks} 个chunk")
+        populate(layout, path, args)
+        with context.Pool(1) as pool:
+            run = pool.apply(bench_queries, (layout, path, args))
+        for stage, samples in run["samples"].items():
+            for seconds in samples:
+                recorder.record(stage, seconds)
+        resources[layout] = {**run["resources"], **accuracy(run["results"], expected, args.top_k)}
+
+    summary = recorder.summary()
+    result = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "workdir": workdir,
+            "args": vars(args)
+        },
+        "resources": resources,
+        "stages": summary
+    }
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(format_summary(summary))
+    for layout, stats in resources.items():
+        collections = (
+            f"collection数 {stats['collections']}，检索中打开的collection {stats['collections_opened']}，"
+            if "collections" in stats else ""
+        )
+        print(
+            f"{layout}: {collections}新增打开文件 {stats['open_files_added']}，"
+            f"磁盘文件 {stats['files_on_disk']} 个 / {stats['bytes_on_disk'] / 1024 / 1024:.1f} MB，"
+            f"recall@{args.top_k} {stats[f'recall_at_{args.top_k}']}，顺序一致 {stats['identical_order']}"
+        )
+    print(f"\n结果已写入 {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
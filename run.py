@@ -2,6 +2,8 @@ import sys
 import uvicorn
 import webbrowser
 import os
+import argparse
+import subprocess
 from threading import Timer
 
 # Python 版本校验
@@ -9,16 +11,68 @@ if not (sys.version_info.major == 3 and sys.version_info.minor in (10, 11)):
     print("\033[91m[错误] 仅支持 Python 3.10 或 3.11，当前版本：{}\033[0m".format(sys.version))
     sys.exit(1)
 
-def open_browser():
-    webbrowser.open('http://127.0.0.1:8000')
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="启动本地智能文档问答助手")
+    parser.add_argument("--prod", action="store_true", help="生产模式：多个工作进程，不自动重载，不打开浏览器")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_WORKERS", "2")), help="生产模式的Web工作进程数")
+    parser.add_argument("--host", default=None, help="监听地址，开发模式默认127.0.0.1，生产模式默认0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--embedding-server", action="store_true",
+        help="同时启动嵌入服务，各工作进程通过Unix socket共用一份模型（仅Linux/Mac）"
+    )
+    parser.add_argument(
+        "--embedded-chroma", action="store_true",
+        help="不启动ChromaDB服务，各进程直接打开db/chroma_db（向量按版本分collection存储）"
+    )
+    parser.add_argument("--import-report", action="store_true", help="输出按包汇总的导入耗时后退出")
+    return parser.parse_args(argv)
+
+def open_browser(port: int):
+    webbrowser.open(f'http://127.0.0.1:{port}')
+
+def start_embedding_server():
+    """启动嵌入服务子进程，并让Web工作进程（继承环境变量）通过其socket编码"""
+    from app.config import DATA_DIR, EMBEDDING_SERVER_SOCKET
+
+    socket_path = EMBEDDING_SERVER_SOCKET or str(DATA_DIR / "embedding.sock")
+    os.environ["EMBEDDING_SERVER_SOCKET"] = socket_path
+    return subprocess.Popen([sys.executable, "-m", "scripts.embedding_server", "--socket", socket_path])
 
 if __name__ == "__main__":
+    args = parse_args()
+    if args.import_report:
+        from scripts.startup_report import main as startup_report
+        sys.exit(startup_report([]))
+
     # 确保必要的目录存在
     os.makedirs('db/chroma_db', exist_ok=True)
     os.makedirs('docs_storage', exist_ok=True)
-    
-    # 3秒后自动打开浏览器
-    Timer(3, open_browser).start()
-    
-    # 启动应用
-    uvicorn.run("app.main:app", host="127.0.0.1", port=8000, reload=True) 
\ No newline at end of file
+
+    # 已指定外部ChromaDB服务或选择嵌入模式时不启动
+    chroma_server = None
+    if not args.embedded_chroma and not os.getenv("CHROMA_SERVER_URL"):
+        from scripts.chroma_server import start_background
+        chroma_server = start_background()
+    embedding_server = start_embedding_server() if args.embedding_server else None
+    try:
+        if args.prod:
+            # 入库工作进程和定时回收只在其中一个工作进程中启动（见app.main的文件锁）
+            uvicorn.run(
+                "app.main:app",
+                host=args.host or "0.0.0.0",
+                port=args.port,
+                workers=args.workers,
+                reload=False
+            )
+        else:
+            # 3秒后自动打开浏览器
+            Timer(3, open_browser, args=(args.port,)).start()
+
+            # 启动应用
+            uvicorn.run("app.main:app", host=args.host or "127.0.0.1", port=args.port, reload=True)
+    finally:
+        for server in (embedding_server, chroma_server):
+            if server is not None:
+                server.terminate()
+                server.wait(10)
@@ -0,0 +1,73 @@
+"""
+启动ChromaDB服务：由这一个进程持有 db/chroma_db，Web工作进程、入库工作进程和脚本设置
+CHROMA_SERVER_URL 后都通过HTTP读写同一份向量数据（分片布局必须如此，见VECTOR_LAYOUT）
+
+    python -m scripts.chroma_server                  # 监听 127.0.0.1:CHROMA_SERVER_PORT（默认8001）
+    python -m scripts.chroma_server --port 8101 --path /data/chroma_db
+
+run.py和 python -m app.main 默认会用start_background启动该服务并为应用进程设置CHROMA_SERVER_URL
+除ChromaDB自身的接口外，POST /api/v1/maintenance/vacuum 在服务进程内整理chroma.sqlite3（存储回收时调用）
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+import urllib.request
+
+def start_background(timeout: float = 60):
+    """
+    启动ChromaDB服务子进程并等待其就绪，之后启动的Web工作进程和入库工作进程（继承环境变量）都通过它读写向量
+    不导入app.config，调用方在导入应用之前设置好CHROMA_SERVER_URL，在同一进程内运行的应用也能读到
+    """
+    port = int(os.getenv("CHROMA_SERVER_PORT", "8001"))
+    url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen([sys.executable, "-m", "scripts.chroma_server", "--port", str(port)])
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f"{url}/api/v1/heartbeat", timeout=2):
+                break
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError(f"ChromaDB服务启动失败（端口 {port}）")
+            time.sleep(0.5)
+    os.environ["CHROMA_SERVER_URL"] = url
+    return process
+
+def create_app():
+    """ChromaDB的服务端应用，加上整理数据库文件的接口（数据文件只由本进程打开）"""
+    from chromadb.app import app
+    from app.services.vector_store import vacuum_chroma_file
+
+    @app.post("/api/v1/maintenance/vacuum")
+    def vacuum():
+        return {"compacted": vacuum_chroma_file(os.environ["PERSIST_DIRECTORY"])}
+
+    return app
+
+def parse_args(argv=None):
+    from app.config import CHROMA_DB_PATH, CHROMA_SERVER_PORT
+
+    parser = argparse.ArgumentParser(description="ChromaDB服务")
+    parser.add_argument("--path", default=str(CHROMA_DB_PATH), help="ChromaDB数据目录")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=CHROMA_SERVER_PORT)
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    os.makedirs(args.path, exist_ok=True)
+
+    # chromadb.app在导入时按环境变量创建持久化的服务端实例（create_app中导入）
+    os.environ["IS_PERSISTENT"] = "TRUE"
+    os.environ["PERSIST_DIRECTORY"] = args.path
+    os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+    import uvicorn
+    uvicorn.run("scripts.chroma_server:create_app", factory=True, host=args.host, port=args.port, workers=1, log_level="warning")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""
+启动本地嵌入服务：加载一次嵌入模型，通过Unix socket为Web工作进程和入库工作进程编码（仅Linux/Mac）
+
+    python -m scripts.embedding_server                       # 监听 EMBEDDING_SERVER_SOCKET 或 db/embedding.sock
+    python -m scripts.embedding_server --socket /run/chatdoc/embedding.sock
+
+服务端按EMBEDDING_BACKEND加载模型；应用进程设置相同的 EMBEDDING_SERVER_SOCKET 后不再各自加载模型
+"""
+import sys
+import signal
+import logging
+import argparse
+import threading
+
+def parse_args(argv=None):
+    from app.config import DATA_DIR, EMBEDDING_SERVER_SOCKET
+
+    parser = argparse.ArgumentParser(description="本地嵌入服务")
+    parser.add_argument(
+        "--socket", default=EMBEDDING_SERVER_SOCKET or str(DATA_DIR / "embedding.sock"), help="Unix socket路径"
+    )
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    from app.config import EMBEDDING_BACKEND
+    from app.services.embeddings import create_embed_model
+    from app.services.embedding_server import EmbeddingServer, tokenizer_source
+
+    embed_model = create_embed_model(server_socket="")
+    embed_model.get_text_embedding("预热")
+    server = EmbeddingServer(embed_model, args.socket, tokenizer=tokenizer_source(EMBEDDING_BACKEND))
+
+    # serve_forever阻塞主线程，收到信号后在另一个线程中关闭
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
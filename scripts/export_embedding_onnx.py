@@ -0,0 +1,155 @@
+"""
+将嵌入模型导出为ONNX（fp32和int8动态量化），并与PyTorch fp32模型的向量核对
+
+    python -m scripts.export_embedding_onnx                  # 导出到EMBEDDING_ONNX_PATH并核对
+    python -m scripts.export_embedding_onnx --samples 1000 --variants int8
+
+核对文本取自已入库文档的内容块（没有数据时使用内置示例），结果写入导出目录的validation.json：
+逐条余弦相似度、以候选模型编码问题在fp32向量中检索的top-k重合率，以及两者的编码吞吐
+最低余弦相似度低于EMBEDDING_MIN_COSINE的模型不会被 EMBEDDING_BACKEND=onnx 加载
+需要安装torch、transformers和onnxruntime
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+
+_FALLBACK_TEXTS = [
+    "本合同自双方签字盖章之日起生效，有效期为三年。",
+    "乙方应在收到货物后七个工作日内完成验收，并书面通知甲方。",
+    "产品A的单价为每件120元，含税，运费由甲方承担。",
+    "如遇不可抗力，受影响的一方应及时通知对方，并在十五日内提供证明。",
+    "第三条 付款方式：预付30%，验收合格后支付剩余70%。",
+    "设备保修期为十二个月，自安装调试完成之日起计算。",
+    "技术参数：额定电压220V，额定功率1500W，防护等级IP54。",
+    "未经对方书面同意，任何一方不得向第三方披露本协议内容。",
+    "The warranty does not cover damage caused by improper installation.",
+    "零件号 GB/T 5783-2016 M8x30 六角头螺栓，数量200件。"
+]
+
+def parse_args(argv=None):
+    from app.config import EMBEDDING_ONNX_PATH, EMBEDDING_MIN_COSINE
+
+    parser = argparse.ArgumentParser(description="导出并核对ONNX嵌入模型")
+    parser.add_argument("--output", default=str(EMBEDDING_ONNX_PATH), help="导出目录")
+    parser.add_argument("--variants", nargs="+", choices=("fp32", "int8"), default=["fp32", "int8"])
+    parser.add_argument("--samples", type=int, default=500, help="核对使用的文本数")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--min-cosine", type=float, default=EMBEDDING_MIN_COSINE)
+    parser.add_argument("--opset", type=int, default=14)
+    parser.add_argument("--skip-export", action="store_true", help="只核对已导出的模型")
+    return parser.parse_args(argv)
+
+def sample_texts(limit: int) -> list:
+    """从已入库的内容块中取核对文本，没有数据时使用内置示例"""
+    from sqlalchemy import func
+    from app.models.database import SessionLocal, DocumentBlock
+
+    try:
+        with SessionLocal() as db:
+            rows = db.query(DocumentBlock.content).filter(
+                func.length(DocumentBlock.content) > 4
+            ).distinct().limit(limit).all()
+            texts = [row.content for row in rows]
+    except Exception as e:
+        logging.warning(f"读取内容块失败，使用内置示例: {str(e)}")
+        texts = []
+    return texts or _FALLBACK_TEXTS[:limit]
+
+def export(output: str, variants, opset: int):
+    """导出fp32模型（输出last_hidden_state），再对权重做int8动态量化"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from app.config import EMBEDDING_MODEL_NAME
+    from app.services.embeddings import onnx_model_file
+
+    os.makedirs(output, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+    model = AutoModel.from_pretrained(EMBEDDING_MODEL_NAME).eval()
+    tokenizer.save_pretrained(output)
+
+    dummy = tokenizer(["导出示例文本"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    fp32_path = os.path.join(output, onnx_model_file("fp32"))
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(dummy[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                **{name: {0: "batch", 1: "sequence"} for name in input_names},
+                "last_hidden_state": {0: "batch", 1: "sequence"}
+            },
+            opset_version=opset
+        )
+    logging.info(f"已导出 {fp32_path}")
+
+    if "int8" in variants:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(output, onnx_model_file("int8"))
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        logging.info(f"已量化 {int8_path}")
+
+def encode(embed_model, texts) -> tuple:
+    """返回 (向量矩阵, 每秒编码的文本数)"""
+    import numpy as np
+
+    start = time.perf_counter()
+    vectors = np.asarray(embed_model.get_text_embedding_batch(texts), dtype=np.float32)
+    return vectors, len(texts) / (time.perf_counter() - start)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    from app.models.database import init_db
+    from app.services.embeddings import (
+        OnnxEmbedding, create_embed_model, compare_embeddings, onnx_model_file, VALIDATION_FILE
+    )
+
+    if not args.skip_export:
+        export(args.output, args.variants, args.opset)
+
+    init_db()
+    texts = sample_texts(args.samples)
+    reference, reference_rate = encode(create_embed_model("torch"), texts)
+
+    path = os.path.join(args.output, VALIDATION_FILE)
+    reports = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            reports = json.load(f)
+
+    failed = []
+    for variant in args.variants:
+        candidate, candidate_rate = encode(OnnxEmbedding(args.output, variant, min_cosine=None), texts)
+        report = compare_embeddings(reference, candidate, args.top_k)
+        report.update({
+            "model_file": onnx_model_file(variant),
+            "validated_at": datetime.now().isoformat(timespec="seconds"),
+            "min_cosine": args.min_cosine,
+            "passed": report["cosine_min"] >= args.min_cosine,
+            "texts_per_second": {"fp32_torch": round(reference_rate, 1), variant: round(candidate_rate, 1)}
+        })
+        reports[variant] = report
+        if not report["passed"]:
+            failed.append(variant)
+        print(
+            f"{variant}: 余弦相似度 最低 {report['cosine_min']} / 平均 {report['cosine_mean']}，"
+            f"recall@{args.top_k} {report[f'recall_at_{min(args.top_k, len(texts))}']}，"
+            f"吞吐 {candidate_rate:.1f} 条/s（PyTorch fp32 {reference_rate:.1f} 条/s），"
+            f"{'通过' if report['passed'] else '未通过'}"
+        )
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(reports, f, ensure_ascii=False, indent=2)
+    print(f"核对结果已写入 {path}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
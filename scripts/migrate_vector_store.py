@@ -0,0 +1,149 @@
+"""
+迁移ChromaDB中的向量：
+- --target shards（默认）：旧布局（每个版本一个 version_{id} collection）迁移到分片collection
+- --target mmap：全部版本转换为内存映射索引（VECTOR_BACKEND=mmap），按VECTOR_INDEX_DTYPE量化
+
+    python -m scripts.migrate_vector_store --dry-run    # 只列出待迁移的版本和记录数
+    python -m scripts.migrate_vector_store              # 迁移并删除旧collection
+    python -m scripts.migrate_vector_store --keep-legacy
+    python -m scripts.migrate_vector_store --target mmap
+
+迁移直接复制已有向量，不重新计算
+分片只能通过ChromaDB服务写入（CHROMA_SERVER_URL，见scripts/chroma_server.py），服务运行时也可执行；
+迁移到分片后需同时设置VECTOR_LAYOUT=sharded，否则之后入库的版本仍写入各自的collection（检索延迟的差异见该配置的说明）；
+迁移到mmap请在停止服务（包括入库工作进程）后执行
+"""
+import sys
+import json
+import logging
+import argparse
+from typing import Optional
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="迁移ChromaDB向量到分片collection或内存映射索引")
+    parser.add_argument("--target", choices=("shards", "mmap"), default="shards", help="迁移目标")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不写入")
+    parser.add_argument("--keep-legacy", action="store_true", help="迁移后保留ChromaDB中的原数据")
+    parser.add_argument("--batch-size", type=int, default=None, help="每批复制的记录数")
+    parser.add_argument("--report", help="将迁移报告写入指定的JSON文件")
+    return parser.parse_args(argv)
+
+def deleted_version_ids() -> set:
+    """已软删除的版本，迁移时写入is_deleted=1"""
+    from app.models.database import SessionLocal, DocumentVersion
+
+    try:
+        with SessionLocal() as db:
+            rows = db.query(DocumentVersion.version_id).filter(DocumentVersion.is_deleted == True).all()
+            return {row.version_id for row in rows}
+    except Exception as e:
+        logging.warning(f"读取版本删除状态失败，全部按未删除处理: {str(e)}")
+        return set()
+
+def unpurged_version_ids() -> list:
+    """未清理的版本（含软删除的版本，恢复后仍可检索）"""
+    from app.models.database import SessionLocal, DocumentVersion
+
+    with SessionLocal() as db:
+        rows = db.query(DocumentVersion.version_id).filter(
+            DocumentVersion.purged_at.is_(None)
+        ).order_by(DocumentVersion.version_id).all()
+        return [row.version_id for row in rows]
+
+def migrate_to_mmap(
+    chroma_store,
+    mmap_store,
+    version_ids,
+    deleted_versions: Optional[set] = None,
+    keep_legacy: bool = False,
+    dry_run: bool = False
+) -> list:
+    """
+    将版本的向量从ChromaDB复制到内存映射索引，核对记录数后删除ChromaDB中的数据（keep_legacy时保留）
+    记录中的删除标记不复制，deleted_versions中的版本在索引的manifest中标记为删除
+    """
+    deleted_versions = deleted_versions or set()
+    reports = []
+    for version_id in version_ids:
+        total = chroma_store.count(version_id, include_deleted=True)
+        if not total:
+            continue
+        report = {"version_id": version_id, "target": mmap_store.path_for(version_id), "records": total}
+        if dry_run:
+            reports.append(report)
+            continue
+
+        records = chroma_store.get(version_id, include=["embeddings", "documents", "metadatas"])
+        chunks = [
+            {
+                "id": record_id,
+                "text": text,
+                "metadata": {
+                    key: value for key, value in (metadata or {}).items()
+                    if key not in ("is_deleted", "live_version_id")
+                }
+            }
+            for record_id, text, metadata in zip(records["ids"], records["documents"], records["metadatas"])
+        ]
+        mmap_store.write_version(version_id, chunks, records["embeddings"])
+        if version_id in deleted_versions:
+            mmap_store.set_deleted(version_id)
+
+        copied = mmap_store.count(version_id, include_deleted=True)
+        report["copied"] = copied
+        if copied != total:
+            report["error"] = "记录数不一致，已保留ChromaDB中的数据"
+            logging.error(f"迁移版本 {version_id} 失败：ChromaDB {total} 条，索引中 {copied} 条")
+        elif not keep_legacy:
+            chroma_store.delete_version(version_id)
+            report["legacy_deleted"] = True
+        reports.append(report)
+        logging.info(f"版本 {version_id} 已转换为内存映射索引（{copied} 条）")
+    return reports
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    from app.config import CHROMA_SERVER_URL, VECTOR_MIGRATION_BATCH_SIZE
+    from app.services.vector_store import VectorStore, create_chroma_client
+
+    if args.target == "shards" and not CHROMA_SERVER_URL and not args.dry_run:
+        print("迁移到分片需要ChromaDB服务：请先启动 python -m scripts.chroma_server 并设置CHROMA_SERVER_URL", file=sys.stderr)
+        return 2
+    store = VectorStore(create_chroma_client(), layout="per_version" if args.target == "mmap" else "sharded")
+    if args.target == "mmap":
+        from app.models.database import init_db
+        from app.services.mmap_index import MmapVectorStore
+
+        init_db()
+        reports = migrate_to_mmap(
+            store,
+            MmapVectorStore(),
+            unpurged_version_ids(),
+            deleted_versions=deleted_version_ids(),
+            keep_legacy=args.keep_legacy,
+            dry_run=args.dry_run
+        )
+    else:
+        reports = store.migrate_legacy(
+            deleted_versions=deleted_version_ids(),
+            batch_size=args.batch_size or VECTOR_MIGRATION_BATCH_SIZE,
+            keep_legacy=args.keep_legacy,
+            dry_run=args.dry_run
+        )
+
+    failed = [report for report in reports if report.get("error")]
+    records = sum(report["records"] for report in reports)
+    action = "待迁移" if args.dry_run else "已迁移"
+    print(f"{action} {len(reports) - len(failed)} 个版本，共 {records} 条记录；失败 {len(failed)} 个")
+    for report in failed:
+        print(f"  版本 {report['version_id']}: {report['error']}", file=sys.stderr)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+清理软删除超过保留期的版本（原始文件、向量、倒排索引和派生数据），并整理数据库文件
+
+    python -m scripts.reclaim_storage --dry-run    # 只列出可回收的版本和文件大小
+    python -m scripts.reclaim_storage
+    python -m scripts.reclaim_storage --retention-days 7 --report reclaim.json
+    python -m scripts.reclaim_storage --vacuum     # 同时完整整理数据库文件，旧数据库切换为增量整理模式
+
+服务运行时会按 RECLAIM_INTERVAL_HOURS 自动执行，也可调用 POST /api/maintenance/reclaim（full_vacuum=true 对应 --vacuum）；
+本脚本用于停止服务后手动执行（使用ChromaDB服务时需保持该服务运行）
+"""
+import sys
+import json
+import logging
+import argparse
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="回收软删除版本占用的存储")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不删除")
+    parser.add_argument("--retention-days", type=float, default=None, help="保留期（天），默认使用VERSION_RETENTION_DAYS")
+    parser.add_argument("--report", help="将回收报告写入指定的JSON文件")
+    parser.add_argument("--vacuum", action="store_true", help="即使没有可回收的版本也整理数据库文件，旧数据库执行一次完整VACUUM")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    from app.config import VERSION_RETENTION_DAYS
+    from app.models.database import init_db
+    from app.services.vector_store import VectorStore, create_chroma_client
+    from app.services.lexical_index import LexicalIndexStore
+    from app.services.storage_reclaimer import StorageReclaimer
+
+    init_db()
+    reclaimer = StorageReclaimer(
+        VectorStore(create_chroma_client()),
+        LexicalIndexStore(),
+        retention_days=VERSION_RETENTION_DAYS if args.retention_days is None else args.retention_days
+    )
+    summary = reclaimer.run(dry_run=args.dry_run, full_vacuum=args.vacuum)
+
+    action = "可回收" if args.dry_run else "已回收"
+    print(f"{action} {len(summary['versions'])} 个版本，失败 {len(summary['failed'])} 个")
+    for report in summary["versions"]:
+        print(
+            f"  版本 {report['version_id']}（删除于 {report['deleted_at']}）：文件 {report['file_bytes']} 字节，"
+            f"向量 {report['vector_records']} 条"
+        )
+    for report in summary["failed"]:
+        print(f"  版本 {report['version_id']}: {report['error']}", file=sys.stderr)
+    reclaimed = summary["bytes_reclaimed"]
+    print(
+        f"释放：文件 {reclaimed['files']} 字节，SQLite {reclaimed['sqlite']} 字节，"
+        f"ChromaDB {reclaimed['chroma']} 字节，共 {reclaimed['total'] / 1024 / 1024:.1f} MB"
+    )
+    for store, result in summary["compaction"].items():
+        detail = result.get("method") if result["compacted"] else f"未整理（{result['reason']}）"
+        print(f"  整理{store}：{detail}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
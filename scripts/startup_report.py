@@ -0,0 +1,81 @@
+"""
+启动耗时报告：在新的解释器中以 -X importtime 导入模块，按顶层包汇总导入耗时
+
+    python -m scripts.startup_report                  # 应用入口和后台加载的文档处理器
+    python -m scripts.startup_report --module app.main --top 20 --json startup.json
+
+app.main 是Web工作进程启动时同步导入的部分；app.services.document_processor（llama_index、torch等）
+在服务启动后由后台线程导入，不阻塞启动，但决定模型就绪前的等待时间
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from collections import defaultdict
+
+DEFAULT_MODULES = ["app.main", "app.services.document_processor"]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="导入耗时报告")
+    parser.add_argument("--module", action="append", help="要导入的模块，可重复，默认app.main和文档处理器")
+    parser.add_argument("--top", type=int, default=15, help="列出耗时最多的顶层包数量")
+    parser.add_argument("--json", help="将报告写入指定的JSON文件")
+    return parser.parse_args(argv)
+
+def import_times(module: str, cwd: str):
+    """
+    返回 (总耗时秒数, [(模块名, 自身耗时秒数)], 错误信息)
+    -X importtime的输出格式：import time: self [us] | cumulative | imported package
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, capture_output=True, text=True
+    )
+    entries, total = [], 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        entries.append((name, int(self_us) / 1e6))
+        if name == module:
+            total = int(cumulative_us) / 1e6
+    error = None
+    if result.returncode != 0:
+        error = (result.stderr.strip().splitlines() or ["导入失败"])[-1]
+    return total, entries, error
+
+def summarize(module: str, cwd: str, top: int) -> dict:
+    total, entries, error = import_times(module, cwd)
+    packages = defaultdict(float)
+    for name, seconds in entries:
+        packages[name.split(".")[0]] += seconds
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "module": module,
+        "total_seconds": round(total, 3),
+        "modules_imported": len(entries),
+        "packages": [{"package": name, "seconds": round(seconds, 3)} for name, seconds in ranked[:top]],
+        "error": error
+    }
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    reports = [summarize(module, cwd, args.top) for module in (args.module or DEFAULT_MODULES)]
+
+    for report in reports:
+        print(f"\n{report['module']}：共 {report['total_seconds']:.2f}s，导入 {report['modules_imported']} 个模块")
+        if report["error"]:
+            print(f"  导入失败: {report['error']}")
+        for item in report["packages"]:
+            print(f"  {item['package']:<32}{item['seconds'] * 1000:>10.1f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+    return 1 if any(report["error"] for report in reports) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())